@@ -363,6 +363,25 @@ void loop_command_interface() {
         break;
       }
 
+      case 'i': {
+        // Identify the firmware and the board (by the flash chip's unique
+        // ID), so the host can remember what link settings work for it
+        enter_passthrough();
+        flash_start_spi(0x4B);  // Read unique ID
+        for (int i = 0; i < 4; ++i) fpga_spi_transfer(0);  // Dummy bytes
+        Serial.print("ID: arduino ");
+        for (int i = 0; i < 8; ++i) {
+          uint8_t b = fpga_spi_transfer(0);
+          if (b < 16) Serial.print("0");
+          Serial.print(b, HEX);
+        }
+        end_spi();
+        exit_passthrough();
+        Serial.println();
+        Serial.println("OK");
+        break;
+      }
+
       case 'z': {
         // Reset flash
         start_spi(6);
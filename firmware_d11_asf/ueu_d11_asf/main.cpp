@@ -225,6 +225,16 @@ volatile static uint32_t _millis = 0;
 
 static uint32_t millis() { return _millis; }
 
+// SysTick counts down from LOAD to 0 once per millisecond, at 48 MHz
+static uint32_t micros() {
+  uint32_t ms, ticks;
+  do {
+    ms = _millis;
+    ticks = SysTick->LOAD - SysTick->VAL;
+  } while (ms != _millis);
+  return ms * 1000 + ticks / 48;
+}
+
 // millisecond timer
 extern "C" void SysTick_Handler(void) {
   ++_millis;
@@ -382,6 +392,22 @@ void erase_sector(uint32_t addr) {
   flash_end_spi_after_write();
 }
 
+// Erase a 4kB sector (20h), 32kB block (52h) or 64kB block (D8h).  The
+// block erases are much quicker per byte: 45/120/150 ms typical on the
+// W25Q128JV.
+void erase_block(uint32_t addr, uint32_t size) {
+  flash_write_enable();
+  if (size == 65536L) {
+    flash_start_spi(0xD8);  // 64kB block erase
+  } else if (size == 32768L) {
+    flash_start_spi(0x52);  // 32kB block erase
+  } else {
+    flash_start_spi(0x20);  // Sector erase
+  }
+  flash_send_24bit_addr(addr);
+  flash_end_spi_after_write();
+}
+
 bool online_waiting = false;
 bool online = false;
 long when_online = 0;
@@ -428,7 +454,8 @@ int read_line_to_page_buf() {
 }
 
 // Request 4096 byte blocks from the serial port, and erase/program flash as appropriate.
-void program_range(uint32_t start_addr, uint32_t end_addr) {
+// With erase = false, the host has already erased the range (see the 'E' command).
+void program_range(uint32_t start_addr, uint32_t end_addr, bool erase = true) {
     for (uint32_t sector = start_addr; sector < end_addr; sector += SECTOR_SIZE) {
       if (!serial_dtr()) goto programming_error;
 
@@ -440,10 +467,12 @@ void program_range(uint32_t start_addr, uint32_t end_addr) {
       serial_println();
 
       // Then erase the sector
-      serial_print("Erase at ");
-      serial_print_hex(sector);
-      serial_println();
-      erase_sector(sector);
+      if (erase) {
+        serial_print("Erase at ");
+        serial_print_hex(sector);
+        serial_println();
+        erase_sector(sector);
+      }
 
       // Now program all the 256 byte blocks inside the sector
       for (uint32_t addr = sector; addr < sector + SECTOR_SIZE; addr += 256L) {
@@ -701,6 +730,59 @@ void loop_command_interface() {
         break;
       }
 
+      case 'i': {
+        // Identify the firmware and the board (by the flash chip's unique
+        // ID), so the host can remember what link settings work for it
+        enter_passthrough();
+        flash_start_spi(0x4B);  // Read unique ID
+        for (int i = 0; i < 4; ++i) fpga_spi_transfer(0);  // Dummy bytes
+        serial_print("ID: asf ");
+        for (int i = 0; i < 8; ++i) serial_print_hex(fpga_spi_transfer(0), 2);
+        end_spi();
+        exit_passthrough();
+        serial_println();
+        serial_println("OK");
+        break;
+      }
+
+      case 'b': {
+        // Stream boundary scan snapshots until the host sends anything.  To
+        // save link bandwidth, a record only goes out when the vector
+        // changes (or every 65535 samples, as a keepalive):
+        //   B5, micros() (4 bytes LE), samples since last record (2 bytes
+        //   LE), boundary vector (6 bytes, starting with AA)
+        serial_println("SCAN:");
+        uint8_t rec[13] = {0xB5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0};
+        uint16_t samples = 0;
+        while (serial_dtr() && !serial_available()) {
+          uint32_t now = micros();
+          start_spi(5);
+          fpga_spi_transfer(0);  // 55, sent while the FPGA loads the vector
+          bool changed = false;
+          for (int i = 7; i < 13; ++i) {
+            uint8_t b = fpga_spi_transfer(0);
+            if (b != rec[i]) changed = true;
+            rec[i] = b;
+          }
+          end_spi();
+          ++samples;
+          if (changed || samples == 0xffff) {
+            rec[1] = (uint8_t)now; rec[2] = (uint8_t)(now >> 8);
+            rec[3] = (uint8_t)(now >> 16); rec[4] = (uint8_t)(now >> 24);
+            rec[5] = (uint8_t)samples; rec[6] = (uint8_t)(samples >> 8);
+            serial_write(rec, 13);
+            samples = 0;
+          }
+          // Only sends if the last transfer is done, so records queue up
+          // rather than holding up sampling
+          serial_flush();
+        }
+        if (serial_available()) serial_read();  // whatever stopped us
+        serial_println();
+        serial_println("OK");
+        break;
+      }
+
       case 'z': {
         // Reset flash
         start_spi(6);
@@ -798,6 +880,41 @@ void loop_command_interface() {
         break;
       }
 
+      case 'w': {
+        serial_println("write erased range: enter start+len<CR>");
+
+        uint32_t start_addr, end_addr;
+        if (read_start_and_range(&start_addr, &end_addr) < 0) break;
+
+        enter_passthrough();
+        program_range(start_addr, end_addr, false);
+        exit_passthrough();
+        break;
+      }
+
+      case 'E': {
+        serial_println("erase block: enter start+len<CR> (len 4096, 32768 or 65536)");
+
+        uint32_t start_addr, end_addr;
+        if (read_start_and_range(&start_addr, &end_addr) < 0) break;
+
+        uint32_t size = end_addr - start_addr;
+        if (size != SECTOR_SIZE && size != 32768L && size != 65536L) {
+          serial_println("ERR length must be 4096, 32768 or 65536");
+          break;
+        }
+        if (start_addr & (size - 1)) {
+          serial_println("ERR start addr must be aligned to the length");
+          break;
+        }
+
+        enter_passthrough();
+        erase_block(start_addr, size);
+        exit_passthrough();
+        serial_println("OK");
+        break;
+      }
+
       case 'P': {
         serial_println("Program 64kB from serial port");
         enter_passthrough();
@@ -0,0 +1,100 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# This source file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This source file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# --------------
+# board_variants
+# --------------
+
+# Variants of max10_electron_ula.py.  The script builds the variant named in
+# $BOARD_VARIANT (default v1, the board that was ordered) and writes its
+# outputs into $BOARD_OUTPUT_DIR (default: the current directory, as before).
+#
+# common/build_variants.py builds several of these side by side:
+#
+#   python common/build_variants.py max10_electron_ula.py   (or: make variants)
+
+import os
+
+LVTH_BUFFER = (
+    "74LVTH162245ZRDR",
+    "IC buffer 16-bit; https://www.digikey.com/product-detail/en/texas-instruments/74LVTH162245ZRDR/296-16878-1-ND",
+)
+# Same ZRD pinout as the LVTH part, but no bus hold and no 22R outputs
+LVC_BUFFER = (
+    "74LVC16245AZRDR",
+    "IC buffer 16-bit; https://www.digikey.com/products/en?keywords=74LVC16245AZRDR",
+)
+
+class Variant:
+    def __init__(self, name, desc, layers=4, buffers=None,
+                 electron_pullups=False, cas_in_pullup=False):
+        self.name = name
+        self.desc = desc
+        # Copper layers, for the fab outputs (see LAYERS in Makefile.pcb)
+        self.layers = layers
+        # {buffer identifier: (value, desc)}
+        self.buffers = {"ABUF": LVTH_BUFFER, "DBUF": LVTH_BUFFER}
+        self.buffers.update(buffers or {})
+        # 10k pullups to 5V on nNMI_5V, nIRQ_5V and KBD*_5V
+        self.electron_pullups = electron_pullups
+        # 10k from CAS_IN_5V to CAS_IN_divider, plus an optional cap
+        self.cas_in_pullup = cas_in_pullup
+
+    def derive(self, name, desc, **changes):
+        """A copy of this variant with some settings changed."""
+        variant = Variant(name, desc, self.layers, dict(self.buffers),
+                          self.electron_pullups, self.cas_in_pullup)
+        for key, value in changes.items():
+            if not hasattr(variant, key):
+                raise ValueError("Unknown variant setting %s" % key)
+            setattr(variant, key, value)
+        return variant
+
+V1 = Variant("v1", "as ordered from JLCPCB on 2019-05-15")
+V2 = V1.derive("v2", "v1 plus the TODO(v2) CRITICAL fixes",
+               buffers={"ABUF": LVTH_BUFFER, "DBUF": LVC_BUFFER},
+               electron_pullups=True,
+               cas_in_pullup=True)
+
+# In build order; the first is the base the others are compared against
+VARIANTS = [
+    V1,
+    V2,
+    V2.derive("v2-2layer", "v2 on a two layer board", layers=2),
+]
+
+DEFAULT_VARIANT = "v1"
+
+def get(name):
+    for variant in VARIANTS:
+        if variant.name == name:
+            return variant
+    raise ValueError("Unknown board variant %s; choose from %s" % (
+        name, ", ".join(v.name for v in VARIANTS)))
+
+def current():
+    """The variant selected by $BOARD_VARIANT."""
+    return get(os.environ.get("BOARD_VARIANT") or DEFAULT_VARIANT)
+
+def output_path(fn):
+    """Where the selected variant's copy of an output file goes."""
+    return os.path.join(os.environ.get("BOARD_OUTPUT_DIR") or ".", fn)
+
+def building_variant():
+    """True when writing into a variant directory rather than the usual
+    outputs next to the script (and in ../altera)."""
+    return bool(os.environ.get("BOARD_OUTPUT_DIR"))
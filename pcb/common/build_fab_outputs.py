@@ -13,48 +13,57 @@ from __future__ import print_function
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# Plots gerbers and the drill file for a board.  Each layer (and the drill
+# set) is a separate job in a pool of worker processes, each with its own
+# copy of the board.  Outputs are cached in .fab_cache/<hash>, keyed on the
+# board file and everything that affects the plot, so rerunning on an
+# unchanged board just copies the previous outputs.  Only the CACHE_ENTRIES
+# most recently used entries are kept.
+
 from glob import glob
+import hashlib
+import multiprocessing
 import os
 from pcbnew import *
+import shutil
 import sys
+import time
 
 layer_count = int(os.environ['LAYERS'])
 
-def generate_outputs(fn, fab_output_path, preview_output_path):
-
-    # Open the .kicad_pcb file
-    board = LoadBoard(fn)
-
-    # Set up the PLOT_CONTROLLER, which generates the gerber files
-    plotter = PLOT_CONTROLLER(board)
-
-    options = plotter.GetPlotOptions()
-    options.SetOutputDirectory(fab_output_path)
-
-    options.SetPlotFrameRef(False)
-    options.SetPlotPadsOnSilkLayer(False)
-    options.SetPlotValue(True)
-    options.SetPlotReference(True)
-    options.SetPlotInvisibleText(False)
-    options.SetPlotViaOnMaskLayer(False)
-    options.SetExcludeEdgeLayer(True);
-    options.SetMirror(False)
-    options.SetNegative(False)
-    options.SetUseAuxOrigin(False)
-
-    options.SetUseGerberProtelExtensions(True)
-    options.SetUseGerberAttributes(False)
-    options.SetSubtractMaskFromSilk(False)
-
-    options.SetFormat(PLOT_FORMAT_GERBER)
-
-    options.SetDrillMarksType(PCB_PLOT_PARAMS.NO_DRILL_SHAPE)
-    options.SetScale(1)
-    options.SetPlotMode(FILLED)
-    options.SetLineWidth(FromMM(0.1))
-
+# Bump this when changing anything below that affects the output files
+CACHE_VERSION = 1
+CACHE_PATH = os.environ.get('FAB_CACHE', '.fab_cache')
+CACHE_ENTRIES = int(os.environ.get('FAB_CACHE_ENTRIES', 8))
+
+# Applied to the PLOT_CONTROLLER's options in each worker, in order
+plot_options = [
+    ("SetPlotFrameRef", False),
+    ("SetPlotPadsOnSilkLayer", False),
+    ("SetPlotValue", True),
+    ("SetPlotReference", True),
+    ("SetPlotInvisibleText", False),
+    ("SetPlotViaOnMaskLayer", False),
+    ("SetExcludeEdgeLayer", True),
+    ("SetMirror", False),
+    ("SetNegative", False),
+    ("SetUseAuxOrigin", False),
+
+    ("SetUseGerberProtelExtensions", True),
+    ("SetUseGerberAttributes", False),
+    ("SetSubtractMaskFromSilk", False),
+
+    ("SetFormat", PLOT_FORMAT_GERBER),
+
+    ("SetDrillMarksType", PCB_PLOT_PARAMS.NO_DRILL_SHAPE),
+    ("SetScale", 1),
+    ("SetPlotMode", FILLED),
+    ("SetLineWidth", FromMM(0.1)),
+]
+
+def layers_to_plot():
     # Plot everything needed for fabrication
-    layers_to_plot = [
+    layers = [
         ("F.Cu", F_Cu, "Top copper"),
         ("B.Cu", B_Cu, "Bottom copper"),
         ("F.Mask", F_Mask, "Top solder mask"),
@@ -69,60 +78,114 @@ def generate_outputs(fn, fab_output_path, preview_output_path):
         print("plotting 2 layers")
     elif layer_count == 4:
         print("plotting 4 layers")
-        layers_to_plot += [
+        layers += [
             ("In1.Cu", In1_Cu, "Internal copper 1"),
             ("In2.Cu", In2_Cu, "Internal copper 2"),
         ]
     else:
         raise Exception("invalid layer count %d" % layer_count)
-
-    for file_suffix, layer, description in layers_to_plot:
-        print("Plotting %s" % file_suffix)
+    return layers
+
+def cache_key(fn, layers):
+    h = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        h.update(f.read())
+    try:
+        version = GetBuildVersion()
+    except NameError:
+        version = "unknown"
+    h.update(repr((CACHE_VERSION, version, plot_options,
+                   [(suffix, layer) for suffix, layer, description in layers])).encode())
+    return h.hexdigest()
+
+# Per-process state for the worker pool
+_board = None
+_fab_output_path = None
+
+def _init_worker(fn, fab_output_path):
+    global _board, _fab_output_path
+    _board = LoadBoard(fn)
+    _fab_output_path = fab_output_path
+
+def _run_job(job):
+    t0 = time.time()
+    if job[0] == "drill":
+        # Generate drill file
+        drill = EXCELLON_WRITER(_board)
+        drill.SetFormat(False, EXCELLON_WRITER.DECIMAL_FORMAT)
+        drill.CreateDrillandMapFilesSet(_fab_output_path, True, False)
+        name = "drill"
+    else:
+        file_suffix, layer, description = job[1]
+        # Set up the PLOT_CONTROLLER, which generates the gerber files
+        plotter = PLOT_CONTROLLER(_board)
+        options = plotter.GetPlotOptions()
+        options.SetOutputDirectory(_fab_output_path)
+        for setter, value in plot_options:
+            getattr(options, setter)(value)
         plotter.SetLayer(layer)
         plotter.OpenPlotfile(file_suffix, PLOT_FORMAT_GERBER, description)
         plotter.PlotLayer()
-
-    # Human-viewable previews
-    # options.SetOutputDirectory(preview_output_path)
-    # for file_suffix, description, layers, mirrored in [
-    #     [
-    #         "F.Preview",
-    #         "Front preview",
-    #         [
-    #             (F_Cu, RED),
-    #             (F_SilkS, WHITE),
-    #             (Edge_Cuts, YELLOW),
-    #         ],
-    #         False,
-    #     ],
-    #     [
-    #         "B.Preview",
-    #         "Back preview",
-    #         [
-    #             (B_Cu, GREEN),
-    #             (B_SilkS, WHITE),
-    #             (Edge_Cuts, YELLOW),
-    #         ],
-    #         True,
-    #     ],
-    # ]:
-    #     options.SetMirror(mirrored)
-    #     plotter.OpenPlotfile(file_suffix, PLOT_FORMAT_SVG, description)
-    #     plotter.SetColorMode(True)
-
-    #     for layer, color in layers:
-    #         options.SetColor(color)
-    #         plotter.SetLayer(layer)
-    #         plotter.PlotLayer()
-
-    # Done with layer plots -- close the plotter so we can write drill files
-    plotter.ClosePlot()
-
-    # Generate drill file
-    drill = EXCELLON_WRITER(board)
-    drill.SetFormat(False, EXCELLON_WRITER.DECIMAL_FORMAT)
-    print("Writing drill file")
-    drill.CreateDrillandMapFilesSet(fab_output_path, True, False)
+        plotter.ClosePlot()
+        name = file_suffix
+    return name, time.time() - t0
+
+def copy_files(src, dest):
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    for path in glob(os.path.join(src, "*")):
+        shutil.copy(path, dest)
+
+def prune_cache(cache_path, keep=CACHE_ENTRIES):
+    # Drop all but the most recently used entries; scratch dirs belong to
+    # runs that may still be going
+    entries = [path for path in glob(os.path.join(cache_path, "*"))
+               if os.path.isdir(path) and ".tmp" not in os.path.basename(path)]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+def generate_outputs(fn, fab_output_path, preview_output_path, jobs=None,
+                     cache_path=CACHE_PATH):
+    t0 = time.time()
+    layers = layers_to_plot()
+    key = cache_key(fn, layers)
+    cached = os.path.join(cache_path, key)
+    if os.path.isdir(cached):
+        # Mark it recently used, for prune_cache
+        os.utime(cached, None)
+        copy_files(cached, fab_output_path)
+        print("%s unchanged; copied fab outputs from %s in %.1f s" % (
+            fn, cached, time.time() - t0))
+        return
+
+    # Plot into a scratch dir, so an interrupted run never leaves a partial
+    # cache entry
+    scratch = cached + ".tmp%d" % os.getpid()
+    if not os.path.isdir(scratch):
+        os.makedirs(scratch)
+    job_list = [("drill",)] + [("layer", layer) for layer in layers]
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(job_list)))
+    print("Plotting %d layers and drill file with %d workers" % (len(layers), jobs))
+    pool = multiprocessing.Pool(jobs, _init_worker, (os.path.abspath(fn),
+                                                     os.path.abspath(scratch)))
+    try:
+        timings = pool.map(_run_job, job_list)
+    finally:
+        pool.close()
+        pool.join()
+
+    for name, seconds in sorted(timings, key=lambda t: -t[1]):
+        print("  %-10s %6.2f s" % (name, seconds))
+    print("  %-10s %6.2f s (%.2f s of work)" % (
+        "total", time.time() - t0, sum(seconds for name, seconds in timings)))
+
+    copy_files(scratch, fab_output_path)
+    os.rename(scratch, cached)
+    prune_cache(cache_path)
 
 if __name__ == '__main__':
-    generate_outputs(sys.argv[1], 'gerber_tmp', '.')
+    generate_outputs(sys.argv[1], 'gerber_tmp', '.',
+                     jobs=int(os.environ['JOBS']) if 'JOBS' in os.environ else None)
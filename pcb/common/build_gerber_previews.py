@@ -13,65 +13,157 @@ from __future__ import print_function
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from gerber import load_layer
-from gerber.render import GerberCairoContext, RenderSettings, theme
+# Renders pcb-front.png and pcb-back.png from the gerbers and drill files,
+# using gerber_raster.py (NumPy only; no cairo or pcb-tools).
+#
+# Every layer file is rasterised in a pool of worker processes, and the
+# rasters are cached in .preview_cache (see gerber_raster.cached_raster),
+# so after a change only the layers that changed are redrawn.  The first
+# resolution given is written to pcb-front.png / pcb-back.png, and any
+# others to pcb-front-<N>dpmm.png etc.
+#
+#   python build_gerber_previews.py [gerber_tmp] [--dpmm 10 --dpmm 40]
+
+import argparse
 from glob import glob
+import multiprocessing
 import os
-import sys
-
-def generate_previews(fab_output_path, preview_output_path):
-
-    def read(pattern):
-        files = glob(os.path.join(fab_output_path, pattern))
-        if not files:
-            print("WARNING: Nothing found matching %s" % pattern)
-            return None
-        return load_layer(files[0])
-
-    def save(name):
-        path = os.path.join(preview_output_path, "%s.png" % name)
-        print("Saving preview to %s" % path)
-        ctx.dump(path)
-
-    def render(pattern, **kw):
-        layer = read(pattern)
-        if layer is None:
-            print("Not rendering %s" % pattern)
-            return
-        ctx.render_layer(layer, **kw)
-
-    # Rendering context
-    ctx = GerberCairoContext(scale=10)
-    ctx.color = (80./255, 80/255., 154/255.)
-    ctx.drill_color = ctx.color
-
-    # Edges
-    render("*.gm1")
-    # Copper
-    render("*.gtl")
-    # Mask
-    render("*.gts")
-    # Silk
-    render("*.gto", settings=RenderSettings(color=theme.COLORS['white'], alpha=0.85))
-    # Drills
-    render("*.drl")
-
-    save("pcb-front")
-    ctx.clear()
-
-    # Edges
-    render("*.gm1")
-    # Copper
-    render("*.gbl")
-    # Mask
-    render("*.gbs")
-    # Silk
-    render("*.gbo", settings=RenderSettings(color=theme.COLORS['white'], alpha=0.85))
-    # Drills
-    render("*.drl")
-
-    save("pcb-back")
+import time
+
+import numpy as np
+
+import gerber_raster
+
+CACHE_PATH = os.environ.get('PREVIEW_CACHE', '.preview_cache')
+DEFAULT_DPMM = 10
+
+BOARD_COLOUR = (20, 60, 35)
+COPPER_COLOUR = (200, 165, 90)
+MASK_COLOUR = (30, 110, 70)
+MASK_ALPHA = 0.8
+SILK_COLOUR = (255, 255, 255)
+SILK_ALPHA = 0.85
+
+# (name, edge, copper, mask, silk) patterns for each side; drills go
+# through both
+SIDES = [
+    ("pcb-front", "*.gm1", "*.gtl", "*.gts", "*.gto"),
+    ("pcb-back", "*.gm1", "*.gbl", "*.gbs", "*.gbo"),
+]
+DRILLS = "*.drl"
+
+def find(fab_output_path, pattern):
+    files = sorted(glob(os.path.join(fab_output_path, pattern)))
+    if not files:
+        print("WARNING: Nothing found matching %s" % pattern)
+    return files
+
+def board_area(edge):
+    # Pixels inside the outline: between the first and last edge pixel on
+    # each row and each column, which is exact for convex boards
+    def spans(mask):
+        any_set = mask.any(axis=1)
+        first = np.argmax(mask, axis=1)
+        last = mask.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+        cols = np.arange(mask.shape[1])[None, :]
+        return any_set[:, None] & (cols >= first[:, None]) & (cols <= last[:, None])
+    return spans(edge) & spans(edge.T).T
+
+def _render_job(job):
+    # Worker: rasterise one file, or load it from the cache.  Returns packed
+    # bits, to keep the result small on the way back.
+    fn, frame, dpmm, cache_path = job
+    mask, seconds = gerber_raster.cached_raster(fn, frame, dpmm, cache_path)
+    return fn, dpmm, np.packbits(mask), seconds
+
+def generate_previews(fab_output_path, preview_output_path, dpmms=(DEFAULT_DPMM,),
+                      jobs=None, cache_path=CACHE_PATH):
+    t0 = time.time()
+
+    # All layers share the board outline's frame, so they line up
+    edges = find(fab_output_path, SIDES[0][1])
+    if edges:
+        frame = gerber_raster.bounds(gerber_raster.read_layer(edges[0]))
+    else:
+        frame = gerber_raster.union_bounds(
+            gerber_raster.bounds(gerber_raster.read_layer(fn))
+            for fn in glob(os.path.join(fab_output_path, "*.g*")))
+    if frame is None:
+        print("Nothing to render in %s" % fab_output_path)
+        return
+
+    drills = find(fab_output_path, DRILLS)
+    files = []
+    for side in SIDES:
+        for pattern in side[1:]:
+            for fn in find(fab_output_path, pattern)[:1]:
+                if fn not in files:
+                    files.append(fn)
+    files += drills
+
+    job_list = [(fn, frame, dpmm, cache_path) for dpmm in dpmms for fn in files]
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(job_list)))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_render_job, job_list)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_render_job(job) for job in job_list]
+    rasters = {}
+    drawn = 0
+    for fn, dpmm, bits, seconds in results:
+        shape = gerber_raster.frame_shape(frame, dpmm)
+        rasters[fn, dpmm] = np.unpackbits(bits)[:shape[0] * shape[1]].reshape(shape).astype(bool)
+        if seconds is not None:
+            drawn += 1
+            print("  %-40s %3d dpmm %6.2f s" % (os.path.basename(fn), dpmm, seconds))
+    print("Rasterised %d of %d layers (the rest were cached) with %d workers" % (
+        drawn, len(job_list), jobs))
+
+    for i, dpmm in enumerate(dpmms):
+        shape = gerber_raster.frame_shape(frame, dpmm)
+        empty = np.zeros(shape, dtype=bool)
+
+        def raster(pattern):
+            fns = find(fab_output_path, pattern)
+            return rasters[fns[0], dpmm] if fns else empty
+
+        holes = empty.copy()
+        for fn in drills:
+            holes |= rasters[fn, dpmm]
+        for name, edge, copper, mask, silk in SIDES:
+            board = board_area(raster(edge)) if edges else ~empty
+            image = gerber_raster.composite(shape, [
+                (board, BOARD_COLOUR, 1.0),
+                (raster(copper) & board, COPPER_COLOUR, 1.0),
+                # The mask layer has the openings; the mask is everywhere else
+                (board & ~raster(mask), MASK_COLOUR, MASK_ALPHA),
+                (raster(silk) & board, SILK_COLOUR, SILK_ALPHA),
+                (raster(edge), SILK_COLOUR, 1.0),
+                (holes, None, 0),
+            ])
+            suffix = "" if i == 0 else "-%ddpmm" % dpmm
+            path = os.path.join(preview_output_path, "%s%s.png" % (name, suffix))
+            print("Saving preview to %s" % path)
+            gerber_raster.write_png(path, image)
+    print("Previews done in %.2f s" % (time.time() - t0))
 
+def main():
+    parser = argparse.ArgumentParser(description="Render PCB previews from gerbers")
+    parser.add_argument("fab_output_path", nargs="?", default="gerber_tmp")
+    parser.add_argument("--output", default=".", help="where to write the PNGs")
+    parser.add_argument("--dpmm", type=int, action="append",
+                        help="pixels per mm; repeat for several sizes (default %d)" % DEFAULT_DPMM)
+    parser.add_argument("--jobs", type=int,
+                        default=int(os.environ['JOBS']) if 'JOBS' in os.environ else None)
+    args = parser.parse_args()
+    generate_previews(args.fab_output_path, args.output,
+                      dpmms=args.dpmm or [DEFAULT_DPMM], jobs=args.jobs)
 
 if __name__ == '__main__':
-    generate_previews('gerber_tmp', '.')
+    main()
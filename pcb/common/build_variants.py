@@ -0,0 +1,198 @@
+from __future__ import print_function
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Builds several variants of a board side by side.  The board's directory
+# needs a board_variants.py with a VARIANTS list (objects with .name, .desc
+# and .layers), and the board script has to honour two environment
+# variables:
+#
+#   BOARD_VARIANT     which variant to build
+#   BOARD_OUTPUT_DIR  where to write the netlist, BOM, pin table etc.
+#
+# Each variant runs in its own interpreter, in a pool of worker processes,
+# writing into <output>/<variant>/ with its log in build.log.  Afterwards
+# every variant is compared with the first one: netlist and BOM changes as
+# in watch_board.py, and a line count for any other output that differs
+# (the FPGA pin table, for example).  The full diffs go in
+# <output>/<base>-to-<variant>.txt.
+#
+#   python build_variants.py max10_electron_ula.py [v1 v2 ...] \
+#       [--output variants] [--jobs N]      (or: make variants)
+
+import argparse
+import difflib
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from watch_board import read_model, diff_models, plural
+
+DEFAULT_OUTPUT = "variants"
+LOG_FN = "build.log"
+MAX_LINES = 20
+
+def load_variants(script):
+    sys.path.insert(0, os.path.dirname(script))
+    import board_variants
+    return board_variants.VARIANTS
+
+def _build_job(job):
+    # Worker: run the board script for one variant.  Returns (name, ok,
+    # seconds).
+    script, name, layers, output_dir, python = job
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    env = dict(os.environ)
+    env.update(BOARD_VARIANT=name, BOARD_OUTPUT_DIR=output_dir, LAYERS=str(layers))
+    t0 = time.time()
+    with open(os.path.join(output_dir, LOG_FN), "w") as log:
+        status = subprocess.call([python, os.path.basename(script)],
+                                 cwd=os.path.dirname(script), env=env,
+                                 stdout=log, stderr=subprocess.STDOUT)
+    return name, status == 0, time.time() - t0
+
+def read_lines(fn):
+    with open(fn) as f:
+        return f.read().splitlines()
+
+def compare_outputs(base_dir, other_dir, skip):
+    """Returns [(file name, changed line count or None if only on one side,
+    unified diff lines)] for plain outputs other than those in skip."""
+    names = set(os.listdir(base_dir)) | set(os.listdir(other_dir))
+    result = []
+    for name in sorted(names - set(skip)):
+        a = os.path.join(base_dir, name)
+        b = os.path.join(other_dir, name)
+        if not (os.path.isfile(a) and os.path.isfile(b)):
+            result.append((name, None, []))
+            continue
+        lines = list(difflib.unified_diff(read_lines(a), read_lines(b), lineterm="",
+                                          fromfile=a, tofile=b))
+        if lines:
+            changed = sum(1 for line in lines[2:] if line[:1] in "+-")
+            result.append((name, changed, lines))
+    return result
+
+def build_variants(script, names=None, output_path=DEFAULT_OUTPUT, jobs=None,
+                   python=sys.executable, netlist=None, bom="bill_of_materials.txt"):
+    """Builds the variants (all of them if names is empty), and prints a
+    summary and the differences from the first one.  Returns True if they
+    all built."""
+    t0 = time.time()
+    script = os.path.abspath(script)
+    variants = load_variants(script)
+    if names:
+        by_name = dict((v.name, v) for v in variants)
+        unknown = [n for n in names if n not in by_name]
+        if unknown:
+            print("Unknown variant%s %s; choose from %s" % (
+                "" if len(unknown) == 1 else "s", ", ".join(unknown),
+                ", ".join(v.name for v in variants)))
+            return False
+        variants = [by_name[n] for n in names]
+    netlist = netlist or os.path.splitext(os.path.basename(script))[0] + ".net"
+    output_path = os.path.abspath(output_path)
+
+    job_list = [(script, v.name, v.layers, os.path.join(output_path, v.name), python)
+                for v in variants]
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(job_list)))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_build_job, job_list)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_build_job(job) for job in job_list]
+
+    built = []
+    for variant, (name, ok, seconds) in zip(variants, results):
+        output_dir = os.path.join(output_path, name)
+        rel = os.path.relpath(output_dir)
+        if not ok:
+            print("%-12s FAILED in %.1f s; see %s" % (name, seconds, os.path.join(rel, LOG_FN)))
+            continue
+        model = read_model(os.path.join(output_dir, netlist), os.path.join(output_dir, bom))
+        print("%-12s %d layers, %s, %s, %s in %.1f s -> %s/" % (
+            name, variant.layers, plural(len(model.components), "component"),
+            plural(len(model.nets), "net"), plural(sum(model.bom.values()), "BOM line"),
+            seconds, rel))
+        built.append((variant, output_dir, model))
+
+    if len(built) > 1:
+        base, base_dir, base_model = built[0]
+        for variant, output_dir, model in built[1:]:
+            print()
+            print("%s -> %s (%s):" % (base.name, variant.name, variant.desc))
+            lines = diff_models(base_model, model)
+            if variant.layers != base.layers:
+                lines.insert(0, "~ layers %d -> %d" % (base.layers, variant.layers))
+            others = compare_outputs(base_dir, output_dir, (netlist, bom, LOG_FN))
+            for line in lines[:MAX_LINES]:
+                print("  " + line)
+            if len(lines) > MAX_LINES:
+                print("  ... and %d more changes" % (len(lines) - MAX_LINES))
+            for name, changed, _ in others:
+                if changed is None:
+                    print("  %s only built for one of them" % name)
+                else:
+                    print("  %s: %s differ" % (name, plural(changed, "line")))
+            if not lines and not others:
+                print("  no differences")
+
+            diff_fn = os.path.join(output_path, "%s-to-%s.txt" % (base.name, variant.name))
+            with open(diff_fn, "w") as f:
+                for line in lines:
+                    print(line, file=f)
+                for name, changed, diff_lines in others:
+                    for line in diff_lines:
+                        print(line, file=f)
+            print("  (full diff in %s)" % os.path.relpath(diff_fn))
+
+    print()
+    print("Built %d of %d variants with %d workers in %.1f s" % (
+        len(built), len(variants), jobs, time.time() - t0))
+    return len(built) == len(variants)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build several variants of a board")
+    parser.add_argument("script", help="board script, e.g. max10_electron_ula.py")
+    parser.add_argument("variants", nargs="*",
+                        help="variants to build (default all in board_variants.py); "
+                             "the first is the base for the diffs")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT,
+                        help="directory for the variant directories (default %(default)s)")
+    parser.add_argument("--netlist", help="netlist the script writes (default <script>.net)")
+    parser.add_argument("--bom", default="bill_of_materials.txt",
+                        help="BOM the script writes (default %(default)s)")
+    parser.add_argument("--python", default=sys.executable,
+                        help="interpreter to run the script with")
+    parser.add_argument("--jobs", type=int,
+                        default=int(os.environ['JOBS']) if 'JOBS' in os.environ else None)
+    args = parser.parse_args()
+    ok = build_variants(args.script, args.variants, args.output, args.jobs,
+                        args.python, args.netlist, args.bom)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+from __future__ import print_function
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Visual diff between two sets of fab outputs (zip files or directories of
+# gerbers and drill files), e.g. a freshly plotted board against the zip
+# that was last sent off for manufacture.
+#
+# Layers are matched by the part of the file name after the last "-"
+# (F.Cu.gtl, PTH.drl...), rasterised into a common frame with
+# gerber_raster.py, and XORed.  For each layer that changed, this writes
+# <output>/<layer>.png (unchanged artwork grey, removed red, added green)
+# and prints the changed area and the bounding box of each changed patch
+# (in KiCad coordinates, with y down).
+#
+#   python gerber_diff.py max10_electron_ula_v1_jlcpcb_2019-05-15.zip \
+#       max10_electron_ula.zip [--output fab_diff] [--dpmm 10]
+#
+# The exit status is 0 if nothing changed, 1 if something did (and 2 for
+# layers that only exist on one side).
+
+import argparse
+from glob import glob
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import zipfile
+
+import numpy as np
+
+import gerber_raster
+
+CACHE_PATH = os.environ.get('PREVIEW_CACHE', '.preview_cache')
+DEFAULT_DPMM = 10
+
+# Changes are grouped into patches on a grid of this size
+CELL_MM = 1.0
+
+UNCHANGED_COLOUR = (90, 90, 90)
+REMOVED_COLOUR = (230, 40, 40)
+ADDED_COLOUR = (40, 200, 40)
+
+EXTENSIONS = (".gtl", ".gbl", ".gts", ".gbs", ".gtp", ".gbp", ".gto", ".gbo",
+              ".gm1", ".drl") + tuple(".g%d" % n for n in range(1, 31))
+
+def layer_name(fn):
+    base = os.path.basename(fn)
+    return base.rsplit("-", 1)[-1]
+
+def read_fab_outputs(path):
+    """{layer name: (file name, contents)} from a zip or a directory."""
+    files = {}
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            for name in z.namelist():
+                if name.lower().endswith(EXTENSIONS):
+                    files[layer_name(name)] = (name, z.read(name))
+    else:
+        for fn in glob(os.path.join(path, "*")):
+            if fn.lower().endswith(EXTENSIONS):
+                with open(fn, "rb") as f:
+                    files[layer_name(fn)] = (fn, f.read())
+    return files
+
+def frame_for(*sets):
+    # Union of the board outlines (or of everything, if there aren't any)
+    frames = []
+    for files in sets:
+        edges = [k for k in files if k.endswith(".gm1")]
+        keys = edges or list(files)
+        for k in keys:
+            fn, data = files[k]
+            frames.append(gerber_raster.bounds(gerber_raster.read_layer(fn, data.decode("latin-1"))))
+    return gerber_raster.union_bounds(frames, margin=0.5)
+
+def _render_job(job):
+    name, side, fn, data, frame, dpmm, cache_path = job
+    mask, seconds = gerber_raster.cached_raster(fn, frame, dpmm, cache_path, data)
+    return name, side, np.packbits(mask), seconds
+
+def patches(changed, dpmm, frame, cell_mm=CELL_MM):
+    """Groups changed pixels into patches of touching grid cells.  Returns
+    [(xmin, ymin, xmax, ymax, area in mm^2)], biggest first."""
+    cell = max(1, int(round(cell_mm * dpmm)))
+    h, w = changed.shape
+    ch, cw = -(-h // cell), -(-w // cell)
+    padded = np.zeros((ch * cell, cw * cell), dtype=bool)
+    padded[:h, :w] = changed
+    counts = padded.reshape(ch, cell, cw, cell).sum(axis=(1, 3))
+    occupied = set(zip(*np.nonzero(counts)))
+
+    xmin, ymin, xmax, ymax = frame
+    result = []
+    while occupied:
+        # Flood fill over 8-connected cells
+        stack = [occupied.pop()]
+        cells = []
+        while stack:
+            r, c = stack.pop()
+            cells.append((r, c))
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    n = (r + dr, c + dc)
+                    if n in occupied:
+                        occupied.remove(n)
+                        stack.append(n)
+        rows = [r for r, c in cells]
+        cols = [c for r, c in cells]
+        r0, r1 = min(rows) * cell, (max(rows) + 1) * cell
+        c0, c1 = min(cols) * cell, (max(cols) + 1) * cell
+        # Tighten the box to the changed pixels themselves
+        window = padded[r0:r1, c0:c1]
+        rr = np.nonzero(window.any(axis=1))[0]
+        cc = np.nonzero(window.any(axis=0))[0]
+        top, bottom = r0 + rr[0], r0 + rr[-1] + 1
+        left, right = c0 + cc[0], c0 + cc[-1] + 1
+        area = sum(counts[r, c] for r, c in cells) / float(dpmm * dpmm)
+        result.append((xmin + left / float(dpmm), ymax - bottom / float(dpmm),
+                       xmin + right / float(dpmm), ymax - top / float(dpmm), area))
+    result.sort(key=lambda p: -p[4])
+    return result
+
+def diff(old_path, new_path, output_path="fab_diff", dpmm=DEFAULT_DPMM, jobs=None,
+         cache_path=CACHE_PATH, min_area=0.0, max_patches=10):
+    """Prints the differences between two fab output sets, and writes change
+    images into output_path.  Returns the exit status (see above)."""
+    t0 = time.time()
+    old = read_fab_outputs(old_path)
+    new = read_fab_outputs(new_path)
+    if not old or not new:
+        print("No gerbers found in %s" % (new_path if old else old_path))
+        return 2
+    frame = frame_for(old, new)
+    shape = gerber_raster.frame_shape(frame, dpmm)
+
+    status = 0
+    for name in sorted(set(old) ^ set(new)):
+        print("%-16s only in %s" % (name, old_path if name in old else new_path))
+        status = 2
+    common = sorted(set(old) & set(new))
+    job_list = []
+    for name in common:
+        if old[name][1] == new[name][1]:
+            continue  # byte for byte identical
+        for side, files in (("old", old), ("new", new)):
+            fn, data = files[name]
+            job_list.append((name, side, fn, data, frame, dpmm, cache_path))
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(job_list) or 1))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_render_job, job_list)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_render_job(job) for job in job_list]
+    rasters = {}
+    for name, side, bits, seconds in results:
+        rasters[name, side] = np.unpackbits(bits)[:shape[0] * shape[1]].reshape(shape).astype(bool)
+
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    changed_layers = 0
+    print("Comparing %s (old) with %s (new) at %d px/mm" % (old_path, new_path, dpmm))
+    for name in common:
+        if (name, "old") not in rasters:
+            print("  %-16s identical" % name)
+            continue
+        before = rasters[name, "old"]
+        after = rasters[name, "new"]
+        removed = before & ~after
+        added = after & ~before
+        changed = removed | added
+        found = [p for p in patches(changed, dpmm, frame) if p[4] >= min_area]
+        if not found:
+            print("  %-16s no visible change" % name)
+            continue
+        changed_layers += 1
+        px_area = 1.0 / (dpmm * dpmm)
+        print("  %-16s changed %.2f mm^2 (+%.2f -%.2f) in %d place%s" % (
+            name, changed.sum() * px_area, added.sum() * px_area, removed.sum() * px_area,
+            len(found), "" if len(found) == 1 else "s"))
+        for x0, y0, x1, y1, area in found[:max_patches]:
+            print("      %.2f mm^2 in (%.2f, %.2f) - (%.2f, %.2f)" % (area, x0, -y1, x1, -y0))
+        if len(found) > max_patches:
+            print("      ... and %d more" % (len(found) - max_patches))
+
+        if not os.path.isdir(output_path):
+            os.makedirs(output_path)
+        image = gerber_raster.composite(shape, [
+            (before & after, UNCHANGED_COLOUR, 1.0),
+            (removed, REMOVED_COLOUR, 1.0),
+            (added, ADDED_COLOUR, 1.0),
+        ], background=(255, 255, 255, 255))
+        gerber_raster.write_png(os.path.join(output_path, name + ".png"), image)
+    if changed_layers:
+        print("%d layer%s changed; see %s/" % (
+            changed_layers, "" if changed_layers == 1 else "s", output_path))
+        status = status or 1
+    else:
+        print("No changes")
+    print("Diffed in %.2f s" % (time.time() - t0))
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description="Visual diff between two sets of gerbers")
+    parser.add_argument("old", help="zip or directory, e.g. the last fab order")
+    parser.add_argument("new", help="zip or directory, e.g. gerber_tmp")
+    parser.add_argument("--output", default="fab_diff", help="where to write change images")
+    parser.add_argument("--dpmm", type=int, default=DEFAULT_DPMM,
+                        help="pixels per mm (default %(default)d)")
+    parser.add_argument("--min-area", type=float, default=0.0,
+                        help="ignore patches smaller than this many mm^2")
+    parser.add_argument("--jobs", type=int,
+                        default=int(os.environ['JOBS']) if 'JOBS' in os.environ else None)
+    args = parser.parse_args()
+    sys.exit(diff(args.old, args.new, args.output, args.dpmm, args.jobs,
+                  min_area=args.min_area))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,484 @@
+from __future__ import print_function
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Minimal gerber (RS-274X) and Excellon reader and NumPy rasteriser, for
+# previews and diffs of the fab outputs KiCad writes.
+#
+# Supported: %FS, %MO, %AD with C/R/O/P apertures (hole sizes are ignored),
+# %LP, G01/G02/G03, G74/G75, G36/G37 regions, D01/D02/D03, and Excellon
+# drill files with tool definitions, INCH/METRIC and G85 slots.  Aperture
+# macros (%AM) aren't; KiCad 5 doesn't use them for anything we plot.
+#
+# Everything is in mm, with y up, as in the gerber.  Rendering stamps a
+# precomputed aperture kernel at every flash and at half pixel steps along
+# every stroke (so a whole layer's worth of strokes with one aperture is a
+# single fancy indexing operation), and fills regions with a vectorised
+# even-odd scanline.
+#
+#   layer = gerber_raster.read_layer("board-F.Cu.gtl")
+#   frame = gerber_raster.bounds(layer)
+#   mask = gerber_raster.rasterise(layer, frame, dpmm=10)  # 2D bool array
+#   gerber_raster.write_png("out.png", rgba_array)
+
+import hashlib
+import math
+import os
+import re
+import struct
+import time
+import zlib
+
+import numpy as np
+
+# Maximum distance between an arc and the chords approximating it
+ARC_TOLERANCE_MM = 0.005
+
+# Bump this when changing anything that affects rendered rasters
+CACHE_VERSION = 1
+
+# Limit on temporary array sizes (elements) when rendering
+CHUNK_ELEMENTS = 1 << 22
+
+class Level:
+    # A run of drawing with one polarity
+    def __init__(self, dark):
+        self.dark = dark
+        self.flashes = {}   # {aperture: [(x, y)]}
+        self.strokes = {}   # {aperture: [(x1, y1, x2, y2)]}
+        self.regions = []   # [[(x, y), ...]]
+
+class Layer:
+    def __init__(self):
+        self.apertures = {}  # {code: (shape, [params in mm])}
+        self.levels = []
+
+    def level(self, dark):
+        if not self.levels or self.levels[-1].dark != dark:
+            self.levels.append(Level(dark))
+        return self.levels[-1]
+
+def arc_points(x0, y0, x1, y1, cx, cy, clockwise, full_circle):
+    # Points along an arc from (x0, y0) to (x1, y1), excluding the start
+    r = math.hypot(x0 - cx, y0 - cy)
+    a0 = math.atan2(y0 - cy, x0 - cx)
+    a1 = math.atan2(y1 - cy, x1 - cx)
+    if full_circle:
+        sweep = -2 * math.pi if clockwise else 2 * math.pi
+    else:
+        sweep = a1 - a0
+        if clockwise and sweep >= 0:
+            sweep -= 2 * math.pi
+        elif not clockwise and sweep <= 0:
+            sweep += 2 * math.pi
+    if r <= ARC_TOLERANCE_MM:
+        step = math.pi / 2
+    else:
+        step = 2 * math.acos(max(-1.0, 1 - ARC_TOLERANCE_MM / r))
+    n = max(2, int(math.ceil(abs(sweep) / step)))
+    points = [(cx + r * math.cos(a0 + sweep * i / n), cy + r * math.sin(a0 + sweep * i / n))
+              for i in range(1, n)]
+    points.append((x1, y1))
+    return points
+
+def parse_gerber(text):
+    layer = Layer()
+    int_digits, dec_digits = 4, 6
+    scale = 1.0  # to mm
+    dark = True
+    interpolation = 1
+    multi_quadrant = True
+    aperture = None
+    x = y = 0.0
+    region = None
+
+    def coord(s):
+        return int(s) / float(10 ** dec_digits) * scale
+
+    for m in re.finditer(r"%([^%]*)%|([^%*]*)\*", text):
+        ext, block = m.groups()
+        if ext is not None:
+            for cmd in ext.split("*"):
+                cmd = cmd.strip()
+                if cmd.startswith("FS"):
+                    f = re.search(r"X(\d)(\d)", cmd)
+                    int_digits, dec_digits = int(f.group(1)), int(f.group(2))
+                elif cmd.startswith("MO"):
+                    scale = 25.4 if cmd[2:4] == "IN" else 1.0
+                elif cmd.startswith("LP"):
+                    dark = cmd[2] == "D"
+                elif cmd.startswith("AD"):
+                    a = re.match(r"ADD(\d+)([A-Za-z_][\w.]*),?(.*)", cmd)
+                    if a:
+                        params = [float(p) * scale for p in a.group(3).split("X") if p]
+                        if a.group(2) == "P":
+                            # diameter, vertices, rotation: only the first is a size
+                            params[1:] = [p / scale for p in params[1:]]
+                        layer.apertures[int(a.group(1))] = (a.group(2), params)
+            continue
+
+        block = block.strip()
+        if not block or block.startswith("G04"):
+            continue
+        if block in ("M02", "M00", "M30"):
+            break
+        g = re.match(r"^G(\d+)", block)
+        if g:
+            code = int(g.group(1))
+            if code in (1, 2, 3):
+                interpolation = code
+            elif code == 74:
+                multi_quadrant = False
+            elif code == 75:
+                multi_quadrant = True
+            elif code == 36:
+                region = [(x, y)]
+            elif code == 37:
+                if region and len(region) > 2:
+                    layer.level(dark).regions.append(region)
+                region = None
+            block = block[g.end():]
+            if code == 54:
+                pass  # aperture select prefix; the D code follows
+        d = re.match(r"^(?:X([+-]?\d+))?(?:Y([+-]?\d+))?(?:I([+-]?\d+))?(?:J([+-]?\d+))?(?:D(\d+))?$",
+                     block)
+        if not d or not block:
+            continue
+        nx = coord(d.group(1)) if d.group(1) else x
+        ny = coord(d.group(2)) if d.group(2) else y
+        i = coord(d.group(3)) if d.group(3) else 0.0
+        j = coord(d.group(4)) if d.group(4) else 0.0
+        dcode = int(d.group(5)) if d.group(5) else (1 if (d.group(1) or d.group(2)) else None)
+        if dcode is None:
+            continue
+        if dcode >= 10:
+            aperture = dcode
+            continue
+        if dcode == 1:
+            if interpolation == 1:
+                points = [(nx, ny)]
+            elif multi_quadrant:
+                points = arc_points(x, y, nx, ny, x + i, y + j, interpolation == 2,
+                                    (nx, ny) == (x, y))
+            else:
+                # Single quadrant: the centre offset is unsigned; pick the
+                # sign that puts the centre equidistant from both ends.
+                best = None
+                for si in (1, -1):
+                    for sj in (1, -1):
+                        cx, cy = x + si * abs(i), y + sj * abs(j)
+                        err = abs(math.hypot(x - cx, y - cy) - math.hypot(nx - cx, ny - cy))
+                        if best is None or err < best[0]:
+                            best = (err, cx, cy)
+                points = arc_points(x, y, nx, ny, best[1], best[2], interpolation == 2, False)
+            if region is not None:
+                region.extend(points)
+            elif aperture is not None:
+                strokes = layer.level(dark).strokes.setdefault(aperture, [])
+                px, py = x, y
+                for qx, qy in points:
+                    strokes.append((px, py, qx, qy))
+                    px, py = qx, qy
+        elif dcode == 2:
+            if region is not None:
+                if len(region) > 2:
+                    layer.level(dark).regions.append(region)
+                region = [(nx, ny)]
+        elif dcode == 3 and aperture is not None:
+            layer.level(dark).flashes.setdefault(aperture, []).append((nx, ny))
+        x, y = nx, ny
+    return layer
+
+def parse_excellon(text):
+    layer = Layer()
+    scale = 25.4
+    tool = None
+    level = layer.level(True)
+    in_header = False
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(";"):
+            continue
+        if line == "M48":
+            in_header = True
+            continue
+        if line in ("%", "M95"):
+            in_header = False
+            continue
+        if line.startswith("METRIC"):
+            scale = 1.0
+            continue
+        if line.startswith("INCH"):
+            scale = 25.4
+            continue
+        t = re.match(r"^T(\d+)(?:.*?C([\d.]+))?", line)
+        if t and not line.startswith("T0"):
+            if t.group(2):
+                layer.apertures[int(t.group(1))] = ("C", [float(t.group(2)) * scale])
+            if not in_header:
+                tool = int(t.group(1))
+            continue
+        if line.startswith("T0"):
+            tool = None
+            continue
+        h = re.match(r"^X([+-]?[\d.]+)Y([+-]?[\d.]+)(?:G85X([+-]?[\d.]+)Y([+-]?[\d.]+))?$", line)
+        if h and tool is not None:
+            x, y = float(h.group(1)) * scale, float(h.group(2)) * scale
+            if h.group(3):
+                level.strokes.setdefault(tool, []).append(
+                    (x, y, float(h.group(3)) * scale, float(h.group(4)) * scale))
+            else:
+                level.flashes.setdefault(tool, []).append((x, y))
+    return layer
+
+def read_layer(fn, text=None):
+    # Parse a gerber or drill file, going by the extension
+    if text is None:
+        with open(fn) as f:
+            text = f.read()
+    if fn.lower().endswith((".drl", ".xln", ".txt")) or text.lstrip().startswith("M48"):
+        return parse_excellon(text)
+    return parse_gerber(text)
+
+def aperture_extent(aperture):
+    shape, params = aperture
+    if shape in ("R", "O"):
+        return max(params[0], params[1] if len(params) > 1 else params[0]) / 2.0
+    return params[0] / 2.0 if params else 0.0
+
+def bounds(layer):
+    """(xmin, ymin, xmax, ymax) of everything drawn, in mm, or None."""
+    xs = []
+    ys = []
+    for level in layer.levels:
+        for code, points in level.flashes.items():
+            r = aperture_extent(layer.apertures.get(code, ("C", [0])))
+            for x, y in points:
+                xs.extend((x - r, x + r))
+                ys.extend((y - r, y + r))
+        for code, strokes in level.strokes.items():
+            r = aperture_extent(layer.apertures.get(code, ("C", [0])))
+            for x1, y1, x2, y2 in strokes:
+                xs.extend((min(x1, x2) - r, max(x1, x2) + r))
+                ys.extend((min(y1, y2) - r, max(y1, y2) + r))
+        for region in level.regions:
+            xs.extend(p[0] for p in region)
+            ys.extend(p[1] for p in region)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+def union_bounds(frames, margin=0.0):
+    frames = [f for f in frames if f]
+    if not frames:
+        return None
+    return (min(f[0] for f in frames) - margin, min(f[1] for f in frames) - margin,
+            max(f[2] for f in frames) + margin, max(f[3] for f in frames) + margin)
+
+def frame_shape(frame, dpmm):
+    xmin, ymin, xmax, ymax = frame
+    return (int(math.ceil((ymax - ymin) * dpmm)), int(math.ceil((xmax - xmin) * dpmm)))
+
+def kernel(aperture, dpmm):
+    """(dy, dx) pixel offsets covered by an aperture centred on a pixel."""
+    shape, params = aperture
+    if shape == "C" or not params:
+        rx = ry = (params[0] if params else 0.0) / 2.0 * dpmm
+    else:
+        rx = params[0] / 2.0 * dpmm
+        ry = (params[1] if len(params) > 1 else params[0]) / 2.0 * dpmm
+    n = int(math.ceil(max(rx, ry)))
+    dy, dx = np.mgrid[-n:n + 1, -n:n + 1]
+    if shape == "R":
+        inside = (np.abs(dx) <= rx) & (np.abs(dy) <= ry)
+    elif shape == "O":
+        # Rectangle with semicircular ends along the long axis
+        r = min(rx, ry)
+        ax = np.clip(dx, -(rx - r), rx - r)
+        ay = np.clip(dy, -(ry - r), ry - r)
+        inside = (dx - ax) ** 2 + (dy - ay) ** 2 <= r * r
+    elif shape == "P":
+        vertices = int(params[1]) if len(params) > 1 else 3
+        rotation = math.radians(params[2]) if len(params) > 2 else 0.0
+        inside = np.ones(dx.shape, dtype=bool)
+        apothem = rx * math.cos(math.pi / vertices)
+        for k in range(vertices):
+            a = rotation + (k + 0.5) * 2 * math.pi / vertices
+            # y is flipped in the image
+            inside &= dx * math.cos(a) - dy * math.sin(a) <= apothem
+    else:
+        inside = dx ** 2 + dy ** 2 <= rx * rx
+    inside[n, n] = True
+    return dy[inside].ravel(), dx[inside].ravel()
+
+def _to_pixels(frame, dpmm, x, y):
+    xmin, ymin, xmax, ymax = frame
+    col = (np.asarray(x, dtype=float) - xmin) * dpmm
+    row = (ymax - np.asarray(y, dtype=float)) * dpmm
+    return row, col
+
+def _stamp(img, rows, cols, offsets, value):
+    # Set img at every (rows + dy, cols + dx)
+    h, w = img.shape
+    dy, dx = offsets
+    step = max(1, CHUNK_ELEMENTS // max(1, len(dy)))
+    for start in range(0, len(rows), step):
+        r = rows[start:start + step, None] + dy[None, :]
+        c = cols[start:start + step, None] + dx[None, :]
+        ok = (r >= 0) & (r < h) & (c >= 0) & (c < w)
+        img[r[ok], c[ok]] = value
+
+def _fill_region(img, rows_f, cols_f, value):
+    # Even-odd fill of one polygon given in (fractional) pixel coordinates
+    h, w = img.shape
+    y0 = rows_f
+    y1 = np.roll(rows_f, -1)
+    x0 = cols_f
+    x1 = np.roll(cols_f, -1)
+    r0 = max(0, int(math.floor(rows_f.min())))
+    r1 = min(h, int(math.ceil(rows_f.max())) + 1)
+    c0 = max(0, int(math.floor(cols_f.min())))
+    c1 = min(w, int(math.ceil(cols_f.max())) + 1)
+    if r0 >= r1 or c0 >= c1:
+        return
+    width = c1 - c0
+    dy = np.where(y1 == y0, 1.0, y1 - y0)
+    step = max(1, CHUNK_ELEMENTS // max(1, len(x0)))
+    for start in range(r0, r1, step):
+        stop = min(r1, start + step)
+        yc = np.arange(start, stop)[:, None] + 0.5
+        crosses = (y0[None, :] <= yc) != (y1[None, :] <= yc)
+        xc = x0[None, :] + (yc - y0[None, :]) * (x1 - x0)[None, :] / dy[None, :]
+        which_row, which_edge = np.nonzero(crosses)
+        col = np.clip(np.ceil(xc[which_row, which_edge] - 0.5).astype(int) - c0, 0, width)
+        counts = np.bincount(which_row * (width + 1) + col,
+                             minlength=(stop - start) * (width + 1))
+        parity = np.cumsum(counts.reshape(stop - start, width + 1)[:, :width], axis=1) & 1
+        inside = parity.astype(bool)
+        if value:
+            img[start:stop, c0:c1] |= inside
+        else:
+            img[start:stop, c0:c1] &= ~inside
+
+def rasterise(layer, frame, dpmm):
+    """Render a layer into a bool array covering frame (xmin, ymin, xmax,
+    ymax in mm) at dpmm pixels per mm.  Row 0 is the top (max y)."""
+    img = np.zeros(frame_shape(frame, dpmm), dtype=bool)
+    kernels = {}
+
+    def offsets(code):
+        if code not in kernels:
+            kernels[code] = kernel(layer.apertures.get(code, ("C", [0.0])), dpmm)
+        return kernels[code]
+
+    for level in layer.levels:
+        value = level.dark
+        for region in level.regions:
+            pts = np.asarray(region, dtype=float)
+            rows, cols = _to_pixels(frame, dpmm, pts[:, 0], pts[:, 1])
+            _fill_region(img, rows, cols, value)
+        for code, points in level.flashes.items():
+            pts = np.asarray(points, dtype=float)
+            rows, cols = _to_pixels(frame, dpmm, pts[:, 0], pts[:, 1])
+            _stamp(img, np.floor(rows).astype(int), np.floor(cols).astype(int),
+                   offsets(code), value)
+        for code, strokes in level.strokes.items():
+            s = np.asarray(strokes, dtype=float)
+            r0, c0 = _to_pixels(frame, dpmm, s[:, 0], s[:, 1])
+            r1, c1 = _to_pixels(frame, dpmm, s[:, 2], s[:, 3])
+            # Sample every stroke at half pixel intervals, including both ends
+            n = np.maximum(1, np.ceil(np.hypot(r1 - r0, c1 - c0) * 2)).astype(int) + 1
+            seg = np.repeat(np.arange(len(s)), n)
+            first = np.cumsum(n) - n
+            t = (np.arange(n.sum()) - first[seg]) / np.maximum(1, n - 1)[seg]
+            rows = r0[seg] + (r1 - r0)[seg] * t
+            cols = c0[seg] + (c1 - c0)[seg] * t
+            _stamp(img, np.floor(rows).astype(int), np.floor(cols).astype(int),
+                   offsets(code), value)
+    return img
+
+def cache_key(data, frame, dpmm):
+    h = hashlib.sha1(data)
+    h.update(repr((CACHE_VERSION, [round(v, 6) for v in frame], dpmm)).encode())
+    return h.hexdigest()
+
+def cached_raster(fn, frame, dpmm, cache_path, data=None):
+    """rasterise() for a file, keeping the result in cache_path (as packed
+    bits, keyed on the file contents, frame and resolution).  data is the
+    file contents, if already read (e.g. from a zip).  Returns (mask,
+    seconds taken to render, or None if it came from the cache)."""
+    t0 = time.time()
+    if data is None:
+        with open(fn, "rb") as f:
+            data = f.read()
+    shape = frame_shape(frame, dpmm)
+    cache_fn = os.path.join(cache_path, cache_key(data, frame, dpmm) + ".npy")
+    if os.path.exists(cache_fn):
+        try:
+            bits = np.load(cache_fn)
+            return np.unpackbits(bits)[:shape[0] * shape[1]].reshape(shape).astype(bool), None
+        except (IOError, ValueError):
+            pass  # corrupt; redraw it
+    mask = rasterise(read_layer(fn, data.decode("latin-1")), frame, dpmm)
+    if not os.path.isdir(cache_path):
+        try:
+            os.makedirs(cache_path)
+        except OSError:
+            pass  # another process got there first
+    tmp_fn = "%s.tmp%d.npy" % (cache_fn[:-4], os.getpid())
+    np.save(tmp_fn, np.packbits(mask))
+    os.rename(tmp_fn, cache_fn)
+    return mask, time.time() - t0
+
+def composite(shape, layers, background=(0, 0, 0, 0)):
+    """Alpha-composite [(bool mask, (r, g, b), alpha)] over a background,
+    returning an RGBA uint8 image.  An entry with colour None clears to
+    transparent (e.g. drill holes)."""
+    rgb = np.empty(shape + (3,), dtype=np.float32)
+    rgb[:] = np.asarray(background[:3], dtype=np.float32) / 255.0
+    a = np.full(shape, background[3] / 255.0, dtype=np.float32)
+    for mask, colour, alpha in layers:
+        if colour is None:
+            a[mask] = 0.0
+            continue
+        c = np.asarray(colour, dtype=np.float32) / 255.0
+        out_a = alpha + a[mask] * (1 - alpha)
+        rgb[mask] = (c * alpha + rgb[mask] * (a[mask] * (1 - alpha))[:, None]) / \
+            np.maximum(out_a, 1e-6)[:, None]
+        a[mask] = out_a
+    out = np.empty(shape + (4,), dtype=np.uint8)
+    out[..., :3] = np.clip(rgb * 255 + 0.5, 0, 255)
+    out[..., 3] = np.clip(a * 255 + 0.5, 0, 255)
+    return out
+
+def write_png(fn, image):
+    """Write an RGBA (h, w, 4) or greyscale (h, w) uint8 array as a PNG."""
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    h, w = image.shape[:2]
+    colour_type = 6 if image.ndim == 3 else 0
+    raw = np.zeros((h, image[0].nbytes + 1), dtype=np.uint8)  # filter byte 0
+    raw[:, 1:] = image.reshape(h, -1)
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    output_dir = os.path.dirname(fn)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with open(fn, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, colour_type, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
@@ -0,0 +1,343 @@
+from __future__ import print_function
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Pure Python access to the contents of a .kicad_pcb file, without pcbnew.
+#
+# The board file is read with a streaming S-expression parser, which only
+# ever holds one top level item (a module, segment, via...) in memory, and
+# boiled down to an index of what scripts usually want to ask:
+#
+# - net -> track segments, vias, pads, zone layers
+# - footprint reference -> footprint name, position, rotation, layer, value
+#
+# The index is saved as JSON next to the board (foo.kicad_pcb.index) and
+# reused until the board's mtime or size changes, so queries after the first
+# take milliseconds.
+#
+#   index = kicad_pcb_index.load_index("max10_electron_ula.kicad_pcb")
+#   for x1, y1, x2, y2, width, layer in index.segments("sdram_CLK"): ...
+#
+# Or from the command line, to print what the index knows about some nets
+# or footprints:
+#
+#   python kicad_pcb_index.py max10_electron_ula.kicad_pcb sdram_CLK RAM
+
+import io
+import json
+import math
+import os
+import re
+import sys
+import time
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index"
+
+CHUNK_SIZE = 64 * 1024
+
+TOKEN_RE = re.compile(r'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+UNESCAPE_RE = re.compile(r'\\(.)')
+
+def tokens(f, chunk_size=CHUNK_SIZE):
+    # Yields "(", ")" and atoms (strings with quotes removed).  KiCad never
+    # writes a raw newline inside a quoted string, so the file is tokenised
+    # a chunk at a time, cutting at the last newline.
+    leftover = ""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        text = leftover + chunk
+        cut = text.rfind("\n") + 1
+        if not cut:
+            leftover = text
+            continue
+        text, leftover = text[:cut], text[cut:]
+        for m in TOKEN_RE.finditer(text):
+            token = m.group(0)
+            if token[0] == '"':
+                token = UNESCAPE_RE.sub(r'\1', token[1:-1])
+            yield token
+    for m in TOKEN_RE.finditer(leftover):
+        token = m.group(0)
+        if token[0] == '"':
+            token = UNESCAPE_RE.sub(r'\1', token[1:-1])
+        yield token
+
+def iter_items(f, chunk_size=CHUNK_SIZE):
+    """Yields each child of the top level expression as nested lists,
+    without building the whole tree, e.g. ["segment", ["start", "1", "2"],
+    ...] for a .kicad_pcb file."""
+    stack = []
+    for token in tokens(f, chunk_size):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if not stack:
+                raise ValueError("Unbalanced ')' in s-expression")
+            item = stack.pop()
+            if len(stack) == 1:
+                yield item
+            elif stack:
+                stack[-1].append(item)
+        elif stack:
+            stack[-1].append(token)
+    if stack:
+        raise ValueError("Unterminated s-expression")
+
+def parse_sexp(text):
+    # Parses a whole (small) s-expression into nested lists
+    stack = [[]]
+    for token in tokens(io.StringIO(text)):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            item = stack.pop()
+            stack[-1].append(item)
+        else:
+            stack[-1].append(token)
+    if len(stack) != 1 or not stack[0]:
+        raise ValueError("Unbalanced or empty s-expression")
+    return stack[0][0]
+
+def find(item, key):
+    # First child list of item starting with key
+    for sub in item[1:]:
+        if isinstance(sub, list) and sub and sub[0] == key:
+            return sub
+    return None
+
+def find_all(item, key):
+    return [sub for sub in item[1:] if isinstance(sub, list) and sub and sub[0] == key]
+
+def _xy(item, key):
+    sub = find(item, key)
+    return (float(sub[1]), float(sub[2])) if sub else (0.0, 0.0)
+
+def _net_code(item):
+    net = find(item, "net")
+    return int(net[1]) if net else 0
+
+def _footprint(item, codes):
+    # A module (KiCad 5) or footprint (KiCad 6) and its pads
+    at = find(item, "at")
+    x, y = float(at[1]), float(at[2])
+    rotation = float(at[3]) if len(at) > 3 else 0.0
+    layer = find(item, "layer")[1]
+    ref = value = ""
+    for text in find_all(item, "fp_text"):
+        if text[1] == "reference":
+            ref = text[2]
+        elif text[1] == "value":
+            value = text[2]
+    for prop in find_all(item, "property"):
+        if prop[1] == "Reference":
+            ref = prop[2]
+        elif prop[1] == "Value":
+            value = prop[2]
+
+    # Pad positions are relative to the footprint, and rotate with it
+    # (counterclockwise, with y pointing down)
+    a = math.radians(rotation)
+    cos_a, sin_a = math.cos(a), math.sin(a)
+    pads = []
+    for pad in find_all(item, "pad"):
+        px, py = _xy(pad, "at")
+        layers = find(pad, "layers")
+        net = find(pad, "net")
+        if net:
+            codes[int(net[1])] = net[2] if len(net) > 2 else ""
+        pads.append((
+            _net_code(pad),
+            [ref, pad[1],
+             round(x + px * cos_a + py * sin_a, 5),
+             round(y - px * sin_a + py * cos_a, 5),
+             layers[1:] if layers else []]))
+    info = {
+        "footprint": item[1],
+        "x": x,
+        "y": y,
+        "rotation": rotation,
+        "layer": layer,
+        "value": value,
+    }
+    return ref, info, pads
+
+def build_index(fn):
+    """Reads a .kicad_pcb file and returns the index as a dict."""
+    codes = {}
+    by_code = {}
+    footprints = {}
+
+    def net_entry(code):
+        if code not in by_code:
+            by_code[code] = {"segments": [], "vias": [], "pads": [], "zones": []}
+        return by_code[code]
+
+    with open(fn) as f:
+        for item in iter_items(f):
+            kind = item[0]
+            if kind == "net":
+                codes[int(item[1])] = item[2] if len(item) > 2 else ""
+            elif kind == "segment":
+                start = _xy(item, "start")
+                end = _xy(item, "end")
+                net_entry(_net_code(item))["segments"].append([
+                    start[0], start[1], end[0], end[1],
+                    float(find(item, "width")[1]), find(item, "layer")[1]])
+            elif kind == "via":
+                x, y = _xy(item, "at")
+                drill = find(item, "drill")
+                net_entry(_net_code(item))["vias"].append([
+                    x, y, float(find(item, "size")[1]),
+                    float(drill[1]) if drill else 0.0,
+                    find(item, "layers")[1:]])
+            elif kind == "zone":
+                layer = find(item, "layer")
+                name = find(item, "net_name")
+                code = _net_code(item)
+                if name and code not in codes:
+                    codes[code] = name[1]
+                if layer:
+                    net_entry(code)["zones"].append(layer[1])
+            elif kind in ("module", "footprint"):
+                ref, info, pads = _footprint(item, codes)
+                footprints[ref] = info
+                for code, pad in pads:
+                    net_entry(code)["pads"].append(pad)
+
+    nets = {}
+    for code, entry in by_code.items():
+        name = codes.get(code, "")
+        if not name:
+            continue  # unconnected
+        nets[name] = entry
+    stat = os.stat(fn)
+    return {
+        "version": INDEX_VERSION,
+        "source": {"mtime": stat.st_mtime, "size": stat.st_size},
+        "nets": nets,
+        "footprints": footprints,
+    }
+
+class BoardIndex:
+    def __init__(self, data):
+        self.data = data
+        self.nets = data["nets"]
+        self.footprints = data["footprints"]
+
+    def net_names(self):
+        return sorted(self.nets)
+
+    def _net(self, net):
+        return self.nets.get(net, {"segments": [], "vias": [], "pads": [], "zones": []})
+
+    def segments(self, net):
+        # [(x1, y1, x2, y2, width, layer)] in mm
+        return [tuple(s) for s in self._net(net)["segments"]]
+
+    def vias(self, net):
+        # [(x, y, size, drill, [layers])]
+        return [tuple(v) for v in self._net(net)["vias"]]
+
+    def pads(self, net):
+        # [(ref, pad number, x, y, [layers])], with absolute positions
+        return [tuple(p) for p in self._net(net)["pads"]]
+
+    def zones(self, net):
+        # Layers with a zone (pour) on this net
+        return list(self._net(net)["zones"])
+
+    def footprint(self, ref):
+        # {footprint, x, y, rotation, layer, value} or None
+        return self.footprints.get(ref)
+
+    def pad(self, ref, number):
+        # (net, x, y, [layers]) for one pad, or None
+        for net, entry in self.nets.items():
+            for r, n, x, y, layers in entry["pads"]:
+                if r == ref and n == number:
+                    return net, x, y, layers
+        return None
+
+def index_path(fn):
+    return fn + INDEX_SUFFIX
+
+def load_index(fn, rebuild=False, verbose=False):
+    """Returns a BoardIndex for fn, from the cached index next to it if
+    that's up to date, or otherwise by parsing the board (and saving the
+    index for next time)."""
+    cache_fn = index_path(fn)
+    stat = os.stat(fn)
+    if not rebuild and os.path.exists(cache_fn):
+        try:
+            with open(cache_fn) as f:
+                data = json.load(f)
+            source = data.get("source", {})
+            if (data.get("version") == INDEX_VERSION
+                    and source.get("mtime") == stat.st_mtime
+                    and source.get("size") == stat.st_size):
+                return BoardIndex(data)
+        except ValueError:
+            pass  # corrupt; rebuild it
+    t0 = time.time()
+    data = build_index(fn)
+    if verbose:
+        print("Indexed %s in %.2f s" % (fn, time.time() - t0))
+    tmp_fn = cache_fn + ".tmp"
+    try:
+        with open(tmp_fn, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.rename(tmp_fn, cache_fn)
+    except (IOError, OSError) as e:
+        # Read-only checkout etc.; just don't cache
+        if verbose:
+            print("Not caching index: %s" % e)
+    return BoardIndex(data)
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: %s <board.kicad_pcb> [--rebuild] [net or footprint ref ...]" % sys.argv[0])
+        sys.exit(1)
+    fn = sys.argv[1]
+    args = sys.argv[2:]
+    rebuild = "--rebuild" in args
+    names = [a for a in args if a != "--rebuild"]
+
+    t0 = time.time()
+    index = load_index(fn, rebuild=rebuild, verbose=True)
+    print("Loaded index for %s in %.1f ms: %d nets, %d footprints" % (
+        fn, (time.time() - t0) * 1000, len(index.nets), len(index.footprints)))
+
+    for name in names:
+        fp = index.footprint(name)
+        if fp:
+            print("%s: %s %s at (%g, %g) rotation %g on %s" % (
+                name, fp["value"], fp["footprint"], fp["x"], fp["y"],
+                fp["rotation"], fp["layer"]))
+        if name in index.nets:
+            segments = index.segments(name)
+            length = sum(math.hypot(x2 - x1, y2 - y1) for x1, y1, x2, y2, w, l in segments)
+            print("%s: %d segments (%.2f mm), %d vias, %d pads%s" % (
+                name, len(segments), length, len(index.vias(name)),
+                len(index.pads(name)),
+                ", zones on " + " ".join(index.zones(name)) if index.zones(name) else ""))
+            for ref, number, x, y, layers in index.pads(name):
+                print("  %s.%s at (%g, %g)" % (ref, number, x, y))
+        if not fp and name not in index.nets:
+            print("%s: no such net or footprint" % name)
+
+if __name__ == '__main__':
+    main()
@@ -25,7 +25,7 @@ zip = "%s.zip" % output_name
 
 # Setup .gitignore
 ignore = [x.strip() for x in open(".gitignore").readlines()] if os.path.exists(".gitignore") else []
-for pattern in ("gerber_tmp", zip):
+for pattern in ("gerber_tmp", ".fab_cache", ".preview_cache", "fab_diff", "variants", zip, pcb + ".index"):
     if pattern not in ignore:
         ignore.append(pattern)
 open(".gitignore", "w").writelines("%s\n" % x for x in sorted(ignore))
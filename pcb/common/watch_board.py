@@ -0,0 +1,318 @@
+from __future__ import print_function
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Watch mode for board scripts: reruns the script whenever it (or a .py
+# file next to it) is saved, and prints what changed in the netlist and BOM
+# rather than a text diff:
+#
+# - components added, removed, or with a new value or footprint
+# - nets added, removed or renamed (same pins, new name)
+# - pins moved from one net to another
+# - BOM quantity changes, by value and package
+#
+# The script runs in a fresh interpreter each time, with open() wrapped so
+# that files it writes go to a temporary file first.  Afterwards, each one
+# only replaces the real file if its contents changed, so KiCad and make
+# don't see a new mtime on an identical netlist.  If the script fails,
+# nothing it wrote is kept.
+#
+#   python watch_board.py max10_electron_ula.py   (or: make watch)
+
+import argparse
+from glob import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from kicad_pcb_index import parse_sexp, find, find_all
+
+POLL_SECONDS = 0.5
+TMP_SUFFIX = ".watch-tmp"
+RESULT_MARKER = "@@watch_board@@ "
+MAX_LINES = 40
+
+# ---------------------------------------------------------------------------
+# Child side: run the board script, writing outputs only if they changed
+
+def run_child(script):
+    try:
+        import __builtin__ as builtins
+    except ImportError:
+        import builtins
+    real_open = builtins.open
+    real_rename = os.rename
+    pending = {}
+
+    def watched_open(file, mode="r", *args, **kwargs):
+        if isinstance(file, str):
+            path = os.path.abspath(file)
+            if "w" in mode and "+" not in mode:
+                pending[path] = path + TMP_SUFFIX
+                return real_open(pending[path], mode, *args, **kwargs)
+            if path in pending:
+                # Reading back something written earlier in this run
+                return real_open(pending[path], mode, *args, **kwargs)
+        return real_open(file, mode, *args, **kwargs)
+
+    def watched_rename(src, dst):
+        tmp = pending.pop(os.path.abspath(src), None)
+        real_rename(tmp or src, dst)
+
+    builtins.open = watched_open
+    os.rename = watched_rename
+
+    import runpy
+    ok = False
+    try:
+        # As if run as "python script.py"
+        sys.argv = [script]
+        sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+        runpy.run_path(script, run_name="__main__")
+        ok = True
+    except SystemExit as e:
+        ok = not e.code
+    finally:
+        builtins.open = real_open
+        os.rename = real_rename
+        rewritten = []
+        unchanged = []
+        for path, tmp in sorted(pending.items()):
+            if not os.path.exists(tmp):
+                continue
+            if not ok:
+                os.remove(tmp)
+                continue
+            with open(tmp, "rb") as f:
+                new = f.read()
+            old = None
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    old = f.read()
+            if new == old:
+                os.remove(tmp)
+                unchanged.append(path)
+            else:
+                if os.path.exists(path) and sys.platform == "win32":
+                    os.remove(path)
+                os.rename(tmp, path)
+                rewritten.append(path)
+        sys.stdout.flush()
+        print(RESULT_MARKER + json.dumps({"ok": ok, "rewritten": rewritten,
+                                          "unchanged": unchanged}))
+    sys.exit(0 if ok else 1)
+
+# ---------------------------------------------------------------------------
+# Model: what the diff compares
+
+class BoardModel:
+    def __init__(self, components, nodes, bom):
+        self.components = components  # {ref: (value, footprint)}
+        self.nodes = nodes            # {(ref, pin): net}
+        self.bom = bom                # {(value, package): quantity}
+        self.nets = {}
+        for node, net in nodes.items():
+            self.nets.setdefault(net, set()).add(node)
+
+def _field(item, key):
+    sub = find(item, key)
+    return sub[1] if sub and len(sub) > 1 else ""
+
+def read_model(netlist_fn, bom_fn):
+    components = {}
+    nodes = {}
+    if os.path.exists(netlist_fn):
+        with open(netlist_fn) as f:
+            export = parse_sexp(f.read())
+        for comp in find_all(find(export, "components") or ["components"], "comp"):
+            components[_field(comp, "ref")] = (_field(comp, "value"), _field(comp, "footprint"))
+        for net in find_all(find(export, "nets") or ["nets"], "net"):
+            name = _field(net, "name")
+            for node in find_all(net, "node"):
+                nodes[_field(node, "ref"), _field(node, "pin")] = name
+    bom = {}
+    if os.path.exists(bom_fn):
+        with open(bom_fn) as f:
+            for line in f.readlines()[1:]:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) >= 4:
+                    key = (cols[1], cols[3].split(":")[-1])
+                    bom[key] = bom.get(key, 0) + 1
+    return BoardModel(components, nodes, bom)
+
+def plural(n, what):
+    return "%d %s%s" % (n, what, "" if n == 1 else "s")
+
+def diff_models(old, new):
+    """Returns a list of lines describing the changes from old to new."""
+    lines = []
+    for ref in sorted(set(old.components) - set(new.components)):
+        lines.append("- component %s %s (%s)" % ((ref,) + old.components[ref]))
+    for ref in sorted(set(new.components) - set(old.components)):
+        lines.append("+ component %s %s (%s)" % ((ref,) + new.components[ref]))
+    for ref in sorted(set(old.components) & set(new.components)):
+        (old_value, old_fp), (new_value, new_fp) = old.components[ref], new.components[ref]
+        if old_value != new_value:
+            lines.append("~ %s value %s -> %s" % (ref, old_value, new_value))
+        if old_fp != new_fp:
+            lines.append("~ %s footprint %s -> %s" % (ref, old_fp, new_fp))
+
+    # A net that disappeared and one that appeared with exactly the same
+    # pins is a rename
+    gone = set(old.nets) - set(new.nets)
+    added = set(new.nets) - set(old.nets)
+    by_pins = dict((frozenset(new.nets[n]), n) for n in added)
+    renamed = {}
+    for name in sorted(gone):
+        match = by_pins.get(frozenset(old.nets[name]))
+        if match:
+            renamed[name] = match
+            lines.append("~ net %s renamed to %s" % (name, match))
+    for name in sorted(gone - set(renamed)):
+        lines.append("- net %s (%s)" % (name, plural(len(old.nets[name]), "pin")))
+    for name in sorted(added - set(renamed.values())):
+        lines.append("+ net %s (%s)" % (name, plural(len(new.nets[name]), "pin")))
+
+    moved = []
+    for node in sorted(set(old.nodes) & set(new.nodes)):
+        before, after = old.nodes[node], new.nodes[node]
+        if before != after and renamed.get(before) != after:
+            moved.append("~ %s.%s moved from %s to %s" % (node[0], node[1], before, after))
+    for node in sorted(set(new.nodes) - set(old.nodes)):
+        if node[0] in old.components:
+            moved.append("+ %s.%s connected to %s" % (node[0], node[1], new.nodes[node]))
+    for node in sorted(set(old.nodes) - set(new.nodes)):
+        if node[0] in new.components:
+            moved.append("- %s.%s disconnected from %s" % (node[0], node[1], old.nodes[node]))
+    lines += moved
+
+    for key in sorted(set(old.bom) | set(new.bom)):
+        before, after = old.bom.get(key, 0), new.bom.get(key, 0)
+        if before != after:
+            lines.append("~ BOM %s (%s): %d -> %d" % (key[0], key[1], before, after))
+    return lines
+
+# ---------------------------------------------------------------------------
+# Parent side: watch for changes and rerun
+
+def watched_files(script, extra):
+    files = set(glob(os.path.join(os.path.dirname(script), "*.py")))
+    files.add(script)
+    for path in extra:
+        files.update(glob(os.path.join(path, "*.py")) if os.path.isdir(path) else [path])
+    return sorted(os.path.abspath(f) for f in files)
+
+def snapshot(files):
+    stamps = {}
+    for fn in files:
+        try:
+            stamps[fn] = os.stat(fn).st_mtime
+        except OSError:
+            stamps[fn] = None
+    return stamps
+
+def run_script(script, python, verbose):
+    """Runs the board script through run_child.  Returns (ok, rewritten
+    files, unchanged files)."""
+    proc = subprocess.Popen(
+        [python, os.path.abspath(__file__), "--child", os.path.basename(script)],
+        cwd=os.path.dirname(script) or ".",
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    output, _ = proc.communicate()
+    result = {"ok": False, "rewritten": [], "unchanged": []}
+    lines = []
+    for line in output.splitlines():
+        if line.startswith(RESULT_MARKER):
+            result = json.loads(line[len(RESULT_MARKER):])
+        else:
+            lines.append(line)
+    if verbose or not result["ok"]:
+        print("\n".join(lines))
+    return result["ok"], result["rewritten"], result["unchanged"]
+
+def rebuild(script, python, netlist_fn, bom_fn, model, verbose):
+    t0 = time.time()
+    ok, rewritten, unchanged = run_script(script, python, verbose)
+    if not ok:
+        print("%s failed; outputs left as they were" % os.path.basename(script))
+        return model
+    new_model = read_model(netlist_fn, bom_fn)
+    lines = diff_models(model, new_model)
+    for line in lines[:MAX_LINES]:
+        print("  " + line)
+    if len(lines) > MAX_LINES:
+        print("  ... and %d more changes" % (len(lines) - MAX_LINES))
+    cwd = os.path.dirname(script)
+    print("%s in %.1f s: %s; rewrote %s" % (
+        os.path.basename(script), time.time() - t0,
+        plural(len(lines), "change") if lines else "no netlist or BOM changes",
+        ", ".join(os.path.relpath(f, cwd) for f in rewritten) or "nothing"))
+    return new_model
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        run_child(sys.argv[2])
+        return
+
+    parser = argparse.ArgumentParser(description="Rerun a board script when it changes")
+    parser.add_argument("script", help="board script, e.g. max10_electron_ula.py")
+    parser.add_argument("--netlist", help="netlist the script writes (default <script>.net)")
+    parser.add_argument("--bom", default="bill_of_materials.txt",
+                        help="BOM the script writes (default %(default)s)")
+    parser.add_argument("--watch", action="append", default=[],
+                        help="extra file or directory of .py files to watch")
+    parser.add_argument("--python", default=sys.executable,
+                        help="interpreter to run the script with")
+    parser.add_argument("--once", action="store_true",
+                        help="run once and exit, e.g. to see what an edit did")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="show the script's output even when it succeeds")
+    args = parser.parse_args()
+
+    script = os.path.abspath(args.script)
+    here = os.path.dirname(script)
+    netlist_fn = os.path.join(here, args.netlist or
+                              os.path.splitext(os.path.basename(script))[0] + ".net")
+    bom_fn = os.path.join(here, args.bom)
+
+    # Start from what's on disk, so the first run shows any pending changes
+    model = read_model(netlist_fn, bom_fn)
+    model = rebuild(script, args.python, netlist_fn, bom_fn, model, args.verbose)
+    if args.once:
+        return
+
+    files = watched_files(script, args.watch)
+    stamps = snapshot(files)
+    print("Watching %d files; ^C to stop" % len(files))
+    try:
+        while True:
+            time.sleep(POLL_SECONDS)
+            if snapshot(files) == stamps:
+                continue
+            # Let editors finish writing (some save in several steps)
+            time.sleep(POLL_SECONDS / 2)
+            previous, stamps = stamps, snapshot(files)
+            changed = [os.path.basename(f) for f in files if previous.get(f) != stamps.get(f)]
+            print()
+            print("Changed: %s" % ", ".join(changed))
+            model = rebuild(script, args.python, netlist_fn, bom_fn, model, args.verbose)
+            stamps = snapshot(files)
+    except KeyboardInterrupt:
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# This source file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This source file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# ---------------------
+# fpga_pin_allocator.py
+# ---------------------
+
+# Constraint-driven FPGA pin allocation for the 10M08SCU169 (U169 package).
+#
+# This replaces filling NEXT_CONN slots in list order.  Each signal belongs
+# to a Group, which says which sides of the chip it should escape from and
+# whether it's timing critical, and the allocation is solved as a minimum
+# cost assignment (Hungarian algorithm) of signals to free pins:
+#
+# Hard rules (never broken -- allocation fails instead):
+# - VREF pins have 48 pF on them, so only signals marked slow_ok may use them.
+# - PLL inputs must go on a CLK*p pin.
+# These (and the low speed bank warning) are also checked for signals that
+# are already connected to a pin, so hand placed pins can't break them.
+#
+# Soft rules, in decreasing order of cost:
+# - Each group escapes from one of its preferred sides.
+# - Timing critical signals avoid the low speed banks (1A, 1B, 8).
+# - Signals stay close to their target position on the perimeter, which is
+#   their pin in a previous allocation if given, or otherwise where filling
+#   the free pins in list order (starting at start_pin) would put them.
+#   This keeps groups together and in order, and keeps a pinout stable when
+#   signals are added or removed.
+#
+# The whole thing takes well under a second for ~120 signals.
+
+import re
+
+# Pins in escape routing order, as listed in max10_electron_ula.py
+PERIMETER = [
+    ("top", "B3 A2 A3 B4 A4 A5 B5 E6 A6 B6 F8 A7 B7 A8 E8 E9 D9 A9 C9 A10 "
+            "B10 C10 A11 B11 A12 B12"),
+    ("right", "C11 B13 C12 C13 D12 D13 F9 E10 F10 D11 E13 E12 F13 G9 F12 G13 "
+              "G10 G12 H13 H10 J12 J13 K11 K13 K12 J10 L12 K10 L13 M13 L11"),
+    ("bottom", "M12 N12 M11 N11 L10 H9 N10 J9 M10 N9 J8 H8 M9 N8 M8 K7 K8 N7 "
+               "M7 N6 J7 K6 L5 N5 J6 M5 K5 N4 M4 J5 N3 M3 N2 L3"),
+    ("left", "M2 M1 L2 L1 L4 K1 K2 H5 J1 J2 H1 G4 H6 H4 H2 H3 F1 G5 F4 E1 E3 "
+             "D1 E4 C1 C2 B1 B2"),
+]
+
+# IO bank for each user IO pin
+BANKS = {}
+for _bank, _pins in (
+        ("1A", "D1 C2 E3 E4 C1 B1 F1 E1"),
+        ("1B", "F4 G4 H2 H3 H1"),
+        ("2", "G5 J1 H6 J2 H5 M1 H4 M2 N2 L1 N3 L2 M3 K1 L3 K2"),
+        ("3", "L5 M4 L4 M5 K5 N4 J5 N5 N6 N7 M7 N8 J6 M8 K6 M9 J7 N11 K7 N12 "
+              "M13 N10 M12 N9 M11 L11 J8 K8 M10 L10"),
+        ("5", "K10 K11 J10 L12 K12 L13 J12 K13 J9 J13 H10 H13 H9 G13 H8 G12"),
+        ("6", "G9 G10 F13 E13 F12 E12 F9 D13 F10 C13 F8 B12 E9 B11 C12 B13 "
+              "C11 A12 E10 D9 D12 D11"),
+        ("8", "C10 A8 C9 A9 B10 A10 A11 E8 B7 A7 A6 B6 A4 B5 A3 E6 B3 B4 A5 "
+              "A2 B2")):
+    for _pin in _pins.split():
+        BANKS[_pin] = _bank
+
+LOW_SPEED_BANKS = ("1A", "1B", "8")
+
+# Dual purpose pins that matter to the allocator
+VREF_PINS = ("B7", "D13", "K13", "N11", "L1", "H1")
+PLL_INPUT_PINS = ("H6", "H4", "G9", "F13")  # CLK0p, CLK1p, CLK2p, CLK3p
+
+# Cost weights.  HARD must dominate the sum of all soft costs.
+HARD = 10 ** 9
+SIDE_COST = 10000
+LOW_SPEED_COST = 3000
+DISTANCE_COST = 10
+
+class Group:
+    def __init__(self, name, signals, sides=None, critical=False, slow_ok=(),
+                 pll_inputs=(), critical_signals=()):
+        # signals: names in their preferred perimeter order
+        # sides: sides of the chip this group may escape from (None = any)
+        # critical: all signals are timing critical
+        # slow_ok: signals that may use VREF pins
+        # pll_inputs: signals that must be on a CLK*p pin
+        # critical_signals: individually timing critical signals
+        self.name = name
+        self.signals = list(signals)
+        self.sides = sides
+        self.critical = critical
+        self.slow_ok = set(slow_ok)
+        self.pll_inputs = set(pll_inputs)
+        self.critical_signals = set(critical_signals)
+
+    def __repr__(self):
+        return "<Group %s: %d signals>" % (self.name, len(self.signals))
+
+class AllocationError(Exception):
+    pass
+
+def perimeter_pins():
+    return [pin for side, pins in PERIMETER for pin in pins.split()]
+
+def pin_side(pin_number):
+    for side, pins in PERIMETER:
+        if pin_number in pins.split():
+            return side
+    return None
+
+def read_qsf_pins(fn):
+    # Read a previous allocation from a set_location_assignment snippet, as
+    # written by max10_electron_ula.py.  Returns {net: pin}, with bus
+    # subscripts removed (addr[3] -> addr3) to match the netlist.
+    previous = {}
+    with open(fn) as f:
+        for line in f:
+            m = re.match(r"^\s*set_location_assignment\s+PIN_(\w+)\s+-to\s+(\S+)", line)
+            if m:
+                previous[re.sub(r"[\[\]]", "", m.group(2))] = m.group(1)
+    return previous
+
+def hungarian(cost):
+    # Minimum cost assignment of n rows to m >= n columns.  Returns a list
+    # giving the column for each row.  O(n^2 m), which is nothing at this
+    # size.
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    INF = float("inf")
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    p = [0] * (m + 1)  # p[j] = row matched to column j (1-based), 0 = none
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [INF] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = INF
+            j1 = 0
+            row = cost[i0 - 1]
+            ui0 = u[i0]
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    result = [None] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            result[p[j] - 1] = j - 1
+    return result
+
+def rule_cost(name, group, pin):
+    """Cost of putting signal name (in group) on pin, before distance."""
+    c = 0
+    if pin in VREF_PINS and name not in group.slow_ok:
+        c += HARD
+    if name in group.pll_inputs and pin not in PLL_INPUT_PINS:
+        c += HARD
+    if group.sides is not None and pin_side(pin) not in group.sides:
+        c += SIDE_COST
+    if (group.critical or name in group.critical_signals) and BANKS.get(pin) in LOW_SPEED_BANKS:
+        c += LOW_SPEED_COST
+    return c
+
+def allocate(fpga_pins, groups, start_pin=None, previous=None, free_net="NEXT_CONN",
+             verbose=True):
+    """Assign the signals in groups to the pins in fpga_pins whose net is
+    free_net, updating pin.nets in place.  Signals already connected to a
+    pin are left where they are.  Returns {signal: pin number}."""
+    previous = previous or {}
+    order = perimeter_pins()
+    position = dict((pin, i) for i, pin in enumerate(order))
+
+    fixed = {}
+    for pin in fpga_pins:
+        for net in pin.nets:
+            if net != free_net:
+                fixed[net] = pin.number
+
+    free_pins = [p for p in order
+                 if any(pin.number == p and pin.nets == [free_net] for pin in fpga_pins)]
+    signals = []
+    placed = []  # (name, group, pin) for signals already connected
+    for group in groups:
+        for name in group.signals:
+            if name in fixed:
+                if verbose:
+                    print("already allocated fpga pin: %s" % name)
+                placed.append((name, group, fixed[name]))
+                continue
+            signals.append((name, group))
+    if len(signals) > len(free_pins):
+        raise AllocationError("%d signals to allocate but only %d free pins" % (
+            len(signals), len(free_pins)))
+
+    # Target positions: previous allocation if known, otherwise the pin that
+    # filling in list order from start_pin would give.
+    if start_pin is not None:
+        start = free_pins.index(start_pin)
+        fill_order = free_pins[start:] + free_pins[:start]
+    else:
+        fill_order = free_pins
+    target = {}
+    for i, (name, group) in enumerate(signals):
+        if previous.get(name) in position:
+            target[name] = position[previous[name]]
+        else:
+            target[name] = position[fill_order[i]]
+
+    n_perimeter = len(order)
+    cost = []
+    for name, group in signals:
+        row = []
+        for pin in free_pins:
+            c = rule_cost(name, group, pin)
+            d = abs(position[pin] - target[name])
+            c += DISTANCE_COST * min(d, n_perimeter - d)
+            row.append(c)
+        cost.append(row)
+
+    # Signals connected by hand are held to the same rules, apart from the
+    # side preference
+    problems = []
+    for name, group, pin in placed:
+        if pin in VREF_PINS and name not in group.slow_ok:
+            problems.append("%s is connected to VREF pin %s but isn't slow_ok" % (name, pin))
+        if name in group.pll_inputs and pin not in PLL_INPUT_PINS:
+            problems.append("PLL input %s is connected to %s, which isn't a CLK*p pin" % (
+                name, pin))
+        if ((group.critical or name in group.critical_signals)
+                and BANKS.get(pin) in LOW_SPEED_BANKS):
+            problems.append("warning: timing critical %s is in low speed bank %s" % (
+                name, BANKS[pin]))
+
+    result = {}
+    for i, col in enumerate(hungarian(cost)):
+        name, group = signals[i]
+        pin = free_pins[col]
+        result[name] = pin
+        c = cost[i][col]
+        if c >= HARD:
+            problems.append("%s can't go on any remaining pin (got %s)" % (name, pin))
+        elif c >= SIDE_COST:
+            problems.append("warning: %s (%s) is on the %s side" % (
+                name, group.name, pin_side(pin)))
+        elif c >= LOW_SPEED_COST and (group.critical or name in group.critical_signals):
+            problems.append("warning: timing critical %s is in low speed bank %s" % (
+                name, BANKS[pin]))
+    for p in problems:
+        print(p)
+    if any(not p.startswith("warning") for p in problems):
+        raise AllocationError("no valid FPGA pin allocation")
+
+    by_pin = dict((pin, name) for name, pin in result.items())
+    for pin in fpga_pins:
+        if pin.number in by_pin:
+            pin.nets = [by_pin[pin.number]]
+            if verbose:
+                print('allocating fpga pin %s: new nets==%s' % (pin.number, pin.nets))
+    if verbose:
+        moved = [name for name, pin in result.items()
+                 if name in previous and previous[name] != pin]
+        if previous:
+            print("%d signals allocated, %d moved from previous allocation%s" % (
+                len(result), len(moved), (": " + ", ".join(sorted(moved))) if moved else ""))
+        else:
+            print("%d signals allocated" % len(result))
+    return result
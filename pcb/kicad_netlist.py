@@ -0,0 +1,79 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# This source file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This source file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# ----------------
+# kicad_netlist.py
+# ----------------
+
+# Reader for the KiCad .net files written by max10_electron_ula.py, for
+# scripts that want to look at the connectivity without pcbnew.
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "common"))
+from kicad_pcb_index import parse_sexp
+
+def _children(section):
+    # Older netlists (rgb_to_vga.net) wrap the contents of each section in
+    # an extra list: (components ((comp ...) (comp ...)))
+    for item in section[1:]:
+        if isinstance(item, list) and item and isinstance(item[0], list):
+            for sub in item:
+                yield sub
+        else:
+            yield item
+
+def _field(item, key):
+    for sub in item[1:]:
+        if isinstance(sub, list) and sub and sub[0] == key:
+            return sub[1] if len(sub) > 1 else ""
+    return None
+
+class Netlist:
+    def __init__(self, components, nets):
+        # components: {ref: (value, footprint)}
+        # nets: {net name: [(ref, pin), ...]}
+        self.components = components
+        self.nets = nets
+        self.net_of = {}
+        for name, nodes in nets.items():
+            for node in nodes:
+                self.net_of[node] = name
+
+    def pins_of(self, ref):
+        # {pin: net name} for a component
+        return dict((pin, net) for (r, pin), net in self.net_of.items() if r == ref)
+
+def read_netlist(fn):
+    with open(fn) as f:
+        export = parse_sexp(f.read())
+    components = {}
+    nets = {}
+    for section in export[1:]:
+        if not isinstance(section, list):
+            continue
+        if section[0] == "components":
+            for comp in _children(section):
+                components[_field(comp, "ref")] = (
+                    _field(comp, "value"), _field(comp, "footprint"))
+        elif section[0] == "nets":
+            for net in _children(section):
+                nodes = [(_field(node, "ref"), _field(node, "pin"))
+                         for node in net[1:]
+                         if isinstance(node, list) and node[0] == "node"]
+                nets[_field(net, "name")] = nodes
+    return Netlist(components, nets)
@@ -31,11 +31,22 @@ here = os.path.dirname(sys.argv[0])
 sys.path.insert(0, os.path.join(here, "myelin-kicad.pretty"))
 import myelin_kicad_pcb
 Pin = myelin_kicad_pcb.Pin
+import fpga_pin_allocator
+import quartus_pins
+import rc_timing
+import netlist_erc
+import board_variants
+
+# Which variant to build (see board_variants.py); v1 unless $BOARD_VARIANT
+# says otherwise
+variant = board_variants.current()
+print("Building variant %s (%s)" % (variant.name, variant.desc))
 
 # TODO(v2) CRITICAL add 10k pullups for nNMI_5V and nIRQ_5V
 # TODO(v2) CRITICAL swap DBUF with a 74LVC16245 (and maybe ABUF too)
 # TODO(v2) CRITICAL add 10k pullups for KBD* to 5V (and use LVC rather than LVTH buffer)
 # TODO(v2) CRITICAL pull CAS_IN_5V to CAS_IN_divider with 10k, and add 10u NF decoupling cap from CAS_IN_divider to GND
+# (The four CRITICAL items above are in the v2 variant; see board_variants.py)
 
 # TODO(v2) rename all 100n caps to DC*
 # TODO(v2) put resistor/capacitor values for R*/AR*/C*/AC* on silkscreen
@@ -190,7 +201,7 @@ ula = myelin_kicad_pcb.Component(
 
 # IO requirements: max 130 IO in U169 package, practically 118 IO + 12 special
 
-# So far 114 IO used -- see fpga_pins.txt.
+# So far 114 IO used -- see fpga_pins.txt (generated by this script).
 
 # done(v1) Serial flash: 6 (flash_nCE, flash_SCK, flash_IO0, flash_IO1, flash_IO2, flash_IO3)
 # done(v1) flash_nCE pullup
@@ -249,10 +260,20 @@ pullups = [
     myelin_kicad_pcb.R0805("10k", "RnW_nOE", "3V3", ref="PR10"),
 ]
 
-# rotate array n positions
-# e.g. roll_array(a, 5) will move the first 5 elements to the back of the array
-def roll_array(a, n):
-    return a[n:] + a[:n]
+# v2: pullups on Electron inputs that float when nothing drives them
+if variant.electron_pullups:
+    electron_pullups = [
+        myelin_kicad_pcb.R0805("10k", net, "5V", ref="PR%d" % (16 + n))
+        for n, net in enumerate(["nNMI_5V", "nIRQ_5V",
+                                 "KBD0_5V", "KBD1_5V", "KBD2_5V", "KBD3_5V"])
+    ]
+
+# Pin locations for Quartus, also used as the previous allocation when
+# allocating FPGA pins
+QSF_PINS_FN = '../altera/ElectronULA_max10_from_pcb_pins_qsf.txt'
+
+# Top level HDL entity, which the FPGA pin list is checked against
+VHDL_TOP_FN = '../src/altera/ElectronULA_max10.vhd'
 
 if True:
     # allocate FPGA pins dynamically
@@ -508,155 +529,176 @@ if True:
             Pin("F7",  "VCC_ONE", "3V3"),
     ]
 
-    conns_to_allocate = roll_array([
-        # USB, SD, flash
-        "USB_PU",
-        "sd_DAT2",
-        "sd_DAT3_nCS",
-        "sd_CMD_MOSI",
-        "USB_P",
-        "USB_M",
-        "sd_DAT1",
-        "flash_nCE",
-        "flash_IO1",
-        "flash_IO2",
-        "sd_CLK_SCK",
-        "flash_IO3",
-        "flash_SCK",
-        "sd_DAT0_MISO",
-        "flash_IO0",
+    # Signals to allocate, in perimeter order within each group.  Anything
+    # marked "slow OK" may go on a VREF pin.  The solver in
+    # fpga_pin_allocator.py keeps each group on its preferred sides, keeps
+    # timing critical signals out of the low speed banks, and otherwise
+    # keeps signals where they were last time (the pin list written to
+    # ../altera/ElectronULA_max10_from_pcb_pins_qsf.txt), so adding or
+    # removing a signal doesn't reshuffle everything else.  Set
+    # PIN_ALLOCATION=fresh to ignore the previous allocation and fill in list
+    # order from D12, which reproduces the original v1 pinout.
+    fpga_pin_groups = [
+        # Right and bottom are fast, so SDRAM and the other fast peripherals
+        # go there.
+        fpga_pin_allocator.Group("peripherals", sides=("right", "bottom"), critical=True,
+            slow_ok=["USB_PU"],
+            signals=[
+                # USB, SD, flash
+                "USB_PU",
+                "sd_DAT2",
+                "sd_DAT3_nCS",
+                "sd_CMD_MOSI",
+                "USB_P",
+                "USB_M",
+                "sd_DAT1",
+                "flash_nCE",
+                "flash_IO1",
+                "flash_IO2",
+                "sd_CLK_SCK",
+                "flash_IO3",
+                "flash_SCK",
+                "sd_DAT0_MISO",
+                "flash_IO0",
+            ]),
 
         # Oscillator
-        "clk_osc",
-
-        # SDRAM
-        "sdram_DQ15",
-        "sdram_DQ14",
-        "sdram_DQ13",
-        "sdram_DQ8",
-        "sdram_DQ11",
-        "sdram_A11",
-        "sdram_DQ12",
-        "sdram_DQ10",
-        "sdram_DQ9",
-        "sdram_UDQM",
-        "sdram_A12",
-        "sdram_A8",
-        "sdram_A5",
-        "sdram_A4",
-        "sdram_A7",
-        "sdram_A6",
-        "sdram_CKE",
-        "sdram_BA0",
-        "sdram_A9",
-        "sdram_CLK",
-        "sdram_A0",
-        "sdram_A3",
-        "sdram_nCAS",
-        "sdram_A1",
-        "sdram_BA1",
-        "sdram_A2",
-        "sdram_A10",
-        "sdram_nCS",
-        "sdram_nWE",
-        "sdram_DQ6",
-        "sdram_nRAS",
-        "sdram_LDQM",
-        "sdram_DQ2",
-        "sdram_DQ7",
-        "sdram_DQ1",
-        "sdram_DQ5",
-        "sdram_DQ4",
-        "sdram_DQ0",
-        "sdram_DQ3",
-
-        # DAC
-        "dac_dacdat",
-        "dac_lrclk",
-        "dac_nmute",  # slow OK
-        "dac_mclk",
-        "dac_bclk",
-
-        # ULA
-        # - Comparator
-        "casIn",
-        # - Diode buffer
-        "RST_n_in",
-        # - DBUF
-        "D_buf_DIR",
-        "D_buf_nOE",
-        "data7",
-        "data5",
-        "data4",
-        "data6",
-        "data3",
-        "data2",
-        "data1",
-        #"clk_in",
-        "data0",
-        "RnW_in",
-        "kbd3",
-        "kbd2",
-        "NMI_n_in",
-        "IRQ_n_in",
-        "kbd1",
-        "input_buf_nOE",  # slow OK
-        "ROM_n",  # direct
-        "kbd0",
-        "addr15",
-        "addr9",
-        "addr10",
-        "addr3",
-        "addr11",
-        "addr14",
-        "addr0",
-        "addr8",
-        "addr1",
-        "A_buf_DIR",  # slow OK
-        "addr5",
-        "A_buf_nOE",  # slow OK
-        "misc_buf_nOE",  # slow OK
-        "addr4",
-        "casMO",
-        "casOut",
-        "addr6",
-        "addr13",
-        "addr7",
-        "blue",
-        "addr2",
-        "csync",
-        "HS_n",
-        "addr12",
-        "green",
-        "red",
-        "clk_out",
-        # - HCT125
-        "RST_n_out",  # slow OK
-        "caps",  # slow OK
-        "RnW_out",
-        "RnW_nOE",
-        "IRQ_n_out",
-    ], 84)
-
-    for pin in fpga_pins:
-        if not pin.nets: continue
-        net, = pin.nets
-        # remove already-allocated connections
-        if net in conns_to_allocate:
-            print('already allocated fpga pin: %s' % net)
-            conns_to_allocate.remove(net)
-
-    for pin in fpga_pins:
-        if not pin.nets:
-            print('fpga pin %s has no nets' % pin.number)
-            continue
-
-        net, = pin.nets
-
-        if net == 'NEXT_CONN':
-            pin.nets = [conns_to_allocate.pop(0)]
-            print('allocating first available connection for fpga pin %s: new nets==%s' % (pin.number, pin.nets))
- 
+        fpga_pin_allocator.Group("oscillator", pll_inputs=["clk_osc"], critical=True,
+            signals=["clk_osc"]),
+
+        fpga_pin_allocator.Group("sdram", sides=("right", "bottom"), critical=True,
+            signals=[
+                "sdram_DQ15",
+                "sdram_DQ14",
+                "sdram_DQ13",
+                "sdram_DQ8",
+                "sdram_DQ11",
+                "sdram_A11",
+                "sdram_DQ12",
+                "sdram_DQ10",
+                "sdram_DQ9",
+                "sdram_UDQM",
+                "sdram_A12",
+                "sdram_A8",
+                "sdram_A5",
+                "sdram_A4",
+                "sdram_A7",
+                "sdram_A6",
+                "sdram_CKE",
+                "sdram_BA0",
+                "sdram_A9",
+                "sdram_CLK",
+                "sdram_A0",
+                "sdram_A3",
+                "sdram_nCAS",
+                "sdram_A1",
+                "sdram_BA1",
+                "sdram_A2",
+                "sdram_A10",
+                "sdram_nCS",
+                "sdram_nWE",
+                "sdram_DQ6",
+                "sdram_nRAS",
+                "sdram_LDQM",
+                "sdram_DQ2",
+                "sdram_DQ7",
+                "sdram_DQ1",
+                "sdram_DQ5",
+                "sdram_DQ4",
+                "sdram_DQ0",
+                "sdram_DQ3",
+            ]),
+
+        fpga_pin_allocator.Group("dac", sides=("right", "bottom", "left"),
+            slow_ok=["dac_nmute"],
+            critical_signals=["dac_mclk", "dac_bclk"],
+            signals=[
+                "dac_dacdat",
+                "dac_lrclk",
+                "dac_nmute",  # slow OK
+                "dac_mclk",
+                "dac_bclk",
+            ]),
+
+        # Top and left include banks 1 and 8 (low speed IO), so they're used
+        # for the ULA.
+        fpga_pin_allocator.Group("ula", sides=("top", "left"),
+            slow_ok=["D_buf_DIR", "input_buf_nOE", "A_buf_DIR", "A_buf_nOE",
+                     "misc_buf_nOE"],
+            signals=[
+                # - Comparator
+                "casIn",
+                # - Diode buffer
+                "RST_n_in",
+                # - DBUF
+                "D_buf_DIR",
+                "D_buf_nOE",
+                "data7",
+                "data5",
+                "data4",
+                "data6",
+                "data3",
+                "data2",
+                "data1",
+                #"clk_in",
+                "data0",
+                "RnW_in",
+                "kbd3",
+                "kbd2",
+                "NMI_n_in",
+                "IRQ_n_in",
+                "kbd1",
+                "input_buf_nOE",  # slow OK
+                "ROM_n",  # direct
+                "kbd0",
+                "addr15",
+                "addr9",
+                "addr10",
+                "addr3",
+                "addr11",
+                "addr14",
+                "addr0",
+                "addr8",
+                "addr1",
+                "A_buf_DIR",  # slow OK
+                "addr5",
+                "A_buf_nOE",  # slow OK
+                "misc_buf_nOE",  # slow OK
+                "addr4",
+                "casMO",
+                "casOut",
+                "addr6",
+                "addr13",
+                "addr7",
+                "blue",
+                "addr2",
+                "csync",
+                "HS_n",
+                "addr12",
+                "green",
+                "red",
+                "clk_out",
+            ]),
+
+        # The HCT125 open collector buffer sits at the top right corner
+        fpga_pin_allocator.Group("ula_oc", sides=("top", "right"),
+            slow_ok=["RST_n_out", "caps"],
+            signals=[
+                # - HCT125
+                "RST_n_out",  # slow OK
+                "caps",  # slow OK
+                "RnW_out",
+                "RnW_nOE",
+                "IRQ_n_out",
+            ]),
+    ]
+
+    previous_allocation = None
+    if os.environ.get("PIN_ALLOCATION") != "fresh" and os.path.exists(QSF_PINS_FN):
+        previous_allocation = fpga_pin_allocator.read_qsf_pins(QSF_PINS_FN)
+    fpga_pin_allocator.allocate(fpga_pins, fpga_pin_groups,
+        start_pin="D12", previous=previous_allocation)
+
 else:
     # static FPGA pin allocation
     fpga_pins = [
@@ -864,17 +906,18 @@ print("FPGA: %s" % repr(fpga))
 # print(repr(csv))
 # open('../altera/ElectronULA_max10_from_pcb.csv', 'w').write(csv)
 
-# Write out qsf snippet for pin locations
-with open('../altera/ElectronULA_max10_from_pcb_pins_qsf.txt', 'w') as f:
-    for pin in fpga_pins:
-        if not pin.nets: continue
-        net, = pin.nets
-        if net in ('3V3', 'GND'): continue
-        if net.startswith('fpga_'): continue
-        for bus in fpga.buses:
-            if net.startswith(bus):
-                net = "%s[%s]" % (net[:len(bus)], net[len(bus):])
-        print("set_location_assignment PIN_%s -to %s" % (pin.number, net), file=f)
+# Write out qsf snippet for pin locations and IO standards, and the list of
+# FPGA IO nets, then check that they match the ports of the top level entity.
+fpga_assignments = quartus_pins.pin_assignments(fpga_pins, fpga.buses)
+if board_variants.building_variant():
+    # Keep the variant's pins next to its netlist, not in the Quartus project
+    quartus_pins.write_qsf_pins(board_variants.output_path(os.path.basename(QSF_PINS_FN)),
+                                fpga_assignments)
+else:
+    quartus_pins.write_qsf_pins(QSF_PINS_FN, fpga_assignments)
+quartus_pins.write_pin_list(board_variants.output_path("fpga_pins.txt"), fpga_assignments)
+if not quartus_pins.check(fpga_assignments, VHDL_TOP_FN):
+    sys.exit(1)
 
 
 # chip won't init unless this is pulled high
@@ -1333,8 +1376,8 @@ big_buffers = [
         myelin_kicad_pcb.Component(
             footprint="myelin-kicad:ti_zrd_54_pbga",  # done(v1): check + pinout
             identifier=ident,
-            value="74LVTH162245ZRDR",
-            desc="IC buffer 16-bit; https://www.digikey.com/product-detail/en/texas-instruments/74LVTH162245ZRDR/296-16878-1-ND",
+            value=variant.buffers[ident][0],
+            desc=variant.buffers[ident][1],
             pins=[
                 Pin("A3", "1DIR", DIR1),
                 Pin("A4", "1nOE", nOE1),
@@ -1395,7 +1438,7 @@ big_buffers = [
         myelin_kicad_pcb.C0402("100n", "GND", "3V3", ref="DC?"),
         myelin_kicad_pcb.C0402("100n", "GND", "3V3", ref="DC?"),
     ]
-    for ident, nOE1, DIR1, conn1, nOE2, DIR2, conn2 in
+    for ident, nOE1, DIR1, conn1, nOE2, DIR2, conn2 in [
     [
         # 74LVTH162245 for A_buf
         "ABUF",
@@ -1458,6 +1501,7 @@ big_buffers = [
             ["KBD0_5V",      "kbd0"],
         ]
     ],
+    ]
 ]
 
 oc_buf = [
@@ -1588,6 +1632,12 @@ comparator_misc = [
     # decoupling
     myelin_kicad_pcb.C0805("100n", "5V", "GND", ref="DC?"),
 ]
+if variant.cas_in_pullup:
+    comparator_misc += [
+        # v2: bias CAS_IN_5V to the divider, so IN+ doesn't float
+        myelin_kicad_pcb.R0805("10k", "CAS_IN_5V", "CAS_IN_divider", ref="R12"),
+        myelin_kicad_pcb.C0805("10u NF", "CAS_IN_divider", "GND", ref="C10"),
+    ]
 
 
 ### MICRO USB SOCKET
@@ -1770,6 +1820,10 @@ staples = [
 
 ### END
 
-myelin_kicad_pcb.dump_netlist("max10_electron_ula.net")
-myelin_kicad_pcb.dump_bom("bill_of_materials.txt",
-                          "readable_bill_of_materials.txt")
+NETLIST_FN = board_variants.output_path("max10_electron_ula.net")
+myelin_kicad_pcb.dump_netlist(NETLIST_FN)
+# Rough RC delay of every net against its timing budget
+rc_timing.check(NETLIST_FN, VHDL_TOP_FN)
+netlist_erc.check(NETLIST_FN)
+myelin_kicad_pcb.dump_bom(board_variants.output_path("bill_of_materials.txt"),
+                          board_variants.output_path("readable_bill_of_materials.txt"))
@@ -0,0 +1,313 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# This source file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This source file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# --------------
+# netlist_erc.py
+# --------------
+
+# Electrical rule check for the generated netlist.
+#
+# max10_electron_ula.py records a lot of electrical intent in comments: 5V
+# signals from the ULA header only reach the FPGA through a buffer, the
+# comparator or the reset diode; every enable has a 10k pullup so nothing
+# drives the Electron while the FPGA is unconfigured; and there are TODOs
+# for pullups that v1 is missing.  This turns those into rules (RULES,
+# below) and checks them against the .net file.
+#
+# The netlist is indexed once into a NetGraph (pins by net and by part,
+# and the two-pin passives between nets, with parsed values), so each rule
+# is a few dictionary lookups per net and the whole check takes a few ms.
+#
+# Rule types:
+# - Isolated: no path from one part's signal pins to another's, through
+#   wires or series resistors (voltage domains).
+# - NoResistorTo: no resistor from a part's signal pins straight to a net
+#   (e.g. an FPGA pin pulled to 5V).
+# - Pull: the listed nets (names or a regex) each have a fitted resistor
+#   to a given net, optionally of a given value.
+# - SinglePinNets: nets that only go to one pin.
+# - PowerPins: each part's supply and ground pins are on the right nets,
+#   and every IC has a power pin model.
+#
+# Usage:
+#   python netlist_erc.py [max10_electron_ula.net] [--warnings-as-errors]
+
+import argparse
+import re
+import sys
+import time
+
+import kicad_netlist
+import rc_timing
+
+NETLIST_FN = "max10_electron_ula.net"
+
+POWER_NETS = rc_timing.POWER_NETS + ("mcu_VUSB",)
+
+class NetGraph:
+    def __init__(self, netlist):
+        self.netlist = netlist
+        self.components = netlist.components
+        self.nets = netlist.nets
+        # {ref: {pin: net}}
+        self.pins = {}
+        for (ref, pin), net in netlist.net_of.items():
+            self.pins.setdefault(ref, {})[pin] = net
+        # Two-pin passives: {net: [(ref, kind, value, other net)]}, where
+        # kind is R, C or D and value is None if not fitted
+        self.passives = {}
+        for ref, (value, footprint) in self.components.items():
+            kind = passive_kind(ref, footprint)
+            pins = self.pins.get(ref, {})
+            if not kind or len(pins) != 2:
+                continue
+            a, b = [pins[p] for p in sorted(pins)]
+            parsed = rc_timing.parse_value(value)
+            self.passives.setdefault(a, []).append((ref, kind, parsed, b))
+            self.passives.setdefault(b, []).append((ref, kind, parsed, a))
+
+    def signal_nets(self, ref):
+        return set(net for net in self.pins.get(ref, {}).values() if net not in POWER_NETS)
+
+    def resistors(self, net):
+        # [(ref, ohms, other net)] for fitted resistors on a net
+        return [(ref, value, other) for ref, kind, value, other in self.passives.get(net, ())
+                if kind == "R" and value is not None]
+
+def passive_kind(ref, footprint):
+    lib = footprint.split(":")[0]
+    if lib == "Resistor_SMD":
+        return "R"
+    if lib == "Capacitor_SMD":
+        return "C"
+    if lib == "Diode_SMD":
+        return "D"
+    return None
+
+def format_ohms(ohms):
+    if ohms is None:
+        return "?"
+    if ohms >= 1000:
+        return "%gk" % (ohms / 1000.0)
+    return "%gR" % ohms
+
+class Rule:
+    severity = "error"
+
+    def __init__(self, why, severity=None):
+        self.why = why
+        if severity:
+            self.severity = severity
+
+    def check(self, graph):
+        # Yields a message for each violation
+        return []
+
+class Isolated(Rule):
+    def __init__(self, source, dest, why, allow=None, severity=None):
+        # allow: {net: reason} for connections that are fine
+        Rule.__init__(self, why, severity)
+        self.source = source
+        self.dest = dest
+        self.allow = allow or {}
+
+    def check(self, graph):
+        dest_nets = graph.signal_nets(self.dest)
+        for start in sorted(graph.signal_nets(self.source)):
+            # Walk through series resistors to see which nets this reaches
+            seen = {start: None}
+            queue = [start]
+            while queue:
+                net = queue.pop()
+                for ref, ohms, other in graph.resistors(net):
+                    if (other not in seen and other not in POWER_NETS
+                            and ohms <= rc_timing.SERIES_MAX_OHMS):
+                        seen[other] = ref
+                        queue.append(other)
+            for net in sorted(set(seen) & dest_nets):
+                if net in self.allow:
+                    continue
+                via = []
+                n = net
+                while seen[n]:
+                    via.append(seen[n])
+                    n = [o for r, v, o in graph.resistors(n) if r == seen[n]][0]
+                yield "%s pin on %s reaches %s pin on %s%s" % (
+                    self.source, start, self.dest, net,
+                    " through " + ", ".join(reversed(via)) if via else " directly")
+
+class NoResistorTo(Rule):
+    def __init__(self, ref, net, why, severity=None):
+        Rule.__init__(self, why, severity)
+        self.ref = ref
+        self.net = net
+
+    def check(self, graph):
+        for net in sorted(graph.signal_nets(self.ref)):
+            for ref, ohms, other in graph.resistors(net):
+                if other == self.net:
+                    yield "%s pin on %s is pulled to %s by %s" % (self.ref, net, other, ref)
+
+class Pull(Rule):
+    def __init__(self, nets, to, why, ohms=None, tolerance=0.1, severity=None):
+        # nets: a list of net names, or a regex matched against all nets
+        Rule.__init__(self, why, severity)
+        self.nets = nets
+        self.to = to
+        self.ohms = ohms
+        self.tolerance = tolerance
+
+    def check(self, graph):
+        if isinstance(self.nets, str):
+            nets = [n for n in graph.nets if re.search(self.nets, n)]
+        else:
+            nets = self.nets
+        for net in sorted(nets):
+            if net not in graph.nets:
+                yield "%s is not in the netlist" % net
+                continue
+            found = [(ref, ohms) for ref, ohms, other in graph.resistors(net) if other == self.to]
+            if not found:
+                yield "%s has no %sresistor to %s" % (
+                    net, format_ohms(self.ohms) + " " if self.ohms else "", self.to)
+            elif self.ohms and not any(abs(ohms - self.ohms) <= self.ohms * self.tolerance
+                                       for ref, ohms in found):
+                yield "%s is pulled to %s by %s; want %s" % (
+                    net, self.to, ", ".join("%s (%s)" % (ref, format_ohms(ohms))
+                                            for ref, ohms in found),
+                    format_ohms(self.ohms))
+
+class SinglePinNets(Rule):
+    def __init__(self, why, allow=None, severity=None):
+        Rule.__init__(self, why, severity)
+        self.allow = allow or {}
+
+    def check(self, graph):
+        for net, nodes in sorted(graph.nets.items()):
+            if len(nodes) == 1 and net not in self.allow:
+                yield "%s only connects to %s.%s" % (net, nodes[0][0], nodes[0][1])
+
+class PowerPins(Rule):
+    def __init__(self, models, why, ignore=None, severity=None):
+        # models: [(value regex, {net: [pins]})]; ignore: footprint regex
+        # for parts that don't need a model (connectors etc)
+        Rule.__init__(self, why, severity)
+        self.models = models
+        self.ignore = ignore
+
+    def check(self, graph):
+        for ref, (value, footprint) in sorted(graph.components.items()):
+            pins = graph.pins.get(ref, {})
+            if passive_kind(ref, footprint) or len(pins) < 3:
+                continue
+            model = None
+            for value_re, supplies in self.models:
+                if re.search(value_re, value):
+                    model = supplies
+                    break
+            if model is None:
+                if not (self.ignore and re.search(self.ignore, footprint)):
+                    yield "%s (%s) has no power pin model" % (ref, value)
+                continue
+            for net, numbers in sorted(model.items()):
+                for pin in numbers:
+                    actual = pins.get(pin)
+                    if actual != net:
+                        yield "%s (%s) pin %s is on %s; should be %s" % (
+                            ref, value, pin, actual or "no net", net)
+
+# Board rules for max10_electron_ula.py.  See the TODO(v2) comments there for
+# the pullups that v1 is missing.
+RULES = [
+    Isolated("ULA", "FPGA",
+             "5V signals must pass through a buffer, the comparator or a diode "
+             "before reaching an FPGA pin",
+             allow={"ROM_n": "FPGA output straight into an LS input; 3.3V is a valid high"}),
+    NoResistorTo("FPGA", "5V", "FPGA pins are not 5V tolerant"),
+    Pull(r"^(flash_nCE|sdram_nCS|sd_DAT3_nCS|\w+_nOE|RST_n_out|IRQ_n_out)$", "3V3",
+         "chip and buffer enables must be held inactive while the FPGA is unconfigured",
+         ohms=10e3),
+    Pull(["fpga_CONF_DONE", "fpga_nSTATUS"], "3V3",
+         "Max 10 won't initialise unless these are pulled high", ohms=10e3),
+    Pull(["fpga_TCK"], "GND", "prevent spurious JTAG clocks"),
+    Pull(["RST_n_in"], "3V3", "reset level shifter diode needs a pullup", ohms=10e3),
+    Pull(["casIn"], "3V3", "MIC7221 output is open drain"),
+    Pull(["nNMI_5V", "nIRQ_5V"], "5V",
+         "TODO(v2) CRITICAL: add 10k pullups for nNMI_5V and nIRQ_5V", ohms=10e3),
+    Pull(r"^KBD\d_5V$", "5V",
+         "TODO(v2) CRITICAL: add 10k pullups for KBD* to 5V", ohms=10e3),
+    Pull(["CAS_IN_5V"], "CAS_IN_divider",
+         "TODO(v2) CRITICAL: pull CAS_IN_5V to CAS_IN_divider with 10k", ohms=10e3),
+    SinglePinNets("a net with one pin is usually a typo in a net name",
+                  allow={"VUSB": "FPGA USB is powered from the Electron",
+                         "mcu_VUSB": "MCU USB is powered from the Electron"}),
+    PowerPins([
+        (r"^10M08", {
+            "3V3": ("C6", "C7", "C8", "D3", "D4", "D10", "F2", "F7", "F11", "G3", "G6",
+                    "G8", "G11", "H7", "H11", "J3", "J11", "K3", "K4", "K9", "L6", "L7",
+                    "L8"),
+            "GND": ("A1", "A13", "B8", "C3", "D2", "D5", "E2", "E11", "F3", "G7", "H12",
+                    "J4", "L9", "M6", "N1", "N13"),
+        }),
+        (r"^MT48LC16M16A2", {"3V3": ("A7", "A9", "B3", "C7", "D3", "E7", "J9"),
+                             "GND": ("A1", "A3", "B7", "C3", "D7", "E3", "J1")}),
+        (r"^74LV(TH|C)162?245", {"3V3": ("C3", "C4", "G3", "G4"),
+                                  "GND": ("D3", "D4", "E3", "E4", "F3", "F4")}),
+        (r"^74HCT125", {"5V": ("14",), "GND": ("7",)}),
+        (r"^74HCT245", {"5V": ("20",), "GND": ("10",)}),
+        (r"^MIC7221", {"5V": ("2",), "GND": ("5",)}),
+        (r"^W25Q", {"3V3": ("8",), "GND": ("4",)}),
+        (r"^WM8524", {"3V3": ("6", "12", "15"), "GND": ("4", "13")}),
+        (r"^atsamd11", {"3V3": ("12",), "GND": ("11",)}),
+        (r"^osc$", {"3V3": ("4",), "GND": ("2",)}),
+        (r"^AP7365", {"3V3": ("1",), "5V": ("3",), "GND": ("2",)}),
+    ], "ICs must be powered from the right rail",
+       ignore=r"Connector|Tag-Connect|jtag|usb|sd_card|PLCC|via_single"),
+]
+
+def check(netlist_fn=NETLIST_FN, rules=RULES, warnings_as_errors=False, verbose=True):
+    """Runs the rules over a netlist, printing any violations.  Returns True
+    if there are no errors."""
+    t0 = time.time()
+    graph = NetGraph(kicad_netlist.read_netlist(netlist_fn))
+    errors = warnings = 0
+    for rule in rules:
+        messages = list(rule.check(graph))
+        if not messages:
+            continue
+        severity = "error" if warnings_as_errors else rule.severity
+        print("%s: %s" % (severity, rule.why))
+        for message in messages:
+            print("  %s" % message)
+        if severity == "error":
+            errors += len(messages)
+        else:
+            warnings += len(messages)
+    if verbose or errors or warnings:
+        print("ERC: %d rules, %d nets, %d errors, %d warnings (%.1f ms)" % (
+            len(rules), len(graph.nets), errors, warnings, (time.time() - t0) * 1000))
+    return errors == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Netlist electrical rule check")
+    parser.add_argument("netlist", nargs="?", default=NETLIST_FN)
+    parser.add_argument("--warnings-as-errors", action="store_true")
+    args = parser.parse_args()
+    sys.exit(0 if check(args.netlist, warnings_as_errors=args.warnings_as_errors) else 1)
+
+if __name__ == '__main__':
+    main()
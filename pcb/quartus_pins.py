@@ -0,0 +1,209 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# This source file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This source file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# ---------------
+# quartus_pins.py
+# ---------------
+
+# Generates Quartus pin constraints (set_location_assignment and IO_STANDARD)
+# from the FPGA pin list in max10_electron_ula.py, and checks them against the
+# port list of the VHDL top level entity, so a pin mistake shows up in under a
+# second rather than after a full fit.
+#
+# Can also be run standalone to check an existing constraints file:
+#
+#   python quartus_pins.py ../altera/ElectronULA_max10_from_pcb_pins_qsf.txt \
+#       ../src/altera/ElectronULA_max10.vhd
+
+import re
+import sys
+
+# Every bank on the board has VCCIO = 3V3
+DEFAULT_IO_STANDARD = "3.3-V LVTTL"
+
+# Nets on FPGA pins that don't correspond to HDL ports
+NON_PORT_NETS = ("3V3", "GND")
+NON_PORT_PREFIXES = ("fpga_",)
+
+def quartus_name(net, buses):
+    # addr3 -> addr[3] for nets that are part of a bus
+    for bus in buses:
+        m = re.match(r"^%s(\d+)$" % re.escape(bus), net)
+        if m:
+            return "%s[%s]" % (bus, m.group(1))
+    return net
+
+def pin_assignments(fpga_pins, buses):
+    # Returns [(pin number, HDL port name)] for every user IO on the FPGA
+    assignments = []
+    for pin in fpga_pins:
+        if not pin.nets:
+            continue
+        net, = pin.nets
+        if net in NON_PORT_NETS or net.startswith(NON_PORT_PREFIXES):
+            continue
+        assignments.append((pin.number, quartus_name(net, buses)))
+    return assignments
+
+def read_qsf_assignments(fn):
+    assignments = []
+    with open(fn) as f:
+        for line in f:
+            m = re.match(r"^\s*set_location_assignment\s+PIN_(\w+)\s+-to\s+(\S+)", line)
+            if m:
+                assignments.append((m.group(1), m.group(2)))
+    return assignments
+
+def write_qsf_pins(fn, assignments, io_standard=DEFAULT_IO_STANDARD,
+                   io_standard_overrides=None):
+    io_standard_overrides = io_standard_overrides or {}
+    with open(fn, 'w') as f:
+        for pin, port in assignments:
+            print("set_location_assignment PIN_%s -to %s" % (pin, port), file=f)
+        for pin, port in assignments:
+            standard = io_standard_overrides.get(port, io_standard)
+            print('set_instance_assignment -name IO_STANDARD "%s" -to %s' % (
+                standard, port), file=f)
+
+def write_pin_list(fn, assignments):
+    # One net name per line, in the netlist's naming (no bus subscripts)
+    with open(fn, 'w') as f:
+        for pin, port in assignments:
+            print(re.sub(r"[\[\]]", "", port), file=f)
+
+def parse_vhdl_ports(fn, entity=None):
+    """Returns {port name: (direction, msb, lsb)} for the entity in fn (or
+    the first entity if not specified), with msb/lsb None for scalars."""
+    with open(fn) as f:
+        text = f.read()
+    # Strip comments and normalise case; VHDL identifiers aren't case
+    # sensitive, but we keep the original spelling for reporting.
+    text = re.sub(r"--[^\n]*", "", text)
+    if entity:
+        m = re.search(r"\bentity\s+%s\s+is\b" % re.escape(entity), text, re.I)
+    else:
+        m = re.search(r"\bentity\s+(\w+)\s+is\b", text, re.I)
+    if not m:
+        raise ValueError("No entity %sfound in %s" % (entity + " " if entity else "", fn))
+    m_port = re.compile(r"\bport\s*\(", re.I).search(text, m.end())
+    if not m_port:
+        raise ValueError("Entity in %s has no port list" % fn)
+
+    # Find the matching close paren
+    depth = 1
+    pos = m_port.end()
+    while depth:
+        if pos >= len(text):
+            raise ValueError("Unterminated port list in %s" % fn)
+        if text[pos] == "(":
+            depth += 1
+        elif text[pos] == ")":
+            depth -= 1
+        pos += 1
+    port_text = text[m_port.end():pos - 1]
+
+    ports = {}
+    for decl in port_text.split(";"):
+        decl = decl.strip()
+        if not decl:
+            continue
+        m = re.match(r"^([\w\s,]+):\s*(in|out|inout|buffer)\s+(.*)$", decl, re.I | re.S)
+        if not m:
+            raise ValueError("Can't parse port declaration %r in %s" % (decl, fn))
+        names, direction, type_ = m.groups()
+        msb = lsb = None
+        r = re.search(r"\(\s*(\d+)\s+(downto|to)\s+(\d+)\s*\)", type_, re.I)
+        if r:
+            msb, lsb = int(r.group(1)), int(r.group(3))
+        for name in names.split(","):
+            ports[name.strip()] = (direction.lower(), msb, lsb)
+    return ports
+
+def expand_ports(ports):
+    # {scalar port name, e.g. addr[3]: direction}
+    scalars = {}
+    for name, (direction, msb, lsb) in ports.items():
+        if msb is None:
+            scalars[name] = direction
+        else:
+            for i in range(min(msb, lsb), max(msb, lsb) + 1):
+                scalars["%s[%d]" % (name, i)] = direction
+    return scalars
+
+def cross_check(assignments, ports, ignore_unassigned=()):
+    """Compares pin assignments with the HDL ports.  Returns a list of
+    error strings; empty if everything matches."""
+    errors = []
+    scalars = expand_ports(ports)
+    lower = dict((name.lower(), name) for name in scalars)
+
+    by_pin = {}
+    by_port = {}
+    for pin, port in assignments:
+        by_pin.setdefault(pin, []).append(port)
+        by_port.setdefault(port, []).append(pin)
+    for pin, names in sorted(by_pin.items()):
+        if len(names) > 1:
+            errors.append("PIN_%s is assigned to more than one port: %s" % (
+                pin, ", ".join(names)))
+    for port, pins in sorted(by_port.items()):
+        if len(pins) > 1:
+            errors.append("%s is assigned to more than one pin: %s" % (
+                port, ", ".join("PIN_%s" % p for p in pins)))
+
+    for port, pins in sorted(by_port.items()):
+        if port in scalars:
+            continue
+        if port.lower() in lower:
+            errors.append("%s (PIN_%s) differs only in case from HDL port %s" % (
+                port, pins[0], lower[port.lower()]))
+        elif port in ports:
+            errors.append("%s (PIN_%s) is a bus in the HDL; assign each bit" % (
+                port, pins[0]))
+        else:
+            errors.append("%s (PIN_%s) is not a port of the top level entity" % (
+                port, pins[0]))
+
+    assigned_lower = set(port.lower() for port in by_port)
+    for name in sorted(scalars):
+        if name.lower() not in assigned_lower and name not in ignore_unassigned:
+            errors.append("HDL port %s (%s) has no pin assignment" % (
+                name, scalars[name]))
+    return errors
+
+def check(assignments, vhdl_fn, entity=None, ignore_unassigned=()):
+    # Print any problems and return True if everything matches
+    errors = cross_check(assignments, parse_vhdl_ports(vhdl_fn, entity),
+                         ignore_unassigned)
+    for error in errors:
+        print("ERROR: %s" % error)
+    if errors:
+        print("%d pin assignment problem(s) against %s" % (len(errors), vhdl_fn))
+    else:
+        print("%d pin assignments match the ports in %s" % (len(assignments), vhdl_fn))
+    return not errors
+
+def main():
+    if len(sys.argv) not in (3, 4):
+        print("Usage: %s <qsf or pins_qsf.txt> <top level .vhd> [entity]" % sys.argv[0])
+        sys.exit(1)
+    entity = sys.argv[3] if len(sys.argv) > 3 else None
+    ok = check(read_qsf_assignments(sys.argv[1]), sys.argv[2], entity)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
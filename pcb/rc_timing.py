@@ -0,0 +1,436 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# This source file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This source file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# ------------
+# rc_timing.py
+# ------------
+
+# Lumped RC timing check for every net in the generated netlist.
+#
+# The pin planning comments in max10_electron_ula.py work out by hand that a
+# VREF pin's 48 pF gives T=4.8 ns with a 100 ohm driver, which is no good for
+# SDRAM.  This does the same sum for every net: each FPGA pin is looked up
+# in the pin allocation (the netlist) to get its capacitance class, every
+# other pin gets a capacitance from a small table of part models, and the
+# worst driver on the net (including any series resistance, like the 22R in
+# the A port of the 74LVTH162245s, or discrete resistors between nets) gives
+# an Elmore delay to each receiver.  That's converted to the time to cross
+# the TTL input thresholds (VIL = 0.8 V falling, VIH = 2.0 V rising), and
+# compared with a budget for the net:
+#
+# - SDRAM nets: a quarter of the SDRAM clock period, which depends on the
+#   FastSDRAM generic in the top level VHDL (96 MHz or 48 MHz).
+# - clk_in/clk_osc: a tenth of the 16 MHz period, to keep PLL input edges
+#   sharp.
+# - PHI_OUT: half of the 2 MHz PHI0 high time.
+# - Open collector nets: the rising edge is only driven by the pullup, and
+#   has to be done within half a 2 MHz bus cycle.
+# - Everything else: half a 16 MHz clk_in cycle.
+#
+# The numbers are rough (no transmission line effects, typical datasheet
+# capacitances, a fixed allowance for trace capacitance), but they're good
+# enough to catch a critical signal landing on a VREF pin, or a missing
+# pullup.
+#
+# Usage:
+#   python rc_timing.py [max10_electron_ula.net] [--all] [--pullup nIRQ_5V=4700]
+
+import argparse
+import math
+import re
+import sys
+
+import fpga_pin_allocator
+import kicad_netlist
+
+NETLIST_FN = "max10_electron_ula.net"
+VHDL_TOP_FN = "../src/altera/ElectronULA_max10.vhd"
+
+POWER_NETS = ("GND", "3V3", "5V", "VUSB")
+
+# Receiver thresholds; every input on the board has TTL levels
+VIL = 0.8
+VIH = 2.0
+
+# FPGA pin capacitance by class (Max 10 datasheet, table 16).  Dual purpose
+# config and JTAG pins aren't listed separately, so use the IO figure.
+FPGA_PIN_PF = {
+    "normal": 8.0,    # top/bottom IO; left/right pins are 7 pF
+    "normal_lr": 7.0,
+    "vref": 48.0,
+    "config": 8.0,
+}
+FPGA_CONFIG_PINS = ("B9", "D8", "E5", "D6",  # DEV_CLRn, DEV_OE, JTAGEN, CRC_ERROR
+                    "C4", "C5", "D7", "E7",  # nSTATUS, CONF_DONE, CONFIG_SEL, nCONFIG
+                    "F5", "F6", "G1", "G2")  # TDI, TDO, TMS, TCK
+
+# 3.3-V LVTTL at the default 8 mA current strength
+FPGA_DRIVE_OHMS = 50.0
+
+# Allowance for the PCB trace to each pin on a net
+TRACE_PF_PER_PIN = 2.0
+
+# Resistors between two signal nets below this are series (damping or
+# filter) resistors; bigger ones are bias or switchable pulls, and don't
+# carry the signal.
+SERIES_MAX_OHMS = 1000.0
+
+# The Electron motherboard, seen through the ULA header.  Bus lines go to the
+# CPU, ROM, expansion connector etc; the NMOS/TTL drivers on the other end
+# are weak.
+ELECTRON_BUS_RE = re.compile(r"^(A\d+|PD\d|RnW|nIRQ|nNMI|nRESET)_5V$")
+ELECTRON_BUS_LOAD_PF = 50.0
+ELECTRON_LOAD_PF = 15.0
+ELECTRON_DRIVE_OHMS = 100.0
+# Nets on the ULA header that the Electron drives (the rest are ULA outputs)
+ELECTRON_DRIVEN_RE = re.compile(r"^(A\d+|PD\d|KBD\d|clk_in|nNMI|RnW|CAS_IN)_5V$")
+# Assumed pullups on the motherboard for open collector lines; override with
+# --pullup if you know better.
+ELECTRON_PULLUP_OHMS = {
+    "nIRQ_5V": 3300.0,
+    "nRESET_5V": 3300.0,
+}
+
+class Part:
+    def __init__(self, name, drive_ohms, pin_pf, swing, outputs=None, inputs=(),
+                 series_ohms=None, open_drain=(), gated_outputs=None, fixed_dir=None):
+        # outputs: pins that can drive (None = all pins not in inputs)
+        # series_ohms: {pin: extra series resistance inside the part}
+        # open_drain: output pins that only pull low
+        # gated_outputs: {output pin: input pin}; if the input is tied to GND
+        #   the output is used as an open collector (74HCT125 with nOE keyed)
+        # fixed_dir: {DIR pin: (A pins, B pins)}; if DIR is tied to 3V3 the
+        #   A pins are inputs only, if tied to GND the B pins are
+        self.name = name
+        self.drive_ohms = drive_ohms
+        self.pin_pf = pin_pf
+        self.swing = swing
+        self.outputs = outputs
+        self.inputs = inputs
+        self.series_ohms = series_ohms or {}
+        self.open_drain = open_drain
+        self.gated_outputs = gated_outputs or {}
+        self.fixed_dir = fixed_dir or {}
+
+    def can_drive(self, pin, pin_nets):
+        if pin in self.inputs:
+            return False
+        for dir_pin, (a_pins, b_pins) in self.fixed_dir.items():
+            if pin_nets.get(dir_pin) == "3V3" and pin in a_pins:
+                return False
+            if pin_nets.get(dir_pin) == "GND" and pin in b_pins:
+                return False
+        return self.outputs is None or pin in self.outputs
+
+LVTH162245_1A = ("A6", "B5", "B6", "C5", "C6", "D5", "D6", "E5")
+LVTH162245_1B = ("A1", "B2", "B1", "C2", "C1", "D2", "D1", "E2")
+LVTH162245_2A = ("E6", "F5", "F6", "G5", "G6", "H5", "H6", "J6")
+LVTH162245_2B = ("E1", "F2", "F1", "G2", "G1", "H2", "H1", "J1")
+LVTH162245_A_PORT = LVTH162245_1A + LVTH162245_2A
+LVTH162245_B_PORT = LVTH162245_1B + LVTH162245_2B
+
+# First match on the component value wins
+PART_MODELS = [
+    (r"^74LVTH162245", Part("74LVTH162245", 12.0, 9.0, 3.3,
+                            outputs=LVTH162245_A_PORT + LVTH162245_B_PORT,
+                            series_ohms=dict((pin, 22.0) for pin in LVTH162245_A_PORT),
+                            fixed_dir={"A3": (LVTH162245_1A, LVTH162245_1B),
+                                       "J3": (LVTH162245_2A, LVTH162245_2B)})),
+    # Same pinout, no 22R on the A port (v2 DBUF)
+    (r"^74LVC16245", Part("74LVC16245", 15.0, 5.0, 3.3,
+                          outputs=LVTH162245_A_PORT + LVTH162245_B_PORT,
+                          fixed_dir={"A3": (LVTH162245_1A, LVTH162245_1B),
+                                     "J3": (LVTH162245_2A, LVTH162245_2B)})),
+    (r"^74HCT125", Part("74HCT125", 50.0, 3.5, 5.0, outputs=("3", "6", "8", "11"),
+                        gated_outputs={"3": "2", "6": "5", "8": "9", "11": "12"})),
+    # DIR is tied high, so always A -> B
+    (r"^74HCT245", Part("74HCT245", 50.0, 3.5, 5.0,
+                        outputs=("11", "12", "13", "14", "15", "16", "17", "18"))),
+    (r"^MT48LC16M16A2", Part("SDRAM", 25.0, 5.0, 3.3)),
+    (r"^W25Q", Part("flash", 30.0, 6.0, 3.3)),
+    (r"^atsamd", Part("MCU", 60.0, 5.0, 3.3)),
+    (r"^MIC7221", Part("comparator", 50.0, 3.0, 3.3, outputs=("1",), open_drain=("1",))),
+    (r"^WM8524", Part("DAC", 0.0, 5.0, 3.3, outputs=())),
+    (r"^osc$", Part("oscillator", 30.0, 5.0, 3.3, outputs=("3",))),
+]
+# Connectors and anything else we don't know about: a small load, no drive
+DEFAULT_PART = Part("other", 0.0, 2.0, 3.3, outputs=())
+
+def parse_value(value):
+    """Returns a component value (e.g. 10k, 1k5, 68R, 100n) as a number, or
+    None if it's not fitted ("NF") or can't be parsed."""
+    if not value or re.search(r"\bNF\b", value):
+        return None
+    m = re.match(r"^(\d+)(?:\.(\d+))?([pnumkMR]?)(\d*)", value)
+    if not m:
+        return None
+    whole, frac, unit, tail = m.groups()
+    number = float("%s.%s" % (whole, frac or tail or "0"))
+    return number * {"p": 1e-12, "n": 1e-9, "u": 1e-6, "m": 1e-3,
+                     "k": 1e3, "M": 1e6, "R": 1.0, "": 1.0}[unit]
+
+def fpga_vhdl_generic(fn, name):
+    # Default value of a boolean generic in the top level entity
+    with open(fn) as f:
+        m = re.search(r"\b%s\s*:\s*boolean\s*:=\s*(true|false)" % re.escape(name),
+                      f.read(), re.I)
+    return m.group(1).lower() == "true" if m else None
+
+def fpga_pin_class(pin):
+    if pin in fpga_pin_allocator.VREF_PINS:
+        return "vref"
+    if pin in FPGA_CONFIG_PINS:
+        return "config"
+    if fpga_pin_allocator.pin_side(pin) in ("left", "right"):
+        return "normal_lr"
+    return "normal"
+
+def budgets(fast_sdram):
+    # [(net regex, budget in ns, why)], first match wins
+    sdram_mhz = 96.0 if fast_sdram else 48.0
+    return [
+        (r"^sdram_", 1000.0 / sdram_mhz / 4,
+         "1/4 of %d MHz SDRAM clock (FastSDRAM=%s)" % (sdram_mhz, fast_sdram)),
+        (r"^(clk_in|clk_osc)$", 1000.0 / 16 / 10, "1/10 of 16 MHz clock; PLL input"),
+        (r"^PHI_OUT_5V", 1000.0 / 2 / 4, "1/2 of 2 MHz PHI0 high time"),
+        (r"^nRESET_5V$", 10000.0, "reset"),
+        (r"^casIn$", 1000.0, "cassette input"),
+    ]
+OPEN_COLLECTOR_BUDGET = (250.0, "open collector; 1/2 of 2 MHz bus cycle")
+DEFAULT_BUDGET = (1000.0 / 16 / 2, "1/2 of 16 MHz clk_in cycle")
+
+class NetTiming:
+    def __init__(self, name):
+        self.name = name
+        self.load_pf = 0.0
+        self.fpga_pins = []     # [(pin, class)]
+        self.drivers = []       # [(description, ohms incl. series, swing, open drain)]
+        self.pullups = []       # [(description, ohms, rail voltage)]
+        self.open_collector = False
+        self.series = []        # [(resistor ref, ohms, other net)]
+        self.fall_ns = None
+        self.rise_ns = None
+        self.worst_driver = None
+        self.budget_ns = None
+        self.budget_why = None
+
+    @property
+    def delay_ns(self):
+        return max(t for t in (self.fall_ns, self.rise_ns) if t is not None)
+
+    @property
+    def ok(self):
+        return self.delay_ns <= self.budget_ns
+
+def part_model(value):
+    for pattern, part in PART_MODELS:
+        if re.match(pattern, value or ""):
+            return part
+    return DEFAULT_PART
+
+def build_nets(netlist, fpga_drive_ohms=FPGA_DRIVE_OHMS, pullup_overrides=None):
+    pullup_overrides = pullup_overrides or {}
+    nets = {}
+    for name in netlist.nets:
+        if name not in POWER_NETS:
+            nets[name] = NetTiming(name)
+
+    for name, nodes in netlist.nets.items():
+        if name in POWER_NETS:
+            continue
+        net = nets[name]
+        for ref, pin in nodes:
+            value, footprint = netlist.components.get(ref, ("", ""))
+            pins = None
+            if ref == "FPGA":
+                cls = fpga_pin_class(pin)
+                net.fpga_pins.append((pin, cls))
+                net.load_pf += FPGA_PIN_PF[cls] + TRACE_PF_PER_PIN
+                net.drivers.append(("FPGA %s" % pin, fpga_drive_ohms, 3.3, False))
+            elif ref == "ULA":
+                net.load_pf += (ELECTRON_BUS_LOAD_PF if ELECTRON_BUS_RE.match(name)
+                                else ELECTRON_LOAD_PF)
+                if ELECTRON_DRIVEN_RE.match(name):
+                    net.drivers.append(("Electron", ELECTRON_DRIVE_OHMS, 5.0, False))
+            elif re.match(r"^[A-Z]*R\d+$", ref) or re.match(r"^[A-Z]*C\d+$", ref):
+                pins = netlist.pins_of(ref)
+                if len(pins) != 2:
+                    continue
+                other, = [n for p, n in pins.items() if p != pin]
+                number = parse_value(value)
+                if number is None:
+                    continue
+                is_resistor = re.match(r"^[A-Z]*R\d+$", ref)
+                if is_resistor and other in ("3V3", "5V"):
+                    net.pullups.append((ref, number, 3.3 if other == "3V3" else 5.0))
+                elif is_resistor and other not in POWER_NETS and number < SERIES_MAX_OHMS:
+                    net.series.append((ref, number, other))
+                elif not is_resistor:
+                    net.load_pf += number * 1e12
+                net.load_pf += TRACE_PF_PER_PIN
+            else:
+                part = part_model(value)
+                net.load_pf += part.pin_pf + TRACE_PF_PER_PIN
+                if not part.can_drive(pin, netlist.pins_of(ref)):
+                    continue
+                gate = part.gated_outputs.get(pin)
+                open_drain = pin in part.open_drain or (
+                    gate is not None and netlist.net_of.get((ref, gate)) == "GND")
+                net.open_collector |= open_drain
+                ohms = part.drive_ohms + part.series_ohms.get(pin, 0.0)
+                net.drivers.append(("%s %s" % (ref, pin), ohms, part.swing, open_drain))
+
+        external = pullup_overrides.get(name, ELECTRON_PULLUP_OHMS.get(name))
+        if external and any(ref == "ULA" for ref, pin in nodes):
+            net.pullups.append(("Electron", external, 5.0))
+    return nets
+
+def elmore(nets, start, drive_ohms):
+    """Elmore delay (in seconds, per unit of ln(V/Vth)) from a driver on net
+    start to every net reachable through series resistors.  Returns
+    {net: tau}."""
+    # Build the tree of nets joined by series resistors
+    children = {}
+    seen = set([start])
+    order = [start]
+    i = 0
+    while i < len(order):
+        name = order[i]
+        i += 1
+        children[name] = []
+        for ref, ohms, other in nets[name].series:
+            if other in nets and other not in seen:
+                seen.add(other)
+                children[name].append((other, ohms))
+                order.append(other)
+    # Capacitance downstream of each net
+    downstream = {}
+    for name in reversed(order):
+        downstream[name] = nets[name].load_pf * 1e-12 + sum(
+            downstream[child] for child, ohms in children[name])
+    tau = {start: drive_ohms * downstream[start]}
+    for name in order:
+        for child, ohms in children[name]:
+            tau[child] = tau[name] + ohms * downstream[child]
+    return tau
+
+def analyse(nets, fast_sdram):
+    budget_list = budgets(fast_sdram)
+    for name, net in nets.items():
+        # Drivers reach neighbouring nets through series resistors
+        sources = [(name, d) for d in net.drivers]
+        for ref, ohms, other in net.series:
+            if other in nets:
+                sources.extend((other, d) for d in nets[other].drivers)
+        for source, (desc, ohms, swing, open_drain) in sources:
+            tau = elmore(nets, source, ohms).get(name)
+            if tau is None:
+                continue
+            fall = tau * math.log(swing / VIL) * 1e9
+            rise = None
+            if not open_drain:
+                rise = tau * math.log(swing / (swing - VIH)) * 1e9
+            worst = max(t for t in (fall, rise) if t is not None)
+            if net.worst_driver is None or worst > net.delay_ns:
+                net.fall_ns, net.rise_ns = fall, rise
+                net.worst_driver = desc
+        if net.open_collector:
+            # When released, only the pullups drive the rising edge.  They
+            # act in parallel, so this is pessimistic if there's more than
+            # one.
+            rises = [elmore(nets, name, ohms)[name] * math.log(rail / (rail - VIH)) * 1e9
+                     for desc, ohms, rail in net.pullups]
+            # Nothing pulls it up at all!
+            net.rise_ns = min(rises) if rises else float("inf")
+
+        for pattern, budget, why in budget_list:
+            if re.match(pattern, name):
+                net.budget_ns, net.budget_why = budget, why
+                break
+        else:
+            if net.open_collector:
+                net.budget_ns, net.budget_why = OPEN_COLLECTOR_BUDGET
+            else:
+                net.budget_ns, net.budget_why = DEFAULT_BUDGET
+    return [net for net in nets.values() if net.worst_driver is not None]
+
+def format_ns(t):
+    if t is None:
+        return "-"
+    if t == float("inf"):
+        return "inf"
+    return "%.2f" % t
+
+def report(analysed, show_all=False, margin=0.5):
+    """Print nets that violate their budget, or are within margin (as a
+    fraction) of it, or all of them.  Returns the number of violations."""
+    analysed = sorted(analysed, key=lambda net: net.budget_ns - net.delay_ns)
+    print("%-22s %-9s %7s %-14s %8s %8s %9s  %s" % (
+        "net", "fpga", "C (pF)", "worst driver", "fall ns", "rise ns",
+        "budget ns", ""))
+    violations = 0
+    for net in analysed:
+        if not net.ok:
+            violations += 1
+        elif not show_all and net.delay_ns < net.budget_ns * margin:
+            continue
+        pins = ",".join("%s%s" % (pin, "(VREF)" if cls == "vref" else
+                                  "(cfg)" if cls == "config" else "")
+                        for pin, cls in net.fpga_pins) or "-"
+        print("%-22s %-9s %7.1f %-14s %8s %8s %9.2f  %s%s" % (
+            net.name, pins, net.load_pf, net.worst_driver,
+            format_ns(net.fall_ns), format_ns(net.rise_ns), net.budget_ns,
+            "VIOLATION: " if not net.ok else "", net.budget_why))
+    print("%d nets analysed, %d over budget" % (len(analysed), violations))
+    return violations
+
+def check(netlist_fn=NETLIST_FN, vhdl_fn=VHDL_TOP_FN, show_all=False,
+          fpga_drive_ohms=FPGA_DRIVE_OHMS, pullup_overrides=None, fast_sdram=None):
+    if fast_sdram is None:
+        fast_sdram = fpga_vhdl_generic(vhdl_fn, "FastSDRAM")
+        if fast_sdram is None:
+            print("FastSDRAM generic not found in %s; assuming true" % vhdl_fn)
+            fast_sdram = True
+    netlist = kicad_netlist.read_netlist(netlist_fn)
+    nets = build_nets(netlist, fpga_drive_ohms, pullup_overrides)
+    return report(analyse(nets, fast_sdram), show_all) == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-net RC timing check")
+    parser.add_argument("netlist", nargs="?", default=NETLIST_FN)
+    parser.add_argument("--vhdl", default=VHDL_TOP_FN,
+                        help="top level VHDL, to read the FastSDRAM generic")
+    parser.add_argument("--fast-sdram", choices=("true", "false"),
+                        help="override the FastSDRAM generic")
+    parser.add_argument("--fpga-drive", type=float, default=FPGA_DRIVE_OHMS,
+                        help="FPGA output impedance in ohms (default %(default)g)")
+    parser.add_argument("--pullup", action="append", default=[], metavar="NET=OHMS",
+                        help="pullup on the Electron side of an open collector net")
+    parser.add_argument("--all", action="store_true",
+                        help="show every net, not just the ones close to budget")
+    args = parser.parse_args()
+
+    pullups = {}
+    for spec in args.pullup:
+        net, _, ohms = spec.partition("=")
+        pullups[net] = parse_value(ohms)
+    fast_sdram = None if args.fast_sdram is None else args.fast_sdram == "true"
+    ok = check(args.netlist, args.vhdl, args.all, args.fpga_drive, pullups, fast_sdram)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
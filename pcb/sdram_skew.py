@@ -0,0 +1,232 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# This source file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This source file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# -------------
+# sdram_skew.py
+# -------------
+
+# Routed length and skew report for the SDRAM nets, measured from the board
+# file (no KiCad needed; see common/kicad_pcb_index.py).
+#
+# Each net's length is the sum of its track segments plus the vertical
+# distance through the board for every via it changes layers through.  That
+# is converted to a flight time (outer layers are microstrip, inner layers
+# stripline, so they're slightly different), and compared with sdram_CLK.
+#
+# With FastSDRAM, sdram_CLK comes from a PLL output shifted by -3 ns, so a
+# command launched on a clock_96 edge is captured by the SDRAM on the
+# sdram_CLK edge 7.4 ns later, and must still be valid on the one 3 ns
+# before.  A signal that arrives later than the clock (positive skew) eats
+# into the setup margin, and one that arrives earlier eats into the hold
+# margin.  Without FastSDRAM, everything runs at 48 MHz from registers,
+# giving a full 96 MHz cycle on each side.  For reads, the clock and DQ
+# flight times add up, so the round trip is reported as a fraction of the
+# clock period.
+#
+# Usage:
+#   python sdram_skew.py [max10_electron_ula.kicad_pcb] [--ps-per-mm 6.5]
+
+import argparse
+import math
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "common"))
+import kicad_pcb_index
+import rc_timing
+
+BOARD_FN = "max10_electron_ula.kicad_pcb"
+VHDL_TOP_FN = "../src/altera/ElectronULA_max10.vhd"
+PLL_FN = "../src/altera/max10_pll1.vhd"
+
+CLOCK_NET = "sdram_CLK"
+GROUPS = [
+    ("data", [r"^sdram_DQ\d+$", r"^sdram_[LU]DQM$"]),
+    ("address", [r"^sdram_A\d+$", r"^sdram_BA\d$"]),
+    ("control", [r"^sdram_(nCS|nRAS|nCAS|nWE|CKE)$"]),
+]
+
+# Copper depth below the top surface, for a 1.6 mm 4 layer board (JLC7628)
+LAYER_DEPTH_MM = {
+    "F.Cu": 0.0,
+    "In1.Cu": 0.21,
+    "In2.Cu": 1.39,
+    "B.Cu": 1.6,
+}
+OUTER_LAYERS = ("F.Cu", "B.Cu")
+
+# FR4 propagation delay: microstrip (Er_eff ~3.2) and stripline (Er ~4.3)
+OUTER_PS_PER_MM = 6.0
+INNER_PS_PER_MM = 6.9
+
+# MT48LC16M16A2-75 input setup/hold (address, command and write data)
+SDRAM_SETUP_NS = 1.5
+SDRAM_HOLD_NS = 0.8
+# Allowance for clock to output differences between FPGA pins
+FPGA_IO_SKEW_NS = 0.5
+
+def pll_phase_shift_ns(fn, output=1):
+    # clkN_phase_shift in the altpll generic map, in ns
+    with open(fn) as f:
+        m = re.search(r'clk%d_phase_shift\s*=>\s*"(-?\d+)"' % output, f.read())
+    return int(m.group(1)) / 1000.0 if m else None
+
+def via_transitions(segments, vias):
+    # For each via, the layers of the tracks that meet it
+    result = []
+    for x, y, size, drill, layers in vias:
+        r = size / 2.0 + 0.01
+        touching = set()
+        for x1, y1, x2, y2, width, layer in segments:
+            if math.hypot(x1 - x, y1 - y) <= r or math.hypot(x2 - x, y2 - y) <= r:
+                touching.add(layer)
+        depths = [LAYER_DEPTH_MM[l] for l in touching if l in LAYER_DEPTH_MM]
+        # A via that only meets one layer goes to a pad or plane on another;
+        # count the whole via to be safe.
+        if len(depths) > 1:
+            result.append(max(depths) - min(depths))
+        else:
+            result.append(LAYER_DEPTH_MM["B.Cu"])
+    return result
+
+class NetLength:
+    def __init__(self, index, net, outer_ps_per_mm, inner_ps_per_mm):
+        self.net = net
+        self.outer_mm = 0.0
+        self.inner_mm = 0.0
+        segments = index.segments(net)
+        for x1, y1, x2, y2, width, layer in segments:
+            length = math.hypot(x2 - x1, y2 - y1)
+            if layer in OUTER_LAYERS:
+                self.outer_mm += length
+            else:
+                self.inner_mm += length
+        transitions = via_transitions(segments, index.vias(net))
+        self.n_vias = len(transitions)
+        self.via_mm = sum(transitions)
+        self.delay_ps = (self.outer_mm * outer_ps_per_mm +
+                         (self.inner_mm + self.via_mm) * inner_ps_per_mm)
+
+    @property
+    def length_mm(self):
+        return self.outer_mm + self.inner_mm + self.via_mm
+
+def margins(fast_sdram, phase_ns, clock_mhz):
+    """Returns (setup window, hold window) in ns at the FPGA pins, before
+    the SDRAM's own setup/hold and any PCB skew."""
+    period = 1000.0 / clock_mhz
+    if fast_sdram:
+        return period + phase_ns, -phase_ns
+    # 48 MHz: signals change on one clock_96 edge, sdram_CLK rises on the next
+    period_96 = 1000.0 / 96
+    return period_96, period_96
+
+def report(index, fast_sdram, phase_ns, outer_ps_per_mm=OUTER_PS_PER_MM,
+           inner_ps_per_mm=INNER_PS_PER_MM, max_share=0.1):
+    """Print the length/skew report.  Returns the number of nets flagged."""
+    clock_mhz = 96.0 if fast_sdram else 48.0
+    setup_window, hold_window = margins(fast_sdram, phase_ns, clock_mhz)
+    setup_margin = setup_window - SDRAM_SETUP_NS - FPGA_IO_SKEW_NS
+    hold_margin = hold_window - SDRAM_HOLD_NS - FPGA_IO_SKEW_NS
+    print("SDRAM clock %d MHz (FastSDRAM=%s, sdram_CLK phase %+.1f ns)" % (
+        clock_mhz, fast_sdram, phase_ns if fast_sdram else 0))
+    print("Margin before PCB skew: setup %.2f ns, hold %.2f ns; flagging skew "
+          "using more than %d%% of either" % (setup_margin, hold_margin, max_share * 100))
+
+    if CLOCK_NET not in index.nets:
+        print("%s is not on the board!" % CLOCK_NET)
+        return 1
+    clock = NetLength(index, CLOCK_NET, outer_ps_per_mm, inner_ps_per_mm)
+    print("%s: %.2f mm, %d vias, %.0f ps" % (
+        CLOCK_NET, clock.length_mm, clock.n_vias, clock.delay_ps))
+
+    flagged = 0
+    for group, patterns in GROUPS:
+        nets = sorted(
+            (n for n in index.net_names() if any(re.match(p, n) for p in patterns)),
+            key=lambda n: [int(s) if s.isdigit() else s for s in re.split(r"(\d+)", n)])
+        if not nets:
+            continue
+        lengths = [NetLength(index, n, outer_ps_per_mm, inner_ps_per_mm) for n in nets]
+        print()
+        print("%s (%d nets)" % (group, len(nets)))
+        print("  %-12s %9s %5s %9s %9s  %s" % (
+            "net", "length mm", "vias", "delay ps", "skew ps", ""))
+        for length in lengths:
+            skew_ns = (length.delay_ps - clock.delay_ps) / 1000.0
+            notes = []
+            if skew_ns > 0 and skew_ns > setup_margin * max_share:
+                notes.append("uses %d%% of setup margin" % (skew_ns * 100 / setup_margin))
+            elif skew_ns < 0 and -skew_ns > hold_margin * max_share:
+                notes.append("uses %d%% of hold margin" % (-skew_ns * 100 / hold_margin))
+            if group == "data":
+                round_trip = (length.delay_ps + clock.delay_ps) / 1000.0
+                share = round_trip * clock_mhz / 1000.0
+                if share > max_share:
+                    notes.append("read round trip %.0f ps is %d%% of the clock period" % (
+                        round_trip * 1000, share * 100))
+            if notes:
+                flagged += 1
+            print("  %-12s %9.2f %5d %9.0f %+9.0f  %s" % (
+                length.net, length.length_mm, length.n_vias, length.delay_ps,
+                skew_ns * 1000, "; ".join(notes)))
+        delays = [l.delay_ps for l in lengths]
+        print("  spread %.0f ps (%.0f to %+.0f ps relative to %s)" % (
+            max(delays) - min(delays), min(delays) - clock.delay_ps,
+            max(delays) - clock.delay_ps, CLOCK_NET))
+    print()
+    print("%d SDRAM nets flagged" % flagged)
+    return flagged
+
+def main():
+    parser = argparse.ArgumentParser(description="SDRAM trace length and skew report")
+    parser.add_argument("board", nargs="?", default=BOARD_FN)
+    parser.add_argument("--vhdl", default=VHDL_TOP_FN,
+                        help="top level VHDL, to read the FastSDRAM generic")
+    parser.add_argument("--pll", default=PLL_FN,
+                        help="PLL VHDL, to read the sdram_CLK phase shift")
+    parser.add_argument("--fast-sdram", choices=("true", "false"),
+                        help="override the FastSDRAM generic")
+    parser.add_argument("--ps-per-mm", type=float,
+                        help="propagation delay for all layers (default %g outer, %g inner)" % (
+                            OUTER_PS_PER_MM, INNER_PS_PER_MM))
+    parser.add_argument("--max-share", type=float, default=10,
+                        help="flag skew using more than this %% of the margin (default %(default)g)")
+    args = parser.parse_args()
+
+    if args.fast_sdram is not None:
+        fast_sdram = args.fast_sdram == "true"
+    else:
+        fast_sdram = rc_timing.fpga_vhdl_generic(args.vhdl, "FastSDRAM")
+        if fast_sdram is None:
+            print("FastSDRAM generic not found in %s; assuming true" % args.vhdl)
+            fast_sdram = True
+    phase_ns = pll_phase_shift_ns(args.pll)
+    if phase_ns is None:
+        print("No clk1_phase_shift in %s" % args.pll)
+        sys.exit(1)
+    outer = inner = args.ps_per_mm
+    if args.ps_per_mm is None:
+        outer, inner = OUTER_PS_PER_MM, INNER_PS_PER_MM
+
+    index = kicad_pcb_index.load_index(args.board)
+    flagged = report(index, fast_sdram, phase_ns, outer, inner, args.max_share / 100.0)
+    sys.exit(1 if flagged else 0)
+
+if __name__ == '__main__':
+    main()
@@ -61,6 +61,7 @@ here = os.path.dirname(sys.argv[0])
 sys.path.insert(0, os.path.join(here, "../pcb/myelin-kicad.pretty"))
 import myelin_kicad_pcb
 Pin = myelin_kicad_pcb.Pin
+import video_levels
 
 
 caps = [
@@ -205,5 +206,7 @@ vga_out = [
 ]
 
 myelin_kicad_pcb.dump_netlist("%s.net" % PROJECT_NAME)
+# Levels and edge times at the VGA connector and the EL1883 input
+video_levels.check("%s.net" % PROJECT_NAME)
 myelin_kicad_pcb.dump_bom("bill_of_materials.txt",
                           "readable_bill_of_materials.txt")
@@ -0,0 +1,288 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# ---------------
+# video_levels.py
+# ---------------
+
+# Signal levels and edge times for the rgb_to_vga outputs, worked out from
+# the component values in the netlist rather than from the comments in
+# rgb_to_vga.py.
+#
+# Each output is traced back from its connector pin: through any series
+# resistor to the buffer that drives it (drive impedance and swing come from
+# the part models in ../pcb/rc_timing.py), with the far end modelled as the
+# monitor's termination plus the cable capacitance:
+#
+# - R/G/B: 75R to GND in the monitor.  The high level should be 0.7 V, and
+#   more than 10% over that overdrives the monitor.
+# - HS/VS: 2k to 5V in the monitor.  Both levels must meet TTL thresholds.
+# - CSYNC into the EL1883, via the resistor divider and coupling cap: the
+#   swing must be in the 0.5-2 V p-p input range.  This one is on the board,
+#   so it has no cable.
+#
+# Edges are a single-pole RC (Thevenin resistance of the driver, series
+# resistor and termination, into the cable + input capacitance).  An output
+# that doesn't settle to within 5% of its final level in one 16 MHz pixel
+# smears into the next pixel; one that takes more than half a pixel gets a
+# warning.
+#
+#   python video_levels.py [rgb_to_vga.net] [--cable-pf 120] [--all]
+
+import argparse
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../pcb"))
+import kicad_netlist
+import rc_timing
+from rc_timing import parse_value
+
+NETLIST_FN = "rgb_to_vga.net"
+
+# Electron pixel clock
+PIXEL_MHZ = 16.0
+PIXEL_NS = 1000.0 / PIXEL_MHZ
+# Settled means within this fraction of the final level
+SETTLE_FRACTION = 0.05
+
+# About 1.8 m of VGA cable at ~65 pF/m
+CABLE_PF = 120.0
+MONITOR_INPUT_PF = 10.0
+# The EL1883 datasheet doesn't give an input capacitance; this is a guess
+EL1883_INPUT_PF = 5.0
+
+# (VGA connector pin, name, kind)
+VGA_PINS = [
+    ("1", "R", "video"),
+    ("2", "G", "video"),
+    ("3", "B", "video"),
+    ("13", "HS", "sync"),
+    ("14", "VS", "sync"),
+]
+VGA_VIDEO_TERMINATION = 75.0
+VIDEO_FULL_SCALE = 0.7
+VIDEO_TOLERANCE = 0.1
+VGA_SYNC_PULLUP = 2000.0
+VGA_SYNC_PULLUP_V = 5.0
+
+EL1883_VALUE = "EL1883"
+EL1883_VIDEO_IN_PIN = "2"
+EL1883_MIN_VPP = 0.5
+EL1883_MAX_VPP = 2.0
+
+POWER_NETS = ("GND", "5V")
+
+def parallel(*rs):
+    return 1.0 / sum(1.0 / r for r in rs)
+
+def passives_on(netlist, net, lib):
+    """[(ref, parsed value, other net)] for fitted two pin parts from the given
+    footprint library (Resistor_SMD etc) on a net."""
+    found = []
+    for ref, pin in netlist.nets.get(net, []):
+        value, footprint = netlist.components[ref]
+        if not (footprint or "").startswith(lib + ":"):
+            continue
+        ohms = parse_value(value)
+        pins = netlist.pins_of(ref)
+        if ohms is None or len(pins) != 2:
+            continue
+        other = [n for p, n in pins.items() if p != pin][0]
+        found.append((ref, ohms, other))
+    return found
+
+def driver_on(netlist, net):
+    """(ref, part model) for the buffer driving a net, or (None, None)."""
+    for ref, pin in netlist.nets.get(net, []):
+        value, footprint = netlist.components[ref]
+        part = rc_timing.part_model(value)
+        if part.drive_ohms and part.can_drive(pin, netlist.pins_of(ref)):
+            return ref, part
+    return None, None
+
+def trace_back(netlist, net):
+    """Follows a series resistor back from net to its driver.  Returns
+    (series ohms, series refs, driver ref, part, shunts to GND on net)."""
+    series = 0.0
+    refs = []
+    shunts = []
+    source = net
+    for ref, ohms, other in passives_on(netlist, net, "Resistor_SMD"):
+        if other == "GND":
+            shunts.append(ohms)
+        elif other not in POWER_NETS:
+            series += ohms
+            refs.append(ref)
+            source = other
+    driver, part = driver_on(netlist, source)
+    return series, refs, driver, part, shunts
+
+class Output:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path        # e.g. "BUF -> R7 -> 75R"
+        self.low_v = None
+        self.high_v = None
+        self.load_pf = None
+        self.tau_ns = None
+        self.settle_ns = None
+        self.problems = []      # [(severity, message)]
+
+    def edge(self, r_th, load_pf):
+        self.load_pf = load_pf
+        self.tau_ns = r_th * load_pf * 1e-3
+        self.settle_ns = self.tau_ns * math.log(1.0 / SETTLE_FRACTION)
+        if self.settle_ns > PIXEL_NS:
+            self.problems.append(("error", "smears: settles in %.1f ns, more than a %.1f ns pixel" % (
+                self.settle_ns, PIXEL_NS)))
+        elif self.settle_ns > PIXEL_NS / 2:
+            self.problems.append(("warning", "settles in %.1f ns, over half a pixel" %
+                                  self.settle_ns))
+
+def video_output(name, netlist, net, cable_pf):
+    series, refs, driver, part, shunts = trace_back(netlist, net)
+    out = Output(name, " -> ".join([driver or "?"] + refs + ["75R"]))
+    if not part:
+        out.problems.append(("error", "no driver found for %s" % net))
+        return out
+    r_source = part.drive_ohms + series
+    r_load = parallel(VGA_VIDEO_TERMINATION, *shunts)
+    out.low_v = 0.0
+    out.high_v = part.swing * r_load / (r_source + r_load)
+    # The series resistor that would give exactly full scale
+    ideal = part.swing * r_load / VIDEO_FULL_SCALE - r_load - part.drive_ohms
+    if out.high_v > VIDEO_FULL_SCALE * (1 + VIDEO_TOLERANCE):
+        out.problems.append(("error", "overdrives the monitor: %.2f V into 75R "
+                             "(max %.2f V; %.0fR would give %.1f V)" % (
+                                 out.high_v, VIDEO_FULL_SCALE * (1 + VIDEO_TOLERANCE),
+                                 ideal, VIDEO_FULL_SCALE)))
+    elif out.high_v < VIDEO_FULL_SCALE * (1 - VIDEO_TOLERANCE):
+        out.problems.append(("warning", "dim: %.2f V into 75R (%.0fR would give %.1f V)" % (
+            out.high_v, ideal, VIDEO_FULL_SCALE)))
+    out.edge(parallel(r_source, r_load), cable_pf + MONITOR_INPUT_PF)
+    return out
+
+def sync_output(name, netlist, net, cable_pf):
+    series, refs, driver, part, shunts = trace_back(netlist, net)
+    out = Output(name, " -> ".join([driver or "?"] + refs + ["2k to 5V"]))
+    if not part:
+        out.problems.append(("error", "no driver found for %s" % net))
+        return out
+    r_source = part.drive_ohms + series
+    # Driving low fights the pullup; high, both pull to about the same rail
+    out.low_v = VGA_SYNC_PULLUP_V * r_source / (r_source + VGA_SYNC_PULLUP)
+    out.high_v = part.swing + (VGA_SYNC_PULLUP_V - part.swing) * r_source / (
+        r_source + VGA_SYNC_PULLUP)
+    if out.low_v > rc_timing.VIL:
+        out.problems.append(("error", "low level %.2f V is above VIL (%.1f V)" % (
+            out.low_v, rc_timing.VIL)))
+    if out.high_v < rc_timing.VIH:
+        out.problems.append(("error", "high level %.2f V is below VIH (%.1f V)" % (
+            out.high_v, rc_timing.VIH)))
+    if shunts:
+        out.problems.append(("warning", "resistor to GND on %s loads the sync line" % net))
+    out.edge(parallel(r_source, VGA_SYNC_PULLUP), cable_pf + MONITOR_INPUT_PF)
+    return out
+
+def csync_divider(netlist):
+    refs = [ref for ref, (value, fp) in netlist.components.items()
+            if (value or "").startswith(EL1883_VALUE)]
+    if not refs:
+        return None
+    sync = refs[0]
+    coupled = netlist.pins_of(sync).get(EL1883_VIDEO_IN_PIN)
+    # Back through the coupling cap to the divider
+    divided = coupled
+    for ref, farads, other in passives_on(netlist, coupled, "Capacitor_SMD"):
+        if other not in POWER_NETS:
+            divided = other
+    series, refs, driver, part, shunts = trace_back(netlist, divided)
+    out = Output("CSYNC", " -> ".join([driver or "?"] + refs + [sync]))
+    if not part:
+        out.problems.append(("error", "no driver found for %s" % divided))
+        return out
+    r_source = part.drive_ohms + series
+    if not shunts:
+        out.problems.append(("error", "no divider resistor from %s to GND" % divided))
+        shunts = [float("inf")]
+    r_load = parallel(*shunts)
+    out.low_v = 0.0
+    out.high_v = part.swing * r_load / (r_source + r_load)
+    if not EL1883_MIN_VPP <= out.high_v <= EL1883_MAX_VPP:
+        out.problems.append(("error", "%.2f V p-p is outside the EL1883's %.1f-%.1f V input range" % (
+            out.high_v, EL1883_MIN_VPP, EL1883_MAX_VPP)))
+    # On the board, so no cable; a few pF of trace plus the input
+    out.edge(parallel(r_source, r_load), EL1883_INPUT_PF + rc_timing.TRACE_PF_PER_PIN * 3)
+    return out
+
+def analyse(netlist, cable_pf=CABLE_PF):
+    outputs = []
+    vga = [ref for ref, (value, fp) in netlist.components.items() if value == "VGA"]
+    vga_pins = netlist.pins_of(vga[0]) if vga else {}
+    for pin, name, kind in VGA_PINS:
+        net = vga_pins.get(pin)
+        if not net:
+            continue
+        if kind == "video":
+            outputs.append(video_output(name, netlist, net, cable_pf))
+        else:
+            outputs.append(sync_output(name, netlist, net, cable_pf))
+    divider = csync_divider(netlist)
+    if divider:
+        outputs.append(divider)
+    return outputs
+
+def format_v(v):
+    return "-" if v is None else "%.2f" % v
+
+def report(outputs, show_all=False):
+    """Prints the outputs with problems (or all of them).  Returns the
+    number of errors."""
+    print("%-6s %-26s %6s %6s %7s %7s %9s  %s" % (
+        "output", "path", "low V", "high V", "C (pF)", "tau ns", "settle ns", ""))
+    errors = 0
+    for out in outputs:
+        errors += sum(1 for severity, _ in out.problems if severity == "error")
+        if not out.problems and not show_all:
+            continue
+        print("%-6s %-26s %6s %6s %7s %7s %9s  %s" % (
+            out.name, out.path, format_v(out.low_v), format_v(out.high_v),
+            "-" if out.load_pf is None else "%.1f" % out.load_pf,
+            "-" if out.tau_ns is None else "%.2f" % out.tau_ns,
+            "-" if out.settle_ns is None else "%.2f" % out.settle_ns,
+            "; ".join("%s: %s" % p for p in out.problems) or "ok"))
+    print("%d outputs analysed at %g MHz pixel clock, %d errors" % (
+        len(outputs), PIXEL_MHZ, errors))
+    return errors
+
+def check(netlist_fn=NETLIST_FN, cable_pf=CABLE_PF, show_all=False):
+    netlist = kicad_netlist.read_netlist(netlist_fn)
+    return report(analyse(netlist, cable_pf), show_all) == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Video levels and edge times for rgb_to_vga")
+    parser.add_argument("netlist", nargs="?", default=NETLIST_FN)
+    parser.add_argument("--cable-pf", type=float, default=CABLE_PF,
+                        help="VGA cable capacitance in pF (default %(default)g)")
+    parser.add_argument("--all", action="store_true",
+                        help="show every output, not just the ones with problems")
+    args = parser.parse_args()
+    sys.exit(0 if check(args.netlist, args.cable_pf, args.all) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Convert a raw logic analyser capture (one byte per sample, as read by
+# analyze.c) into a VCD file that can be opened in a waveform viewer.  If the
+# output filename ends in .fst, the VCD is passed through GTKWave's vcd2fst.
+#
+# The capture is read in fixed size chunks and only transitions are written
+# out, so memory use doesn't depend on the length of the capture.
+#
+# Usage:
+#   python capture_to_vcd.py capture.bin capture.vcd
+#   python capture_to_vcd.py --start 20ms --end 60ms capture.bin frame.fst
+#   python capture_to_vcd.py --signal 3=hsync --signal 4=phi0 capture.bin out.vcd
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# analyze.c samples at 8 x 16MHz (UNITS = 8)
+DEFAULT_SAMPLE_RATE = 128000000
+
+# Bit assignments used by analyze.c
+DEFAULT_SIGNALS = {
+    0: "csync",
+    1: "irq",
+    2: "blue",
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+# Matches a run of identical (masked) samples
+RUN_RE = re.compile(b"(.)\\1*", re.S)
+
+def parse_time(s, sample_rate):
+    # Returns a sample number.  Accepts a plain sample count, or a number
+    # with a s/ms/us/ns suffix.
+    m = re.match(r"^\s*([0-9.]+)\s*(s|ms|us|ns)?\s*$", s)
+    if not m:
+        raise ValueError("Can't parse time %r" % s)
+    value, unit = m.groups()
+    if unit is None:
+        return int(value)
+    scale = {"s": 1, "ms": 1e-3, "us": 1e-6, "ns": 1e-9}[unit]
+    return int(round(float(value) * scale * sample_rate))
+
+def parse_signals(specs):
+    signals = dict(DEFAULT_SIGNALS)
+    for spec in specs:
+        bit, _, name = spec.partition("=")
+        bit = int(bit)
+        if not 0 <= bit <= 7:
+            raise ValueError("Bit number must be 0-7 in %r" % spec)
+        if name:
+            signals[bit] = name
+        else:
+            signals.pop(bit, None)
+    return signals
+
+def vcd_id(n):
+    # Short printable identifier codes, as used by most VCD writers
+    chars = ''.join(chr(c) for c in range(33, 127))
+    ident = chars[n % len(chars)]
+    n //= len(chars)
+    while n:
+        ident += chars[n % len(chars)]
+        n //= len(chars)
+    return ident
+
+def write_header(out, signals, sample_rate, source):
+    out.write("$date %s $end\n" % time.ctime())
+    out.write("$version capture_to_vcd.py (%s) $end\n" % os.path.basename(source))
+    out.write("$timescale 1ps $end\n")
+    out.write("$scope module ula $end\n")
+    for bit, name in sorted(signals.items()):
+        out.write("$var wire 1 %s %s $end\n" % (vcd_id(bit), name))
+    out.write("$upscope $end\n")
+    out.write("$enddefinitions $end\n")
+
+def convert(capture, out, signals, sample_rate=DEFAULT_SAMPLE_RATE,
+            start=0, end=None, chunk_size=CHUNK_SIZE):
+    mask = 0
+    for bit in signals:
+        mask |= 1 << bit
+    # Translating with this table zeroes out bits we're not interested in,
+    # so changes on unused channels don't produce runs.
+    table = bytes(c & mask for c in range(256))
+    bits = sorted(signals)
+    ids = dict((bit, vcd_id(bit)) for bit in bits)
+
+    def timestamp(sample):
+        return sample * 1000000000000 // sample_rate
+
+    def write_changes(sample, old, new):
+        changed = old ^ new
+        out.write("#%d\n" % timestamp(sample))
+        for bit in bits:
+            if changed & (1 << bit):
+                out.write("%d%s\n" % ((new >> bit) & 1, ids[bit]))
+
+    write_header(out, signals, sample_rate, capture.name)
+
+    capture.seek(start)
+    pos = start
+    last = None
+    n_transitions = 0
+    while end is None or pos < end:
+        size = chunk_size if end is None else min(chunk_size, end - pos)
+        chunk = capture.read(size)
+        if not chunk:
+            break
+        chunk = chunk.translate(table)
+        for m in RUN_RE.finditer(chunk):
+            value = ord(m.group(1))
+            if last is None:
+                out.write("#%d\n$dumpvars\n" % timestamp(pos))
+                for bit in bits:
+                    out.write("%d%s\n" % ((value >> bit) & 1, ids[bit]))
+                out.write("$end\n")
+            elif value != last:
+                write_changes(pos + m.start(), last, value)
+                n_transitions += 1
+            last = value
+        pos += len(chunk)
+
+    # Mark the end of the capture so viewers show the full window
+    out.write("#%d\n" % timestamp(pos))
+    return pos - start, n_transitions
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a byte-per-sample capture into VCD or FST")
+    parser.add_argument("capture", help="raw capture file")
+    parser.add_argument("output", help="output .vcd or .fst file")
+    parser.add_argument("--rate", type=float, default=DEFAULT_SAMPLE_RATE,
+                        help="sample rate in Hz (default %(default)d)")
+    parser.add_argument("--signal", action="append", default=[],
+                        metavar="BIT=NAME",
+                        help="name an extra bit, or BIT= to drop one")
+    parser.add_argument("--start", default="0",
+                        help="start of window (samples, or with s/ms/us/ns suffix)")
+    parser.add_argument("--end", default=None,
+                        help="end of window (samples, or with s/ms/us/ns suffix)")
+    args = parser.parse_args()
+
+    sample_rate = int(args.rate)
+    signals = parse_signals(args.signal)
+    if not signals:
+        print("No signals selected")
+        sys.exit(1)
+    start = parse_time(args.start, sample_rate)
+    end = parse_time(args.end, sample_rate) if args.end is not None else None
+
+    fst = args.output.lower().endswith(".fst")
+    if fst:
+        vcd2fst = shutil.which("vcd2fst")
+        if not vcd2fst:
+            print("vcd2fst (from GTKWave) is required to write .fst files")
+            sys.exit(1)
+        fd, vcd_fn = tempfile.mkstemp(suffix=".vcd")
+        os.close(fd)
+    else:
+        vcd_fn = args.output
+
+    t0 = time.time()
+    try:
+        with open(args.capture, "rb") as capture, open(vcd_fn, "w") as out:
+            n_samples, n_transitions = convert(capture, out, signals,
+                                               sample_rate, start, end)
+        if fst:
+            subprocess.check_call([vcd2fst, vcd_fn, args.output])
+    finally:
+        if fst:
+            os.unlink(vcd_fn)
+
+    print("%d samples (%.3f ms), %d transitions written to %s in %.1f s" % (
+        n_samples, n_samples * 1000.0 / sample_rate, n_transitions,
+        args.output, time.time() - t0))
+
+if __name__ == '__main__':
+    main()
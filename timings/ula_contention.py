@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cycle-level model of the ULA's CPU clock generation, to predict how fast
+# 6502 code will run in a given screen mode and turbo setting.
+#
+# This mirrors the clk_gen1 process in src/common/ElectronULA.vhd tick by
+# tick at 16MHz: the CPU clock is stopped on RAM and IO accesses and held
+# while the video logic is fetching pixels in the 80 column modes (0-3),
+# and ROM/IO accesses are limited to 2MHz/1MHz in the faster turbo modes.
+#
+# Input is either a trace with one memory access (CPU cycle) per line --
+# the first 4-digit hex number on the line is taken as the address -- or an
+# access mix like ram=40,rom=55,io=5, which is turned into a pseudo-random
+# sequence of accesses.
+#
+# Usage:
+#   python ula_contention.py --mode 0 --turbo 1 --mix ram=40,rom=60
+#   python ula_contention.py --table --trace bus_trace.txt
+#   python ula_contention.py --validate ferranti_ula/*.log
+
+import argparse
+import glob
+import itertools
+import os
+import random
+import re
+import sys
+
+CLOCK = 16000000
+
+# Video timing, in 16MHz ticks and lines (TV output, not VGA)
+TICKS_PER_LINE = 1024  # h_total = 1023
+H_ACTIVE = 640
+HSYNC_START = 768
+LINES_PER_FIELD = (312, 313)  # v_total = 311 / 312 (interlaced even field)
+V_ACTIVE_GPH = 256
+V_ACTIVE_TXT = 250
+V_DISP_GPH = 255  # display interrupt line in graphics modes
+V_DISP_TXT = 249  # display interrupt line in text modes
+V_RTC = 99
+
+# mode: (mode_40, mode_text) as set by the ULA's register 7 decode
+MODES = {
+    0: (False, False),
+    1: (False, False),
+    2: (False, False),
+    3: (False, True),
+    4: (True, False),
+    5: (True, False),
+    6: (True, True),
+    # Mode 7 is handled by the Jafa 6845/SAA5050 implementation, which reads
+    # from the dual port RAM without holding off the CPU, and register 7
+    # decodes as mode 4.
+    7: (True, False),
+}
+
+TURBO_NAMES = {
+    0: "1MHz",
+    1: "2MHz/1MHz with contention",
+    2: "2MHz no contention",
+    3: "4MHz no contention",
+}
+
+NOMINAL_MHZ = {0: 1, 1: 2, 2: 2, 3: 4}
+
+RAM, ROM, IO = 0, 1, 2
+KIND_NAMES = ("RAM", "ROM", "IO")
+
+def classify(addr, kbd_rom=False):
+    # Matches io_access/rom_access/ram_access in ElectronULA.vhd.  kbd_rom
+    # means the keyboard (paged ROM 8 or 9) is selected, which makes reads
+    # from &8000-&BFFF IO accesses.
+    page = addr >> 8
+    if page in (0xFC, 0xFD, 0xFE):
+        return IO
+    if kbd_rom and 0x80 <= page < 0xC0:
+        return IO
+    if addr & 0x8000:
+        return ROM
+    return RAM
+
+def contention_map(mode, field, interlaced=True):
+    # One byte per 16MHz tick of the field, 1 where the video logic holds
+    # off RAM accesses.  This is the unsynchronised 'contention' signal.
+    mode_40, mode_text = MODES[mode]
+    n_lines = LINES_PER_FIELD[field if interlaced else 0]
+    contended_line = b"\x01" * H_ACTIVE + b"\x00" * (TICKS_PER_LINE - H_ACTIVE)
+    idle_line = b"\x00" * TICKS_PER_LINE
+    if mode_40:
+        return bytearray(idle_line * n_lines)
+    lines = []
+    for line in range(n_lines):
+        if mode_text:
+            # 10 line character rows, the last two of which are blank
+            active = line < V_ACTIVE_TXT and line % 10 < 8
+        else:
+            active = line < V_ACTIVE_GPH
+        lines.append(contended_line if active else idle_line)
+    return bytearray(b"".join(lines))
+
+def field_events(mode, interlaced=True):
+    # Tick positions of the RTC and display interrupts and the field lengths,
+    # for comparison with the logic analyser captures.
+    mode_text = MODES[mode][1]
+    disp_line = V_DISP_TXT if mode_text else V_DISP_GPH
+    field0 = LINES_PER_FIELD[0] * TICKS_PER_LINE
+    field1 = LINES_PER_FIELD[1 if interlaced else 0] * TICKS_PER_LINE
+    rtc_to_display = (disp_line - V_RTC) * TICKS_PER_LINE + HSYNC_START
+    # Field 0 RTC interrupt is at the start of the line, field 1 is half way
+    # through it
+    rtc_offset = TICKS_PER_LINE // 2 if interlaced else 0
+    return {
+        "rtc_to_display": (rtc_to_display, rtc_to_display - rtc_offset),
+        "rtc_to_rtc": (field0 + rtc_offset, field1 - rtc_offset),
+        "frame": (field0 + field1, field0 + field1),
+    }
+
+def simulate(accesses, mode, turbo, n_fields=2, interlaced=True,
+             limit_rom=True, limit_io=True):
+    """Run accesses (an iterable of RAM/ROM/IO kinds) through the clock
+    generator for n_fields video fields, or until accesses runs out.
+
+    Returns a dict of results."""
+    maps = [contention_map(mode, f, interlaced) for f in (0, 1)]
+    end_tick = 0
+    for f in range(n_fields):
+        end_tick += len(maps[f % 2])
+    field_ends = list(itertools.accumulate(
+        len(maps[f % 2]) for f in range(n_fields)))
+
+    cycles = [0, 0, 0]
+    ticks_by_kind = [0, 0, 0]
+
+    accesses = iter(accesses)
+    kind = next(accesses, None)
+    if kind is None:
+        raise ValueError("No accesses to simulate")
+    ram = kind == RAM
+    io = kind == IO
+    rom = kind == ROM
+
+    counter = 0
+    stopped = 0
+    clken = 0
+    contention1 = contention2 = 0
+    field = 0
+    cmap = maps[0]
+    field_start = 0
+    field_end = field_ends[0]
+    access_start = 0
+    tick = 0
+    while tick < end_tick:
+        if tick == field_end:
+            field += 1
+            cmap = maps[field % 2]
+            field_start = tick
+            field_end = field_ends[field]
+        contention = cmap[tick - field_start]
+
+        # This is a direct translation of clk_gen1; everything on the right
+        # hand side is the value before the clock edge.
+        new_clken = 0
+        if turbo == 0:
+            new_clken = counter == 15
+            new_stopped = 0
+        elif turbo == 1:
+            new_clken = (counter & 7) == 7 and stopped == 0
+            new_stopped = stopped
+            if stopped == 0 and (counter & 7) == 6 and (ram or io):
+                new_stopped = 1
+            elif counter == 14 and not (ram and contention2):
+                new_stopped = 0
+        elif turbo == 2:
+            new_clken = (counter & 7) == 7 and stopped == 0
+            new_stopped = stopped
+            if limit_io and stopped == 0 and (counter & 7) == 6 and io:
+                new_stopped = 1
+            elif counter == 14:
+                new_stopped = 0
+        else:
+            new_clken = (counter & 3) == 3 and stopped == 0
+            new_stopped = stopped
+            if stopped == 0:
+                if limit_rom and rom and (counter & 3) == 2:
+                    new_stopped = 1
+                elif limit_io and io and (counter & 3) == 2:
+                    if (counter >> 2) in (0, 3):
+                        new_stopped = 1
+                    else:
+                        new_stopped = 2
+            elif rom:
+                if (counter & 7) == 6:
+                    new_stopped = 0
+            elif counter == 14:
+                new_stopped = 1 if stopped & 2 else 0
+
+        if clken:
+            # The CPU completes its cycle on this edge, and puts the address
+            # for the next one on the bus.
+            cycles[kind] += 1
+            ticks_by_kind[kind] += tick + 1 - access_start
+            access_start = tick + 1
+            kind = next(accesses, None)
+            if kind is None:
+                tick += 1
+                break
+            ram = kind == RAM
+            io = kind == IO
+            rom = kind == ROM
+
+        clken = new_clken
+        stopped = new_stopped
+        contention2 = contention1
+        contention1 = contention
+        counter = (counter + 1) & 15
+        tick += 1
+
+    total_cycles = sum(cycles)
+    seconds = float(tick) / CLOCK
+    n_fields_run = float(tick) / (end_tick / float(n_fields))
+    nominal_ticks = CLOCK // (NOMINAL_MHZ[turbo] * 1000000)
+    stall_ticks = [ticks_by_kind[k] - cycles[k] * nominal_ticks
+                   for k in (RAM, ROM, IO)]
+    return {
+        "ticks": tick,
+        "cycles": total_cycles,
+        "cycles_by_kind": cycles,
+        "effective_mhz": total_cycles / seconds / 1e6 if seconds else 0,
+        "fields": n_fields_run,
+        "cycles_per_field": total_cycles / n_fields_run if n_fields_run else 0,
+        # In units of nominal CPU cycles
+        "stalls_per_field": [s / float(nominal_ticks) / n_fields_run
+                             for s in stall_ticks] if n_fields_run else [0] * 3,
+    }
+
+def parse_mix(spec):
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip().lower()
+        if name not in ("ram", "rom", "io"):
+            raise ValueError("Unknown access type %r in mix (use ram, rom, io)" % name)
+        weights[("ram", "rom", "io").index(name)] = float(weight or 1)
+    return weights
+
+def mix_accesses(weights, seed=1):
+    rng = random.Random(seed)
+    kinds = sorted(weights)
+    cum = list(itertools.accumulate(weights[k] for k in kinds))
+    while True:
+        r = rng.random() * cum[-1]
+        for k, c in zip(kinds, cum):
+            if r < c:
+                yield k
+                break
+
+def trace_accesses(fn, kbd_rom=False, repeat=True):
+    # Read the trace once and replay it as often as needed to fill the
+    # requested number of fields.
+    hex_re = re.compile(r"\b([0-9A-Fa-f]{4})\b")
+    kinds = bytearray()
+    with open(fn) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            m = hex_re.search(line)
+            if m:
+                kinds.append(classify(int(m.group(1), 16), kbd_rom))
+    if not kinds:
+        raise ValueError("No accesses found in %s" % fn)
+    while True:
+        for k in kinds:
+            yield k
+        if not repeat:
+            return
+
+def print_result(mode, turbo, r):
+    print("Mode %d, turbo %d (%s): %.3f MHz effective, %d cycles/field" % (
+        mode, turbo, TURBO_NAMES[turbo], r["effective_mhz"],
+        r["cycles_per_field"]))
+    for k in (RAM, ROM, IO):
+        if r["cycles_by_kind"][k]:
+            print("  %-3s %6.1f%% of cycles, %8.0f stall cycles/field" % (
+                KIND_NAMES[k], 100.0 * r["cycles_by_kind"][k] / r["cycles"],
+                r["stalls_per_field"][k]))
+
+# Captures from analyze.c report times in 16MHz ticks
+LOG_RE = re.compile(r"^irq at (\d+) line (-?\d+)")
+FRAME_RE = re.compile(r"^frame length: (\d+)")
+
+def validate(log_fns, tolerance=16):
+    """Compare the model's frame timing against analyze.c output from the
+    real ULAs.  Returns True if everything is within tolerance (ticks)."""
+    ok = True
+    for fn in log_fns:
+        m = re.search(r"mode(\d)", os.path.basename(fn))
+        if not m:
+            print("%s: can't tell screen mode from filename; skipping" % fn)
+            continue
+        mode = int(m.group(1))
+        expected = field_events(mode, interlaced=True)
+        disp_line = (V_DISP_TXT if MODES[mode][1] else V_DISP_GPH) + 1
+        rtc_line = V_RTC
+
+        # Each measurement is (field, ticks)
+        measured = {"rtc_to_display": [], "rtc_to_rtc": [], "frame": []}
+        last_rtc = None
+        last_t = -1
+        with open(fn) as f:
+            for line in f:
+                m = LOG_RE.match(line)
+                if m:
+                    t, irq_line = int(m.group(1)), int(m.group(2))
+                    if t < last_t:
+                        # analyze.c restarted its timebase at the top of
+                        # the frame
+                        last_rtc = None
+                    last_t = t
+                    # The timebase starts at the top of field 0
+                    field = 0 if t < expected["rtc_to_rtc"][0] else 1
+                    if irq_line == rtc_line:
+                        if last_rtc is not None:
+                            measured["rtc_to_rtc"].append((1 - field, t - last_rtc))
+                        last_rtc = t
+                    elif irq_line == disp_line and last_rtc is not None:
+                        measured["rtc_to_display"].append((field, t - last_rtc))
+                    continue
+                m = FRAME_RE.match(line)
+                if m:
+                    measured["frame"].append((0, int(m.group(1))))
+                    last_rtc = None
+                    last_t = -1
+
+        print("%s (mode %d):" % (fn, mode))
+        for name in ("rtc_to_display", "rtc_to_rtc", "frame"):
+            values = measured[name]
+            if not values:
+                print("  %-15s no samples" % name)
+                continue
+            errors = [t - expected[name][field] for field, t in values]
+            error = max(errors, key=abs)
+            good = abs(error) <= tolerance
+            ok = ok and good
+            print("  %-15s model %s  %d samples, worst error %+d ticks %s" % (
+                name, "/".join("%d" % e for e in sorted(set(expected[name]))),
+                len(values), error, "ok" if good else "MISMATCH"))
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Predict 6502 speed under ULA contention")
+    parser.add_argument("--mode", type=int, default=None,
+                        help="screen mode 0-7 (default: all with --table)")
+    parser.add_argument("--turbo", type=int, default=1, choices=range(4),
+                        help="turbo setting: 0=1MHz, 1=2MHz with contention "
+                        "(original Electron), 2=2MHz, 3=4MHz")
+    parser.add_argument("--jafa-mode7", action="store_true",
+                        help="the ULA is built with IncludeJafaMode7")
+    parser.add_argument("--trace", help="trace file, one access per line")
+    parser.add_argument("--mix", help="access mix, e.g. ram=40,rom=55,io=5")
+    parser.add_argument("--kbd-rom", action="store_true",
+                        help="paged ROM 8/9 (keyboard) is selected while tracing")
+    parser.add_argument("--fields", type=int, default=2,
+                        help="number of video fields to simulate")
+    parser.add_argument("--non-interlaced", action="store_true",
+                        help="312 line fields (FPGA video mode 00) instead of 312.5")
+    parser.add_argument("--no-limit-rom", action="store_true",
+                        help="LimitROMSpeed generic set to false")
+    parser.add_argument("--no-limit-io", action="store_true",
+                        help="LimitIOSpeed generic set to false")
+    parser.add_argument("--table", action="store_true",
+                        help="print a table of effective MHz for every mode and turbo setting")
+    parser.add_argument("--validate", nargs="*", metavar="LOG",
+                        help="check frame timing against analyze.c logs "
+                        "(default: everything under timings/)")
+    args = parser.parse_args()
+
+    if args.validate is not None:
+        logs = args.validate or sorted(glob.glob(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "*", "*.log")))
+        sys.exit(0 if validate(logs) else 1)
+
+    modes = list(range(8 if args.jafa_mode7 else 7))
+    if args.mode is not None:
+        if args.mode == 7 and not args.jafa_mode7:
+            parser.error("mode 7 is only available with --jafa-mode7 (IncludeJafaMode7)")
+        if args.mode not in modes:
+            parser.error("mode must be 0-7")
+        modes = [args.mode]
+    elif not args.table:
+        parser.error("specify --mode or --table")
+
+    if args.trace and args.mix:
+        parser.error("use either --trace or --mix, not both")
+    if args.trace:
+        make_accesses = lambda: trace_accesses(args.trace, args.kbd_rom)
+    else:
+        weights = parse_mix(args.mix or "ram=50,rom=50")
+        make_accesses = lambda: mix_accesses(weights)
+
+    options = dict(
+        n_fields=args.fields,
+        interlaced=not args.non_interlaced,
+        limit_rom=not args.no_limit_rom,
+        limit_io=not args.no_limit_io,
+    )
+
+    if args.table:
+        print("mode " + "".join("  turbo %d" % t for t in range(4)))
+        for mode in modes:
+            row = []
+            for turbo in range(4):
+                r = simulate(make_accesses(), mode, turbo, **options)
+                row.append("%9.3f" % r["effective_mhz"])
+            print("%4d " % mode + "".join(row))
+        print("(effective MHz)")
+    else:
+        for mode in modes:
+            print_result(mode, args.turbo,
+                         simulate(make_accesses(), mode, args.turbo, **options))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Keeps the board's command interface open between tools.
+#
+# Opening the port costs a tool the firmware's 100 ms online_waiting delay,
+# the banner and flash detection, the "\n" -> OK handshake, and on the way
+# out an "x" and half a second's sleep.  This daemon pays that once: it holds
+# the port in command mode and listens on a Unix socket
+# (mcu_port.DAEMON_SOCKET by default).  Tools that use mcu_port.Port without
+# --port find the socket and connect to it instead of the serial port.
+#
+# Each connection is one session.  Sessions are served one at a time in the
+# order they connected; while a session is active its bytes go straight to
+# the firmware and everything the firmware sends goes straight back, so the
+# tools speak the usual protocol.  Queued clients wait (their first writes
+# sit in the socket buffer) until the one in front disconnects.
+#
+# Between sessions the daemon gets the firmware back to the OK prompt,
+# discarding whatever the last tool didn't read.  If it doesn't answer
+# (a tool died half way through a 'p' and the firmware is waiting for data)
+# it drops DTR, which makes the firmware abandon the command, and
+# handshakes again.  An idle port is checked every KEEPALIVE_SECONDS.
+#
+#   python board_daemon.py [--port /dev/ttyACM0] [--socket /tmp/elk.sock]
+#   python program_flash.py rom_image.bin 0 256k   # no --port: uses the daemon
+
+import argparse
+import collections
+import os
+import select
+import socket
+import time
+
+import mcu_port
+import tool_log
+
+KEEPALIVE_SECONDS = 30.0
+HANDSHAKE_SECONDS = 3.0
+CHUNK = 4096
+
+class Session:
+    def __init__(self, sock, number):
+        self.sock = sock
+        self.number = number
+        self.connected = time.time()
+        self.started = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+class Daemon:
+    def __init__(self, ser, path):
+        self.ser = ser
+        self.path = path
+        self.queue = collections.deque()
+        self.active = None
+        self.sessions = 0
+        self.recoveries = 0
+        self.last_activity = time.time()
+
+        if os.path.exists(path):
+            # Left behind by a daemon that didn't exit cleanly?
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except socket.error:
+                os.unlink(path)
+            else:
+                raise Exception("Another daemon is already listening on %s" % path)
+            finally:
+                probe.close()
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        os.chmod(path, 0o600)
+        self.listener.listen(16)
+
+    def close(self):
+        for session in list(self.queue) + ([self.active] if self.active else []):
+            session.sock.close()
+        self.listener.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def handshake(self, timeout=HANDSHAKE_SECONDS):
+        """Gets the firmware to the OK prompt, discarding anything before
+        it.  Returns True if it answered."""
+        self.ser.write(b"\n")
+        resp = b""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            r = self.ser.read(CHUNK)
+            if r:
+                resp += r
+                if b"OK\r\n" in resp[-64:]:
+                    # Anything the firmware was still sending is now behind us
+                    time.sleep(0.01)
+                    self.ser.read(CHUNK)
+                    return True
+            else:
+                time.sleep(0.005)
+        return False
+
+    def recover(self):
+        """Handshakes, dropping DTR to abort a stuck command if need be."""
+        if self.handshake():
+            return True
+        self.recoveries += 1
+        tool_log.warning("Firmware didn't answer; dropping DTR")
+        self.ser.dtr = False
+        time.sleep(0.2)
+        self.ser.dtr = True
+        # Past online_waiting, and the banner and flash detection
+        time.sleep(0.2)
+        if self.handshake():
+            return True
+        tool_log.warning("Firmware still not answering; will retry")
+        return False
+
+    def _accept(self):
+        sock, _ = self.listener.accept()
+        self.sessions += 1
+        session = Session(sock, self.sessions)
+        self.queue.append(session)
+        tool_log.debug("Session %d connected; %d queued", session.number, len(self.queue))
+
+    def _start_next(self):
+        if self.active or not self.queue:
+            return
+        self.active = self.queue.popleft()
+        self.active.started = time.time()
+        tool_log.debug("Session %d started after %.3f s in the queue",
+                       self.active.number, self.active.started - self.active.connected)
+
+    def _end_active(self):
+        session = self.active
+        self.active = None
+        session.sock.close()
+        tool_log.debug("Session %d done in %.3f s: %d bytes to the board, %d back",
+                       session.number, time.time() - session.started,
+                       session.bytes_in, session.bytes_out)
+        tool_log.event("session", number=session.number,
+                       queued=round(session.started - session.connected, 3),
+                       seconds=round(time.time() - session.started, 3),
+                       bytes_in=session.bytes_in, bytes_out=session.bytes_out)
+        self.recover()
+        self.last_activity = time.time()
+
+    def _from_client(self):
+        try:
+            data = self.active.sock.recv(CHUNK)
+        except socket.error:
+            data = b""
+        if not data:
+            self._end_active()
+            return
+        self.active.bytes_in += len(data)
+        self.ser.write(data)
+
+    def _from_port(self):
+        data = self.ser.read(CHUNK)
+        if not data:
+            return
+        if not self.active:
+            # Nobody is listening; the next handshake discards it anyway
+            return
+        self.active.bytes_out += len(data)
+        try:
+            self.active.sock.sendall(data)
+        except socket.error:
+            self._end_active()
+
+    def _drop_queued(self, readable):
+        # A queued client that hangs up before its turn
+        for session in list(self.queue):
+            if session.sock in readable:
+                try:
+                    peek = session.sock.recv(1, socket.MSG_PEEK)
+                except socket.error:
+                    peek = b""
+                if not peek:
+                    self.queue.remove(session)
+                    session.sock.close()
+
+    def run(self):
+        while not self.recover():
+            time.sleep(1)
+        tool_log.info("Board ready; listening on %s", self.path)
+        port_fd = self.ser.fileno()
+        while True:
+            self._start_next()
+            watch = [self.listener, port_fd] + [s.sock for s in self.queue]
+            if self.active:
+                watch.append(self.active.sock)
+            readable, _, _ = select.select(watch, [], [], 1.0)
+            if self.listener in readable:
+                self._accept()
+            if port_fd in readable:
+                self._from_port()
+            if self.active and self.active.sock in readable:
+                self._from_client()
+            self._drop_queued(readable)
+            if self.active:
+                self.last_activity = time.time()
+            elif not self.queue and time.time() - self.last_activity > KEEPALIVE_SECONDS:
+                self.recover()
+                self.last_activity = time.time()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Hold the board's command interface open for other tools")
+    parser.add_argument("--port", help="serial port (default: guess)")
+    parser.add_argument("--socket", default=mcu_port.DAEMON_SOCKET,
+                        help="Unix socket to listen on (default %(default)s)")
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+
+    # Not mcu_port.Port's default, which would be our own socket
+    port = args.port or mcu_port.guess_port()
+    with mcu_port.Port(port=port) as ser:
+        daemon = Daemon(ser, args.socket)
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            print()
+        finally:
+            tool_log.info("Served %d sessions; %d recoveries", daemon.sessions, daemon.recoveries)
+            daemon.close()
+
+if __name__ == '__main__':
+    main()
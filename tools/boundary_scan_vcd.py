@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Samples the FPGA's boundary scan vector (SPI command 0x05) as fast as the
+# D11 can and writes the ULA pin transitions to a VCD file.
+#
+# The 'b' command in the ASF D11 firmware's (firmware_d11_asf) command
+# interface reads the vector in a tight loop and only sends a record over USB
+# when it changes, so the link bandwidth only limits how quickly the pins can
+# toggle, not how often they are looked at.  The Arduino firmware doesn't
+# have it.  Each record is:
+#
+#   B5, micros() (4 bytes LE), samples since the last record (2 bytes LE),
+#   vector (6 bytes; the first is AA)
+#
+# The vector layout comes from debug_boundary_vector in ElectronULA_max10.vhd;
+# bits are named after the ULA pins they sit behind, using the pin list in
+# pcb/max10_electron_ula.py.  Records arrive with microsecond timestamps, so
+# the VCD uses a 1us timescale.
+#
+# The port needs to be in command mode (any baud rate other than 115200), so
+# this doesn't work through elk_serial_bridge.py.  ^C (or --duration) stops
+# the capture.
+#
+#   python boundary_scan_vcd.py scan.vcd [--port /dev/ttyACM0] [--duration 10]
+#   python boundary_scan_vcd.py scan.vcd --save scan.raw   # keep the records
+#   python boundary_scan_vcd.py scan.vcd --replay scan.raw  # convert later
+
+import argparse
+import os
+import re
+import struct
+import sys
+import time
+
+import mcu_port
+import tool_log
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "timings"))
+from capture_to_vcd import vcd_id
+
+BOARD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "pcb", "max10_electron_ula.py")
+
+RECORD_MARKER = 0xB5
+RECORD = struct.Struct("<BIH6s")
+VECTOR_MARKER = 0xAA
+SCAN_END = b"\r\nOK\r\n"
+
+# (bit in the 48-bit vector, counting from the MSB of the first byte,
+#  signal name, ULA pin name or None for internal signals).  The vector is
+#  AA, FF FF, flash_data_out, the control byte, then kbd and four 1 bits.
+BOUNDARY_BITS = [
+    (32, "RnW", "RnW"),
+    (34, "powerup_reset_n", None),
+    (35, "RST_n_in", "nRST"),
+    (37, "IRQ_n_in", "nIRQ"),
+    (38, "ula_irq_n", None),
+    (39, "NMI_n_in", "nNMI"),
+    (40, "kbd3", "KBD3"),
+    (41, "kbd2", "KBD2"),
+    (42, "kbd1", "KBD1"),
+    (43, "kbd0", "KBD0"),
+]
+# flash_data_out, dumped as a bus
+FLASH_DATA_BITS = (24, 8)
+
+PIN_RE = re.compile(r'Pin\(\s*(\d+),\s*"([^"]*)"')
+
+def read_ula_pins(fn=BOARD_SCRIPT):
+    """Returns {ULA pin name: pin number} from the ULA header in the board
+    script (the Pin() list inside the 'ULA' component)."""
+    pins = {}
+    try:
+        with open(fn) as f:
+            text = f.read()
+    except IOError:
+        return pins
+    start = text.find('identifier="ULA"')
+    end = text.find("],", start)
+    if start == -1:
+        return pins
+    for number, name in PIN_RE.findall(text[start:end]):
+        pins.setdefault(name, int(number))
+    return pins
+
+def vcd_name(signal, ula_pin, pins):
+    if ula_pin is None:
+        return "%s_internal" % signal
+    if ula_pin in pins:
+        return "%s_pin%d" % (ula_pin, pins[ula_pin])
+    return ula_pin
+
+def watched(vector):
+    # The parts of the vector that are written out; the rest is padding
+    return bytes(vector[3:6])
+
+def vector_bit(vector, bit):
+    return (vector[bit // 8] >> (7 - bit % 8)) & 1
+
+def flash_data(vector):
+    return vector[FLASH_DATA_BITS[0] // 8]
+
+# Decode a known vector: flash_data_out 12, RnW 0 with the rest of the
+# control byte high, and kbd 0101
+_known = bytearray(b"\xaa\xff\xff\x12\x3f\x5f")
+assert flash_data(_known) == 0x12
+assert [vector_bit(_known, bit) for bit, _, _ in BOUNDARY_BITS] == [0, 1, 1, 1, 1, 1, 0, 1, 0, 1]
+assert watched(_known) == b"\x12\x3f\x5f"
+
+def parse_records(buf):
+    """Parses as many records as possible from buf (a bytearray), resyncing on
+    the marker bytes if the stream is corrupted.  Returns ([(micros, samples,
+    vector)], bytes consumed, bytes skipped)."""
+    records = []
+    pos = skipped = 0
+    while len(buf) - pos >= RECORD.size:
+        if buf[pos] != RECORD_MARKER or buf[pos + 7] != VECTOR_MARKER:
+            pos += 1
+            skipped += 1
+            continue
+        _, micros, samples, vector = RECORD.unpack_from(buf, pos)
+        records.append((micros, samples, bytearray(vector)))
+        pos += RECORD.size
+    return records, pos, skipped
+
+class VcdWriter:
+    def __init__(self, out, pins, source):
+        self.out = out
+        self.bits = [(bit, vcd_id(n)) for n, (bit, _, _) in enumerate(BOUNDARY_BITS)]
+        self.flash_id = vcd_id(len(BOUNDARY_BITS))
+        self.last = None
+        self.t0 = None
+        self.t = 0
+        self.written = None
+        self.transitions = 0
+        out.write("$date %s $end\n" % time.ctime())
+        out.write("$version boundary_scan_vcd.py (%s) $end\n" % source)
+        out.write("$timescale 1us $end\n")
+        out.write("$scope module ula $end\n")
+        for (bit, signal, ula_pin), (_, ident) in zip(BOUNDARY_BITS, self.bits):
+            out.write("$var wire 1 %s %s $end\n" % (ident, vcd_name(signal, ula_pin, pins)))
+        out.write("$var wire 8 %s flash_data_out $end\n" % self.flash_id)
+        out.write("$upscope $end\n")
+        out.write("$enddefinitions $end\n")
+
+    def sample(self, t, vector):
+        """Writes whatever changed since the last vector; t is in
+        microseconds."""
+        if self.t0 is None:
+            self.t0 = t
+        self.t = t - self.t0
+        last = self.last
+        if last is not None and watched(vector) == watched(last):
+            return
+        if last is None:
+            self.out.write("#%d\n$dumpvars\n" % self.t)
+        else:
+            self.out.write("#%d\n" % self.t)
+        for bit, ident in self.bits:
+            value = vector_bit(vector, bit)
+            if last is None or value != vector_bit(last, bit):
+                self.out.write("%d%s\n" % (value, ident))
+                if last is not None:
+                    self.transitions += 1
+        if last is None or flash_data(vector) != flash_data(last):
+            self.out.write("b{0:08b} {1}\n".format(flash_data(vector), self.flash_id))
+        if last is None:
+            self.out.write("$end\n")
+        self.last = vector
+        self.written = self.t
+
+    def finish(self):
+        # Mark the time of the last record, so viewers show the full capture
+        if self.t != self.written:
+            self.out.write("#%d\n" % self.t)
+
+class Sampler:
+    """Turns the record stream into VCD, unwrapping the 32-bit microsecond
+    counter and keeping count of the samples behind each record."""
+    def __init__(self, writer, save=None):
+        self.writer = writer
+        self.save = save
+        self.buf = bytearray()
+        self.last_micros = None
+        self.t = 0
+        self.records = 0
+        self.samples = 0
+        self.skipped = 0
+
+    def feed(self, data):
+        if self.save:
+            self.save.write(data)
+        self.buf.extend(data)
+        records, consumed, skipped = parse_records(self.buf)
+        del self.buf[:consumed]
+        self.skipped += skipped
+        for micros, samples, vector in records:
+            if self.last_micros is not None:
+                self.t += (micros - self.last_micros) & 0xffffffff
+            self.last_micros = micros
+            self.records += 1
+            self.samples += samples
+            self.writer.sample(self.t, vector)
+
+def start_scan(ser):
+    ser.write(b"\n")
+    wait_for(ser, b"OK")
+    ser.write(b"b")
+    return wait_for(ser, b"SCAN:\r\n")
+
+def wait_for(ser, match, timeout=5):
+    # Returns anything received after the match
+    resp = b""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        resp += ser.read(1024)
+        p = resp.find(match)
+        if p != -1:
+            return resp[p + len(match):]
+        time.sleep(0.01)
+    raise Exception("Timed out waiting for %r from the MCU; got %r" % (match, resp[-100:]))
+
+def capture(ser, sampler, duration=None):
+    sampler.feed(start_scan(ser))
+    t0 = time.time()
+    progress = tool_log.Progress(None, "scan")
+    try:
+        while duration is None or time.time() - t0 < duration:
+            data = ser.read(4096)
+            if data:
+                sampler.feed(data)
+                progress.update(len(data))
+            else:
+                time.sleep(0.001)
+    except KeyboardInterrupt:
+        print()
+    # Any byte stops the scan (the firmware swallows it); the records still
+    # in flight come before the final OK
+    ser.write(b"\n")
+    tail = b""
+    deadline = time.time() + 5
+    while not tail.endswith(SCAN_END) and time.time() < deadline:
+        tail += ser.read(4096)
+    sampler.feed(tail[:-len(SCAN_END)] if tail.endswith(SCAN_END) else tail)
+    progress.finish()
+    return time.time() - t0
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream the FPGA's boundary scan vector into a VCD file")
+    parser.add_argument("output", help="VCD file to write")
+    parser.add_argument("--port", help="serial port (default: guess)")
+    parser.add_argument("--duration", type=float,
+                        help="seconds to capture for (default: until ^C)")
+    parser.add_argument("--save", help="also save the raw records to this file")
+    parser.add_argument("--replay", help="read records from this file instead of the MCU")
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+
+    pins = read_ula_pins()
+    source = args.replay or args.port or "mcu"
+    save = open(args.save, "wb") if args.save else None
+    with open(args.output, "w") as out:
+        writer = VcdWriter(out, pins, os.path.basename(source))
+        sampler = Sampler(writer, save)
+        if args.replay:
+            with open(args.replay, "rb") as f:
+                while True:
+                    data = f.read(65536)
+                    if not data:
+                        break
+                    sampler.feed(data)
+            elapsed = None
+        else:
+            with mcu_port.Port(port=args.port) as ser:
+                tool_log.info("Sampling; ^C to stop")
+                elapsed = capture(ser, sampler, args.duration)
+        writer.finish()
+    if save:
+        save.close()
+
+    span = sampler.t / 1e6
+    tool_log.info("%d samples in %d records over %.3f s of scan time, %d transitions -> %s",
+                  sampler.samples, sampler.records, span, writer.transitions, args.output)
+    if span:
+        tool_log.info("%.0f samples/s, %.0f records/s",
+                      sampler.samples / span, sampler.records / span)
+    if sampler.skipped:
+        tool_log.warning("Skipped %d bytes of garbled data", sampler.skipped)
+    if elapsed:
+        tool_log.info("Captured for %.1f s", elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Hotspot profiler for AtomBusMon traces.
+#
+# Reads the console output of AtomBusMon (from its serial port, or a saved
+# log) a line at a time, and keeps PC and data address histograms, cycles
+# per instruction and per routine, and per-page heat maps.  Every 64k
+# address has a fixed size counter, so memory use doesn't grow with the
+# length of the trace.
+#
+# The lines understood are the ones the 6502 firmware prints when stepping
+# with tracing on, and when watches or breakpoints are hit:
+#
+#   00.001234 : D940 : A9 07    : LDA #$07
+#   00.001240 : Memory Wr Watch hit at D942 writing FE05:0C  .
+#
+# Cycle counts are the AtomBusMon timer, so the difference between two
+# consecutive lines is charged to the instruction on the first of them.
+#
+# Hot code in the OS and paged ROM is symbolised using the MOS entry points,
+# the OS default vector table, the paged ROM header and the targets of JSRs
+# seen in the trace, plus an optional symbol file.
+#
+# Usage:
+#   python busmon_profile.py trace.log
+#   python busmon_profile.py --port /dev/ttyUSB0 --interval 10
+#   python busmon_profile.py --paged-rom ../roms/mmfs_swram.rom --symbols my.sym trace.log
+
+import argparse
+import bisect
+import os
+import re
+import sys
+import time
+
+ROMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "roms")
+DEFAULT_OS_ROM = os.path.join(ROMS_DIR, "os100.rom")
+DEFAULT_PAGED_ROM = os.path.join(ROMS_DIR, "Basic2.rom")
+
+# The AtomBusMon timer is 24 bits
+COUNTER_WRAP = 1 << 24
+
+COUNT = r"(?:(\d\d)\.(\d{6}) : )?"
+INSTR_RE = re.compile(r"^" + COUNT +
+                      r"([0-9A-F]{4}) : ((?:[0-9A-F]{2} ?)+?)\s*: (\S+) ?(.*)$")
+HIT_RE = re.compile(r"^" + COUNT +
+                    r".*? hit at ([0-9A-F]{4})(?: (reading|writing) ([0-9A-F]{4}):([0-9A-F]{2}))?")
+BARE_COUNT_RE = re.compile(r"^(\d\d)\.(\d{6}) : $")
+# Operand of an absolute or zero page instruction, e.g. $FE05,X or ($70),Y
+OPERAND_RE = re.compile(r"^\(?\$([0-9A-F]{2,4})(?:,X\)|\),Y|,X|,Y|\))?$")
+
+# Standard MOS entry points, which the Electron OS shares with the BBC
+MOS_ENTRY_POINTS = {
+    0xFFB9: "OSRDRM", 0xFFBC: "VDUCHR", 0xFFBF: "OSEVEN", 0xFFC2: "GSINIT",
+    0xFFC5: "GSREAD", 0xFFC8: "NVRDCH", 0xFFCB: "NVWRCH", 0xFFCE: "OSFIND",
+    0xFFD1: "OSGBPB", 0xFFD4: "OSBPUT", 0xFFD7: "OSBGET", 0xFFDA: "OSARGS",
+    0xFFDD: "OSFILE", 0xFFE0: "OSRDCH", 0xFFE3: "OSASCI", 0xFFE7: "OSNEWL",
+    0xFFEE: "OSWRCH", 0xFFF1: "OSWORD", 0xFFF4: "OSBYTE", 0xFFF7: "OSCLI",
+}
+
+# Vectors at &0200, in the order of the OS default vector table
+VECTOR_NAMES = [
+    "USERV", "BRKV", "IRQ1V", "IRQ2V", "CLIV", "BYTEV", "WORDV", "WRCHV",
+    "RDCHV", "FILEV", "ARGSV", "BGETV", "BPUTV", "GBPBV", "FINDV", "FSCV",
+    "EVNTV",
+]
+
+# name, start, end (inclusive)
+def memory_regions(screen_base):
+    return [
+        ("zero page", 0x0000, 0x00FF),
+        ("stack", 0x0100, 0x01FF),
+        ("OS workspace", 0x0200, 0x0DFF),
+        ("user RAM", 0x0E00, screen_base - 1),
+        ("screen", screen_base, 0x7FFF),
+        ("paged ROM", 0x8000, 0xBFFF),
+        ("OS ROM", 0xC000, 0xFBFF),
+        ("FRED", 0xFC00, 0xFCFF),
+        ("JIM", 0xFD00, 0xFDFF),
+        ("SHEILA", 0xFE00, 0xFEFF),
+        ("OS ROM", 0xFF00, 0xFFFF),
+    ]
+
+def read_rom(fn):
+    with open(fn, "rb") as f:
+        data = f.read()
+    if len(data) != 16384:
+        raise ValueError("%s is %d bytes; expected a 16k ROM" % (fn, len(data)))
+    return data
+
+def word(data, offset):
+    return data[offset] | (data[offset + 1] << 8)
+
+def os_rom_symbols(rom):
+    # rom is mapped at &C000
+    symbols = dict((addr, name) for addr, name in MOS_ENTRY_POINTS.items())
+    for name, offset in (("NMI", 0x3FFA), ("RESET", 0x3FFC), ("IRQ/BRK", 0x3FFE)):
+        symbols[word(rom, offset)] = name + " handler"
+    # Find the reset code that copies the default vector table to &0200:
+    #   LDA table-1,Y / STA &01FF,Y
+    m = re.search(b"\xb9(..)\x99\xff\x01", rom, re.S)
+    if m:
+        table = word(m.group(1), 0) + 1 - 0xC000
+        for i, name in enumerate(VECTOR_NAMES):
+            if 0 <= table + i * 2 < len(rom) - 1:
+                addr = word(rom, table + i * 2)
+                if addr >= 0xC000:
+                    symbols.setdefault(addr, name + " default")
+    return symbols
+
+def paged_rom_symbols(rom):
+    # rom is mapped at &8000
+    title_end = rom.find(b"\0", 9)
+    title = rom[9:title_end].decode("ascii", "replace") if title_end > 9 else "ROM"
+    symbols = {}
+    for offset, what in ((0, "language entry"), (3, "service entry")):
+        if rom[offset] == 0x4C:
+            symbols[word(rom, offset + 1)] = "%s %s" % (title, what)
+        symbols.setdefault(0x8000 + offset, "%s %s" % (title, what))
+    return symbols, title
+
+def load_symbol_file(fn):
+    # Accepts "NAME = &1234", "NAME=$1234", "1234 NAME" or "0x1234 NAME"
+    symbols = {}
+    with open(fn) as f:
+        for line in f:
+            line = line.split(";")[0].strip()
+            if not line or line.startswith("#"):
+                continue
+            m = re.match(r"^\.?(\S+)\s*=\s*[&$]?(?:0x)?([0-9A-Fa-f]+)$", line)
+            if m:
+                symbols[int(m.group(2), 16)] = m.group(1)
+                continue
+            m = re.match(r"^[&$]?(?:0x)?([0-9A-Fa-f]{1,4})\s+(\S+)", line)
+            if m:
+                symbols[int(m.group(1), 16)] = m.group(2)
+    return symbols
+
+class Profile:
+    def __init__(self):
+        self.pc_count = [0] * 65536       # instructions executed
+        self.pc_cycles = [0] * 65536      # cycles charged to each instruction
+        self.data_reads = [0] * 65536
+        self.data_writes = [0] * 65536
+        self.operand_refs = [0] * 65536   # addresses named by instruction operands
+        self.disassembly = {}
+        self.opcode_bytes = {}
+        self.jsr_targets = set()
+        self.instructions = 0
+        self.cycles = 0
+        self.lines = 0
+        self.last_pc = None
+        self.last_count = None
+
+    def _count(self, hi, lo):
+        if hi is None:
+            return None
+        return int(hi + lo)
+
+    def _charge(self, count):
+        # Charge the cycles since the last line to the previous instruction
+        if count is not None and self.last_count is not None and self.last_pc is not None:
+            delta = (count - self.last_count) % COUNTER_WRAP
+            self.pc_cycles[self.last_pc] += delta
+            self.cycles += delta
+        self.last_count = count
+
+    def feed(self, line):
+        self.lines += 1
+        line = line.rstrip("\r\n")
+        m = INSTR_RE.match(line)
+        if m:
+            count = self._count(m.group(1), m.group(2))
+            pc = int(m.group(3), 16)
+            self._charge(count)
+            self.last_pc = pc
+            self.instructions += 1
+            self.pc_count[pc] += 1
+            mnemonic, operand = m.group(5), m.group(6).strip()
+            if pc not in self.disassembly:
+                self.disassembly[pc] = ("%s %s" % (mnemonic, operand)).strip()
+                self.opcode_bytes[pc] = bytes(int(b, 16) for b in m.group(4).split())
+            om = OPERAND_RE.match(operand)
+            if om:
+                target = int(om.group(1), 16)
+                if mnemonic == "JSR":
+                    self.jsr_targets.add(target)
+                elif mnemonic != "JMP" and not mnemonic.startswith("B"):
+                    self.operand_refs[target] += 1
+            return
+        m = HIT_RE.match(line)
+        if m:
+            count = self._count(m.group(1), m.group(2))
+            self._charge(count)
+            # The instruction is counted from its own trace line
+            self.last_pc = int(m.group(3), 16)
+            if m.group(4):
+                addr = int(m.group(5), 16)
+                if m.group(4) == "reading":
+                    self.data_reads[addr] += 1
+                else:
+                    self.data_writes[addr] += 1
+            return
+        m = BARE_COUNT_RE.match(line)
+        if m:
+            # The timer has been cleared; this is the count just before
+            self._charge(self._count(m.group(1), m.group(2)))
+            self.last_count = None
+
+class Symboliser:
+    def __init__(self, symbols, os_rom=None, paged_rom=None):
+        self.symbols = dict(symbols)
+        self.roms = []
+        if os_rom is not None:
+            self.roms.append((0xC000, os_rom))
+        if paged_rom is not None:
+            self.roms.append((0x8000, paged_rom))
+        self._sorted = None
+
+    def add(self, addr, name):
+        self.symbols.setdefault(addr, name)
+        self._sorted = None
+
+    def lookup(self, addr):
+        # Nearest symbol at or before addr in the same 16k ROM / RAM area
+        if self._sorted is None:
+            self._sorted = sorted(self.symbols)
+        i = bisect.bisect_right(self._sorted, addr) - 1
+        if i < 0:
+            return None, 0
+        base = self._sorted[i]
+        if (base ^ addr) & 0xC000 and addr >= 0x8000:
+            return None, 0
+        return self.symbols[base], addr - base
+
+    def describe(self, addr):
+        name, offset = self.lookup(addr)
+        if name is None:
+            return ""
+        return name if not offset else "%s+%d" % (name, offset)
+
+    def rom_mismatch(self, addr, opcode_bytes):
+        # True if the bytes traced at addr don't match the ROM image,
+        # which usually means a different paged ROM was selected.
+        for base, rom in self.roms:
+            if base <= addr < base + len(rom) and not 0xFC00 <= addr < 0xFF00:
+                offset = addr - base
+                return rom[offset:offset + len(opcode_bytes)] != opcode_bytes
+        return False
+
+def heat_map(title, counts):
+    # 256 pages as a 16x16 grid, darker characters for more activity
+    shades = " .:-=+*#%@"
+    pages = [sum(counts[p * 256:(p + 1) * 256]) for p in range(256)]
+    peak = max(pages)
+    print("%s (one character per page, peak %d)" % (title, peak))
+    print("      " + "".join("%X" % i for i in range(16)))
+    for row in range(16):
+        cells = ""
+        for col in range(16):
+            v = pages[row * 16 + col]
+            if v == 0:
+                cells += " "
+            else:
+                cells += shades[1 + (len(shades) - 2) * v // peak]
+        print("  %X0  %s" % (row, cells))
+
+def report(profile, symboliser, regions, top_n=20):
+    p = profile
+    for addr in p.jsr_targets:
+        symboliser.add(addr, "sub_%04X" % addr)
+
+    print("=" * 72)
+    print("%d lines, %d instructions, %d cycles (%.2f cycles/instruction)" % (
+        p.lines, p.instructions, p.cycles,
+        float(p.cycles) / p.instructions if p.instructions else 0))
+    weights = p.pc_cycles if p.cycles else p.pc_count
+    unit = "cycles" if p.cycles else "hits"
+    total = float(sum(weights)) or 1.0
+
+    print("\nTop %d instructions by %s:" % (top_n, unit))
+    hot = sorted((a for a in range(65536) if weights[a]),
+                 key=lambda a: -weights[a])[:top_n]
+    for addr in hot:
+        note = ""
+        if addr in p.opcode_bytes and symboliser.rom_mismatch(addr, p.opcode_bytes[addr]):
+            note = " (doesn't match ROM image)"
+        print("  %04X %10d %5.1f%% %8d x  %-16s %s%s" % (
+            addr, weights[addr], 100.0 * weights[addr] / total, p.pc_count[addr],
+            p.disassembly.get(addr, ""), symboliser.describe(addr), note))
+
+    routines = {}
+    for addr in range(65536):
+        if weights[addr]:
+            name, _ = symboliser.lookup(addr)
+            name = name or "?%02Xxx" % (addr >> 8)
+            routines[name] = routines.get(name, 0) + weights[addr]
+    print("\nTop %d routines by %s:" % (top_n, unit))
+    for name, w in sorted(routines.items(), key=lambda x: -x[1])[:top_n]:
+        print("  %-32s %10d %5.1f%%" % (name, w, 100.0 * w / total))
+
+    print("\n%s by memory region:" % unit.capitalize())
+    data = [p.data_reads[a] + p.data_writes[a] + p.operand_refs[a]
+            for a in range(65536)]
+    print("  %-14s %12s %7s %12s" % ("region", unit, "", "data refs"))
+    for name, start, end in regions:
+        if end < start:
+            continue
+        w = sum(weights[start:end + 1])
+        d = sum(data[start:end + 1])
+        print("  %-14s %12d %6.1f%% %12d" % (name, w, 100.0 * w / total, d))
+
+    print()
+    heat_map("Code heat map (%s)" % unit, weights)
+    if any(data):
+        print()
+        heat_map("Data heat map (watch hits + operand references)", data)
+    sys.stdout.flush()
+
+def open_input(args):
+    if args.port:
+        import serial
+        return serial.Serial(args.port, args.baud, timeout=0.1)
+    if args.trace == "-":
+        return sys.stdin
+    return open(args.trace, "r", errors="replace")
+
+def lines_from(source, is_serial, follow):
+    if is_serial:
+        buf = b""
+        while True:
+            data = source.read(4096)
+            if not data:
+                yield None  # give the caller a chance to report
+                continue
+            buf += data
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                yield line.decode("ascii", "replace")
+    else:
+        while True:
+            line = source.readline()
+            if line:
+                yield line
+            elif follow:
+                time.sleep(0.2)
+                yield None
+            else:
+                return
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile 6502 code from AtomBusMon traces")
+    parser.add_argument("trace", nargs="?", default="-",
+                        help="saved AtomBusMon log (default: stdin)")
+    parser.add_argument("--port", help="read live from AtomBusMon's serial port")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--follow", action="store_true",
+                        help="keep reading the log as it grows, like tail -f")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="print a report every this many seconds while reading")
+    parser.add_argument("--top", type=int, default=20, help="number of hotspots to list")
+    parser.add_argument("--os-rom", default=DEFAULT_OS_ROM)
+    parser.add_argument("--paged-rom", default=DEFAULT_PAGED_ROM,
+                        help="ROM selected at &8000 during the trace (default BASIC)")
+    parser.add_argument("--symbols", action="append", default=[],
+                        help="extra symbol file (NAME = &ADDR or ADDR NAME per line)")
+    parser.add_argument("--screen-base", type=lambda s: int(s, 0), default=0x3000,
+                        help="start of screen memory, for the region summary")
+    args = parser.parse_args()
+
+    symbols = {}
+    os_rom = read_rom(args.os_rom) if args.os_rom else None
+    paged_rom = read_rom(args.paged_rom) if args.paged_rom else None
+    if os_rom is not None:
+        symbols.update(os_rom_symbols(os_rom))
+    if paged_rom is not None:
+        paged, title = paged_rom_symbols(paged_rom)
+        symbols.update(paged)
+    for fn in args.symbols:
+        symbols.update(load_symbol_file(fn))
+    symboliser = Symboliser(symbols, os_rom, paged_rom)
+    regions = memory_regions(args.screen_base)
+
+    profile = Profile()
+    source = open_input(args)
+    last_report = time.time()
+    try:
+        for line in lines_from(source, bool(args.port), args.follow):
+            if line is not None:
+                profile.feed(line)
+            if args.interval and time.time() - last_report >= args.interval:
+                report(profile, symboliser, regions, args.top)
+                last_report = time.time()
+    except KeyboardInterrupt:
+        pass
+    report(profile, symboliser, regions, args.top)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Host file server for the Electron, over the USB serial port that
+# ElectronULA_max10.vhd maps at &FCA0 (data) and &FCA1 (status), and which
+# the D11 firmware forwards to the host at 115200 baud.
+#
+# Serves one or more volumes: host directories (with .inf files for load and
+# exec addresses, in the usual "NAME LLLLLL EEEEEE" form) and DFS disc images
+# (.ssd, or side 0 of a .dsd).  Volume 0 is selected at startup.
+#
+# Every request and response is a frame:
+#
+#   A5 <cmd or status> <length lo> <length hi> <payload> <checksum>
+#
+# where the checksum is the low byte of the sum of everything after the A5.
+# Numbers in payloads are little endian.  Requests (responses after ->):
+#
+#   01 HELLO                                 -> version, max data (2), volumes
+#   02 CAT first entry (2)                   -> count, more, entries
+#        (each entry: name length, name, load (4), exec (4), length (4), attr)
+#   03 INFO name                             -> load (4), exec (4), length (4), attr
+#   04 OPEN mode, name                       -> handle, length (4), load (4), exec (4)
+#        (mode 1 = read, 2 = create/truncate, 3 = update)
+#   05 READ handle, offset (4), count (2)    -> data
+#   06 WRITE handle, offset (4), data        -> nothing
+#   07 CLOSE handle                          -> nothing
+#   08 DELETE name                           -> nothing
+#   09 READ BLOCK sector (2), count          -> count * 256 bytes (images only)
+#   0A WRITE BLOCK sector (2), data          -> nothing (images only)
+#   0B FLUSH                                 -> nothing
+#   0C MOUNT volume                          -> kind (0 dir, 1 image), sectors (2), title
+#
+# To keep the link busy rather than the disk:
+#
+# - READ is served from a per-handle read-ahead window (READ_AHEAD bytes),
+#   so a sequential load only touches the host file every few requests.
+# - CAT returns as many entries as fit in one frame, from a listing that's
+#   cached until the volume changes.
+# - WRITE is acknowledged straight away and buffered per handle; the
+#   buffer goes to disk when it passes WRITE_BEHIND bytes, on CLOSE, FLUSH
+#   or a READ of the same handle, after IDLE_FLUSH_SECONDS without
+#   requests, and on exit.  If that write fails, the next request on the
+#   handle gets the error.
+#
+# The Electron side of the protocol isn't in this repository yet; this is
+# the host end.
+#
+#   python elk_file_server.py [--port /dev/ttyACM0] games/ elite.ssd
+
+import argparse
+import os
+import re
+import struct
+import time
+
+import mcu_port
+import tool_log
+
+VERSION = 1
+SYNC = 0xA5
+
+CMD_HELLO = 0x01
+CMD_CAT = 0x02
+CMD_INFO = 0x03
+CMD_OPEN = 0x04
+CMD_READ = 0x05
+CMD_WRITE = 0x06
+CMD_CLOSE = 0x07
+CMD_DELETE = 0x08
+CMD_READ_BLOCK = 0x09
+CMD_WRITE_BLOCK = 0x0A
+CMD_FLUSH = 0x0B
+CMD_MOUNT = 0x0C
+
+OK = 0x00
+ERR_CHECKSUM = 0x01
+ERR_BAD_COMMAND = 0x02
+ERR_NOT_FOUND = 0x03
+ERR_READ_ONLY = 0x04
+ERR_BAD_HANDLE = 0x05
+ERR_IO = 0x06
+ERR_TOO_MANY_OPEN = 0x07
+ERR_BAD_REQUEST = 0x08
+
+MODE_READ = 1
+MODE_CREATE = 2
+MODE_UPDATE = 3
+
+# Largest payload either way; the Electron side reads into a page-aligned
+# buffer, so keep it a multiple of 256
+MAX_DATA = 1024
+MAX_HANDLES = 8
+READ_AHEAD = 16384
+WRITE_BEHIND = 16384
+IDLE_FLUSH_SECONDS = 1.0
+# Give up on a half-received frame after this long
+FRAME_TIMEOUT = 2.0
+POLL_SECONDS = 0.05
+
+SECTOR_SIZE = 256
+
+class FileServerError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+# ---------------------------------------------------------------------------
+# Volumes
+
+class Entry:
+    def __init__(self, name, load, exec_addr, length, locked=False):
+        self.name = name
+        self.load = load
+        self.exec_addr = exec_addr
+        self.length = length
+        self.locked = locked
+
+class DirectoryVolume:
+    """A host directory; NAME.inf next to NAME holds the load and exec
+    addresses."""
+    kind = 0
+    sectors = 0
+
+    def __init__(self, path):
+        self.path = path
+        self.title = os.path.basename(os.path.normpath(path))
+
+    def _host_name(self, name):
+        # $.NAME and NAME are the same file; match case insensitively
+        if name.startswith("$."):
+            name = name[2:]
+        if not name or "/" in name or "\\" in name or name.startswith(".."):
+            raise FileServerError(ERR_BAD_REQUEST, "bad file name %r" % name)
+        for fn in os.listdir(self.path):
+            if fn.lower() == name.lower() and not fn.lower().endswith(".inf"):
+                return os.path.join(self.path, fn)
+        return os.path.join(self.path, name)
+
+    def _read_inf(self, fn):
+        load = exec_addr = 0
+        locked = False
+        try:
+            with open(fn + ".inf") as f:
+                fields = f.read().split()
+            if len(fields) >= 3:
+                load, exec_addr = int(fields[1], 16), int(fields[2], 16)
+            locked = "L" in fields[3:] or "Locked" in fields[3:]
+        except (IOError, OSError, ValueError):
+            pass
+        return load, exec_addr, locked
+
+    def _write_inf(self, fn, load, exec_addr, locked=False):
+        with open(fn + ".inf", "w") as f:
+            f.write("%s %06X %06X %06X%s\n" % (
+                os.path.basename(fn), load, exec_addr, os.path.getsize(fn),
+                " L" if locked else ""))
+
+    def version(self):
+        # Anything that changes the listing changes the directory's mtime
+        return os.stat(self.path).st_mtime
+
+    def listing(self):
+        entries = []
+        for fn in sorted(os.listdir(self.path), key=str.lower):
+            path = os.path.join(self.path, fn)
+            if fn.lower().endswith(".inf") or fn.startswith(".") or not os.path.isfile(path):
+                continue
+            load, exec_addr, locked = self._read_inf(path)
+            entries.append(Entry(fn, load, exec_addr, os.path.getsize(path), locked))
+        return entries
+
+    def info(self, name):
+        fn = self._host_name(name)
+        if not os.path.isfile(fn):
+            raise FileServerError(ERR_NOT_FOUND, "%s not found" % name)
+        load, exec_addr, locked = self._read_inf(fn)
+        return Entry(os.path.basename(fn), load, exec_addr, os.path.getsize(fn), locked)
+
+    def create(self, name, truncate):
+        fn = self._host_name(name)
+        if os.path.exists(fn) and self._read_inf(fn)[2]:
+            raise FileServerError(ERR_READ_ONLY, "%s is locked" % name)
+        if truncate or not os.path.exists(fn):
+            open(fn, "wb").close()
+            if not os.path.exists(fn + ".inf"):
+                self._write_inf(fn, 0, 0)
+        return self.info(name)
+
+    def read(self, name, offset, count):
+        with open(self._host_name(name), "rb") as f:
+            f.seek(offset)
+            return f.read(count)
+
+    def write(self, name, offset, data):
+        fn = self._host_name(name)
+        with open(fn, "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+        # Keep the length in the .inf up to date
+        self._write_inf(fn, *self._read_inf(fn))
+
+    def delete(self, name):
+        fn = self._host_name(name)
+        if not os.path.isfile(fn):
+            raise FileServerError(ERR_NOT_FOUND, "%s not found" % name)
+        if self._read_inf(fn)[2]:
+            raise FileServerError(ERR_READ_ONLY, "%s is locked" % name)
+        os.remove(fn)
+        if os.path.exists(fn + ".inf"):
+            os.remove(fn + ".inf")
+
+    def read_blocks(self, sector, count):
+        raise FileServerError(ERR_BAD_REQUEST, "directories don't have blocks")
+
+    write_blocks = read_blocks
+
+class DiscImageVolume:
+    """A DFS disc image.  Files can be read; writing is by block only, which
+    is what a DFS running on the Electron does anyway."""
+    kind = 1
+
+    def __init__(self, path):
+        self.path = path
+        # .dsd images interleave the two sides a track at a time; we serve
+        # side 0
+        self.interleaved = path.lower().endswith(".dsd")
+        size = os.path.getsize(path)
+        self.sectors = (size // 2 if self.interleaved else size) // SECTOR_SIZE
+        self._changes = 0
+
+    @property
+    def title(self):
+        return self._catalogue()[0]
+
+    def _offset(self, sector):
+        if self.interleaved:
+            track, s = divmod(sector, 10)
+            return (track * 2 * 10 + s) * SECTOR_SIZE
+        return sector * SECTOR_SIZE
+
+    def read_blocks(self, sector, count):
+        if sector + count > self.sectors:
+            raise FileServerError(ERR_BAD_REQUEST, "sector %d+%d past the end of the disc" % (
+                sector, count))
+        data = b""
+        with open(self.path, "rb") as f:
+            for s in range(sector, sector + count):
+                f.seek(self._offset(s))
+                data += f.read(SECTOR_SIZE).ljust(SECTOR_SIZE, b"\0")
+        return data
+
+    def write_blocks(self, sector, data):
+        count = -(-len(data) // SECTOR_SIZE)
+        if sector + count > self.sectors:
+            raise FileServerError(ERR_BAD_REQUEST, "sector %d+%d past the end of the disc" % (
+                sector, count))
+        with open(self.path, "r+b") as f:
+            for n in range(count):
+                f.seek(self._offset(sector + n))
+                f.write(data[n * SECTOR_SIZE:(n + 1) * SECTOR_SIZE])
+        self._changes += 1
+
+    def _catalogue(self):
+        cat = self.read_blocks(0, 2)
+        s0, s1 = bytearray(cat[:SECTOR_SIZE]), bytearray(cat[SECTOR_SIZE:])
+        title = (bytes(s0[:8]) + bytes(s1[:4])).rstrip(b"\0 ").decode("latin-1")
+        entries = []
+        for n in range(min(s1[5] // 8, 31)):
+            raw = s0[8 + n * 8:16 + n * 8]
+            name = bytes(raw[:7]).decode("latin-1").rstrip()
+            directory = chr(raw[7] & 0x7F)
+            info = s1[8 + n * 8:16 + n * 8]
+            mixed = info[6]
+
+            def address(lo, hi_bits):
+                value = info[lo] | (info[lo + 1] << 8) | (hi_bits << 16)
+                # Addresses with the top bits set are I/O processor addresses
+                return value | 0xFC0000 if hi_bits == 3 else value
+
+            entries.append((Entry(
+                "%s.%s" % (directory, name),
+                address(0, (mixed >> 2) & 3),
+                address(2, (mixed >> 6) & 3),
+                info[4] | (info[5] << 8) | (((mixed >> 4) & 3) << 16),
+                bool(raw[7] & 0x80)),
+                info[7] | ((mixed & 3) << 8)))
+        return title, entries
+
+    def version(self):
+        return (os.stat(self.path).st_mtime, self._changes)
+
+    def listing(self):
+        return [entry for entry, start in self._catalogue()[1]]
+
+    def _find(self, name):
+        if name[1:2] != ".":
+            name = "$." + name
+        for entry, start in self._catalogue()[1]:
+            if entry.name.lower() == name.lower():
+                return entry, start
+        raise FileServerError(ERR_NOT_FOUND, "%s not found" % name)
+
+    def info(self, name):
+        return self._find(name)[0]
+
+    def read(self, name, offset, count):
+        entry, start = self._find(name)
+        count = max(0, min(count, entry.length - offset))
+        if not count:
+            return b""
+        first = offset // SECTOR_SIZE
+        last = (offset + count - 1) // SECTOR_SIZE
+        data = self.read_blocks(start + first, last - first + 1)
+        skip = offset - first * SECTOR_SIZE
+        return data[skip:skip + count]
+
+    def _read_only(self, *args, **kwargs):
+        raise FileServerError(ERR_READ_ONLY, "disc image files are read only; write blocks instead")
+
+    create = write = delete = _read_only
+
+def open_volume(path):
+    if os.path.isdir(path):
+        return DirectoryVolume(path)
+    if re.search(r"\.(ssd|dsd)$", path, re.I):
+        return DiscImageVolume(path)
+    raise ValueError("%s is not a directory or a .ssd/.dsd image" % path)
+
+# ---------------------------------------------------------------------------
+# Open files, with read-ahead and write-behind
+
+class Handle:
+    def __init__(self, volume, name, mode, length):
+        self.volume = volume
+        self.name = name
+        self.mode = mode
+        self.length = length
+        self.window_start = 0
+        self.window = b""
+        self.pending = []        # [(offset, data)], in order
+        self.pending_bytes = 0
+        self.error = None        # a failed write-behind, for the next request
+
+    def read(self, offset, count, stats):
+        self.flush(stats)
+        count = max(0, min(count, self.length - offset))
+        end = offset + count
+        if offset >= self.window_start and end <= self.window_start + len(self.window):
+            stats["read_hits"] += 1
+        else:
+            stats["read_misses"] += 1
+            self.window_start = offset
+            self.window = self.volume.read(self.name, offset, max(count, READ_AHEAD))
+        start = offset - self.window_start
+        return self.window[start:start + count]
+
+    def write(self, offset, data, stats):
+        if self.mode == MODE_READ:
+            raise FileServerError(ERR_READ_ONLY, "%s is open for reading" % self.name)
+        if self.pending and self.pending[-1][0] + len(self.pending[-1][1]) == offset:
+            # Coalesce sequential writes
+            last_offset, last_data = self.pending[-1]
+            self.pending[-1] = (last_offset, last_data + data)
+        else:
+            self.pending.append((offset, data))
+        self.pending_bytes += len(data)
+        self.length = max(self.length, offset + len(data))
+        # Keep the read-ahead window coherent with what we've been sent
+        if self.window_start < offset + len(data) and offset < self.window_start + len(self.window):
+            self.window = b""
+        if self.pending_bytes >= WRITE_BEHIND:
+            self.flush(stats)
+
+    def flush(self, stats):
+        if not self.pending:
+            return
+        pending, self.pending, self.pending_bytes = self.pending, [], 0
+        try:
+            for offset, data in pending:
+                self.volume.write(self.name, offset, data)
+                stats["bytes_flushed"] += len(data)
+            stats["flushes"] += 1
+        except (IOError, OSError) as e:
+            self.error = FileServerError(ERR_IO, "writing %s: %s" % (self.name, e))
+
+# ---------------------------------------------------------------------------
+# Framing
+
+def checksum(data):
+    return sum(bytearray(data)) & 0xFF
+
+def frame(code, payload=b""):
+    body = struct.pack("<BH", code, len(payload)) + payload
+    return bytes(bytearray([SYNC])) + body + bytes(bytearray([checksum(body)]))
+
+class Link:
+    """Frames over a pyserial-like object (read(n) may return fewer bytes,
+    or none)."""
+    def __init__(self, ser):
+        self.ser = ser
+        self.buf = bytearray()
+        self.started = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def read_frame(self):
+        """Returns (cmd, payload), (None, None) if nothing complete arrived
+        in time, or (cmd, None) for a frame with a bad checksum."""
+        data = self.ser.read(max(1, getattr(self.ser, "in_waiting", 0) or 0))
+        if data:
+            self.bytes_in += len(data)
+            self.buf += bytearray(data)
+        # Drop anything before a sync byte
+        while self.buf and self.buf[0] != SYNC:
+            del self.buf[0]
+        if not self.buf:
+            self.started = None
+            return None, None
+        if self.started is None:
+            self.started = time.time()
+        if len(self.buf) >= 4:
+            length = self.buf[2] | (self.buf[3] << 8)
+            if length > MAX_DATA + 16:
+                # Not a real frame; resync on the next sync byte
+                del self.buf[0]
+                self.started = None
+                return None, None
+            if len(self.buf) >= 5 + length:
+                body = bytes(self.buf[1:4 + length])
+                ok = checksum(body) == self.buf[4 + length]
+                del self.buf[:5 + length]
+                self.started = None
+                return body[0], (body[3:] if ok else None)
+        if time.time() - self.started > FRAME_TIMEOUT:
+            del self.buf[0]
+            self.started = None
+        return None, None
+
+    def send(self, code, payload=b""):
+        data = frame(code, payload)
+        while data:
+            n = self.ser.write(data)
+            if n is None:
+                n = len(data)
+            self.bytes_out += n
+            data = data[n:]
+
+# ---------------------------------------------------------------------------
+# Requests
+
+class FileServer:
+    def __init__(self, volumes):
+        self.volumes = volumes
+        self.volume = volumes[0]
+        self.handles = {}
+        self.catalogue = None    # (volume, version, entries)
+        self.stats = dict(requests=0, errors=0, read_hits=0, read_misses=0,
+                          flushes=0, bytes_flushed=0, cat_hits=0, cat_misses=0)
+
+    def _handle(self, payload):
+        if not payload or bytearray(payload)[0] not in self.handles:
+            raise FileServerError(ERR_BAD_HANDLE, "bad handle")
+        handle = self.handles[bytearray(payload)[0]]
+        if handle.error:
+            error, handle.error = handle.error, None
+            raise error
+        return handle
+
+    def _listing(self):
+        version = self.volume.version()
+        if self.catalogue and self.catalogue[:2] == (self.volume, version):
+            self.stats["cat_hits"] += 1
+        else:
+            self.stats["cat_misses"] += 1
+            self.catalogue = (self.volume, version, self.volume.listing())
+        return self.catalogue[2]
+
+    def _entry_info(self, entry):
+        return struct.pack("<IIIB", entry.load, entry.exec_addr, entry.length,
+                           1 if entry.locked else 0)
+
+    def flush_all(self):
+        for handle in self.handles.values():
+            handle.flush(self.stats)
+
+    def request(self, cmd, payload):
+        """Returns (status, payload) for a request."""
+        self.stats["requests"] += 1
+        try:
+            return OK, self._dispatch(cmd, bytes(payload))
+        except FileServerError as e:
+            self.stats["errors"] += 1
+            tool_log.debug("  error %d: %s", e.status, e)
+            return e.status, str(e).encode("latin-1", "replace")[:MAX_DATA]
+        except (IOError, OSError) as e:
+            self.stats["errors"] += 1
+            return ERR_IO, str(e).encode("latin-1", "replace")[:MAX_DATA]
+        except (struct.error, IndexError, ValueError):
+            self.stats["errors"] += 1
+            return ERR_BAD_REQUEST, b"malformed request"
+
+    def _dispatch(self, cmd, payload):
+        if cmd == CMD_HELLO:
+            return struct.pack("<BHB", VERSION, MAX_DATA, len(self.volumes))
+
+        if cmd == CMD_MOUNT:
+            n = bytearray(payload)[0]
+            if n >= len(self.volumes):
+                raise FileServerError(ERR_NOT_FOUND, "no volume %d" % n)
+            self.flush_all()
+            errors = [h.error for h in self.handles.values() if h.error]
+            self.handles.clear()
+            if errors:
+                # The handles are closed either way; the mount can be retried
+                raise errors[0]
+            self.volume = self.volumes[n]
+            return struct.pack("<BH", self.volume.kind, self.volume.sectors) + \
+                self.volume.title.encode("latin-1", "replace")[:32]
+
+        if cmd == CMD_CAT:
+            first, = struct.unpack("<H", payload[:2])
+            entries = self._listing()
+            out = b""
+            count = 0
+            for entry in entries[first:]:
+                name = entry.name.encode("latin-1", "replace")[:255]
+                item = struct.pack("<B", len(name)) + name + self._entry_info(entry)
+                if 2 + len(out) + len(item) > MAX_DATA or count == 255:
+                    break
+                out += item
+                count += 1
+            more = 1 if first + count < len(entries) else 0
+            return struct.pack("<BB", count, more) + out
+
+        if cmd == CMD_INFO:
+            return self._entry_info(self.volume.info(payload.decode("latin-1")))
+
+        if cmd == CMD_OPEN:
+            mode = bytearray(payload)[0]
+            name = payload[1:].decode("latin-1")
+            if mode not in (MODE_READ, MODE_CREATE, MODE_UPDATE):
+                raise FileServerError(ERR_BAD_REQUEST, "bad open mode %d" % mode)
+            free = [n for n in range(1, MAX_HANDLES + 1) if n not in self.handles]
+            if not free:
+                raise FileServerError(ERR_TOO_MANY_OPEN, "too many open files")
+            if mode == MODE_READ:
+                entry = self.volume.info(name)
+            else:
+                entry = self.volume.create(name, truncate=(mode == MODE_CREATE))
+            self.handles[free[0]] = Handle(self.volume, entry.name if self.volume.kind == 0
+                                           else name, mode, entry.length)
+            return struct.pack("<BIII", free[0], entry.length, entry.load, entry.exec_addr)
+
+        if cmd == CMD_READ:
+            handle = self._handle(payload)
+            offset, count = struct.unpack("<IH", payload[1:7])
+            return handle.read(offset, min(count, MAX_DATA), self.stats)
+
+        if cmd == CMD_WRITE:
+            handle = self._handle(payload)
+            offset, = struct.unpack("<I", payload[1:5])
+            handle.write(offset, payload[5:], self.stats)
+            return b""
+
+        if cmd == CMD_CLOSE:
+            handle = self._handle(payload)
+            del self.handles[bytearray(payload)[0]]
+            handle.flush(self.stats)
+            if handle.error:
+                raise handle.error
+            return b""
+
+        if cmd == CMD_DELETE:
+            name = payload.decode("latin-1")
+            if any(h.name.lower() == name.lower() for h in self.handles.values()):
+                raise FileServerError(ERR_BAD_REQUEST, "%s is open" % name)
+            self.volume.delete(name)
+            return b""
+
+        if cmd == CMD_READ_BLOCK:
+            sector, count = struct.unpack("<HB", payload[:3])
+            return self.volume.read_blocks(sector, min(count, MAX_DATA // SECTOR_SIZE))
+
+        if cmd == CMD_WRITE_BLOCK:
+            sector, = struct.unpack("<H", payload[:2])
+            self.volume.write_blocks(sector, payload[2:])
+            return b""
+
+        if cmd == CMD_FLUSH:
+            self.flush_all()
+            errors = [h.error for h in self.handles.values() if h.error]
+            for h in self.handles.values():
+                h.error = None
+            if errors:
+                raise errors[0]
+            return b""
+
+        raise FileServerError(ERR_BAD_COMMAND, "unknown command %02x" % cmd)
+
+    def report(self, link, seconds):
+        s = self.stats
+        reads = s["read_hits"] + s["read_misses"]
+        tool_log.info("%d requests (%d errors) in %.1f s; %d bytes in, %d out; "
+                      "read-ahead hit %d of %d; %d bytes written in %d flushes; "
+                      "catalogue cache hit %d of %d",
+                      s["requests"], s["errors"], seconds, link.bytes_in, link.bytes_out,
+                      s["read_hits"], reads, s["bytes_flushed"], s["flushes"],
+                      s["cat_hits"], s["cat_hits"] + s["cat_misses"])
+
+def serve(ser, server):
+    link = Link(ser)
+    t0 = time.time()
+    last_request = time.time()
+    try:
+        while True:
+            cmd, payload = link.read_frame()
+            if cmd is None:
+                if time.time() - last_request > IDLE_FLUSH_SECONDS:
+                    server.flush_all()
+                    last_request = time.time()
+                continue
+            last_request = time.time()
+            if payload is None:
+                link.send(ERR_CHECKSUM)
+                continue
+            status, response = server.request(cmd, payload)
+            tool_log.debug("cmd %02x (%d bytes) -> status %02x (%d bytes)",
+                           cmd, len(payload), status, len(response))
+            link.send(status, response)
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.flush_all()
+        server.report(link, time.time() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve files to an Electron over USB serial")
+    parser.add_argument("volumes", nargs="+",
+                        help="directories or .ssd/.dsd disc images; the first is mounted at start")
+    parser.add_argument("--port", help="serial port (default: guess)")
+    parser.add_argument("--baud", type=int, default=115200)
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+
+    volumes = [open_volume(path) for path in args.volumes]
+    for n, volume in enumerate(volumes):
+        tool_log.info("Volume %d: %s (%s)", n, volume.path,
+                      "directory" if volume.kind == 0 else
+                      "disc image, %d sectors" % volume.sectors)
+    server = FileServer(volumes)
+    with mcu_port.Port(baud=args.baud, port=args.port) as ser:
+        ser.timeout = POLL_SECONDS
+        serve(ser, server)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Bridge daemon for the Electron's USB serial link (&FCA0/&FCA1, forwarded
+# by loop_serial_forwarder in the D11 firmware).
+#
+# Holds the serial port open and shares it between several local clients:
+#
+# - a pty, for a terminal program (its name is printed, and --link makes a
+#   symlink to it)
+# - any number of TCP connections to localhost:6502; the other tools in this
+#   directory connect with --port tcp:localhost:6502 (see mcu_port.py)
+#
+# Everything the Electron sends goes to every client.  Bytes from clients
+# are sent in the order they arrive.
+#
+# The D11 moves one byte per SPI transaction, so the USB side is where
+# batching helps: writes are held for up to COALESCE_SECONDS and sent in
+# whole USB packets (USB_PACKET bytes) where possible.  Incoming data goes
+# into a ring buffer that each client reads from at its own pace.  When the
+# slowest TCP client gets within a packet of being overrun, the bridge stops
+# reading the port, and the D11 and FPGA buffers hold the data instead.
+# A client that stays stuck for longer than STALL_SECONDS is skipped
+# forward, and the bytes it missed are counted as an overrun.  The pty never
+# holds up the port, as there may be no terminal on it: it just loses
+# whatever it can't take.
+#
+# Every --stats seconds (and on exit) it prints throughput, average packet
+# fill, ring buffer high water mark, and how long each side was held up.
+#
+#   python elk_serial_bridge.py [--port /dev/ttyACM0] [--tcp 6502] [--link /tmp/elk]
+
+import argparse
+import errno
+import os
+import select
+import socket
+import time
+import tty
+
+import mcu_port
+import tool_log
+
+DEFAULT_TCP_PORT = 6502
+# Full speed USB bulk packet
+USB_PACKET = 64
+COALESCE_SECONDS = 0.002
+RING_SIZE = 65536
+# Stop taking data from clients while this much is waiting for the port
+TX_LIMIT = 16384
+STALL_SECONDS = 2.0
+CHUNK = 4096
+
+class Ring:
+    """A byte ring buffer with an absolute write position, so each reader
+    can keep its own cursor."""
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.buf = bytearray(size)
+        self.head = 0            # total bytes ever written
+
+    def free_for(self, cursor):
+        return self.size - (self.head - cursor)
+
+    def write(self, data):
+        data = data[-self.size:]
+        start = self.head % self.size
+        first = min(len(data), self.size - start)
+        self.buf[start:start + first] = data[:first]
+        self.buf[:len(data) - first] = data[first:]
+        self.head += len(data)
+
+    def read(self, cursor, limit=CHUNK):
+        """Bytes from cursor onward (at most limit)."""
+        count = min(self.head - cursor, limit)
+        start = cursor % self.size
+        first = min(count, self.size - start)
+        return bytes(self.buf[start:start + first] + self.buf[:count - first])
+
+class Client:
+    def __init__(self, name, read_fd, write_fd, cursor, sock=None, holds_port=True):
+        self.name = name
+        # False to drop data rather than stop reading the port
+        self.holds_port = holds_port
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.sock = sock
+        self.cursor = cursor     # next ring position to send to this client
+        self.stuck_since = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.overrun = 0
+
+class Stats:
+    def __init__(self):
+        self.reset()
+        self.total_rx = self.total_tx = self.total_packets = 0
+
+    def reset(self):
+        self.t0 = time.time()
+        self.rx = 0              # from the Electron
+        self.tx = 0              # to the Electron
+        self.packets = 0
+        self.ring_high = 0
+        self.rx_held = 0.0       # seconds we stopped reading the port
+        self.tx_held = 0.0       # seconds we stopped reading clients
+        self.overruns = 0
+
+    def line(self, clients, ring_used, tx_waiting):
+        seconds = max(time.time() - self.t0, 1e-6)
+        fill = float(self.tx) / (self.packets * USB_PACKET) if self.packets else 0.0
+        return ("rx %.0f B/s, tx %.0f B/s, %d packets %.0f%% full; ring %d/%d (high %d); "
+                "port held %.1f s, clients held %.1f s; %d overrun; %d waiting; %d clients" % (
+                    self.rx / seconds, self.tx / seconds, self.packets, fill * 100,
+                    ring_used, RING_SIZE, self.ring_high, self.rx_held, self.tx_held,
+                    self.overruns, tx_waiting, len(clients)))
+
+class Bridge:
+    def __init__(self, ser, tcp_port=DEFAULT_TCP_PORT, link=None):
+        self.ser = ser
+        self.fd = ser.fileno()
+        self.ring = Ring()
+        self.tx = bytearray()
+        self.tx_since = None     # when the oldest unsent byte was queued
+        self.clients = []
+        self.stats = Stats()
+        self.listener = None
+        self.link = link
+
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        # Keep the slave open ourselves, so the master doesn't get EIO
+        # whenever no terminal has it open
+        self.pty_slave = slave
+        self.pty_name = os.ttyname(slave)
+        os.set_blocking(master, False)
+        self.clients.append(Client("pty", master, master, self.ring.head, holds_port=False))
+        tool_log.info("pty: %s", self.pty_name)
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.pty_name, link)
+            tool_log.info("linked %s -> %s", link, self.pty_name)
+
+        if tcp_port:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind(("127.0.0.1", tcp_port))
+            self.listener.listen(5)
+            self.listener.setblocking(False)
+            tool_log.info("tcp: localhost:%d", tcp_port)
+
+    def close(self):
+        for client in self.clients:
+            if client.sock:
+                client.sock.close()
+        if self.listener:
+            self.listener.close()
+        os.close(self.clients[0].read_fd)
+        os.close(self.pty_slave)
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+
+    def _accept(self):
+        sock, addr = self.listener.accept()
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # New clients start with what arrives from now on
+        client = Client("tcp %s:%d" % addr, sock.fileno(), sock.fileno(), self.ring.head, sock)
+        self.clients.append(client)
+        tool_log.info("%s connected", client.name)
+
+    def _drop(self, client):
+        tool_log.info("%s disconnected (%d bytes in, %d out, %d overrun)",
+                      client.name, client.bytes_in, client.bytes_out, client.overrun)
+        self.clients.remove(client)
+        client.sock.close()
+
+    def _slowest(self):
+        return min([c.cursor for c in self.clients if c.holds_port] + [self.ring.head])
+
+    def _read_port(self):
+        try:
+            data = os.read(self.fd, min(CHUNK, self.ring.free_for(self._slowest())))
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        if data:
+            for client in self.clients:
+                lost = len(data) - self.ring.free_for(client.cursor)
+                if lost > 0:
+                    # Only clients that don't hold the port get here
+                    client.cursor += lost
+                    client.overrun += lost
+                    self.stats.overruns += lost
+            self.ring.write(data)
+            self.stats.rx += len(data)
+            self.stats.ring_high = max(self.stats.ring_high, self.ring.head - self._slowest())
+
+    def _read_client(self, client):
+        try:
+            data = os.read(client.read_fd, CHUNK) if not client.sock else client.sock.recv(CHUNK)
+        except (OSError, socket.error) as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            if client.sock:
+                self._drop(client)
+            return
+        if not data:
+            if client.sock:
+                self._drop(client)
+            return
+        client.bytes_in += len(data)
+        if not self.tx:
+            self.tx_since = time.time()
+        self.tx += data
+
+    def _write_client(self, client):
+        data = self.ring.read(client.cursor)
+        try:
+            n = os.write(client.write_fd, data) if not client.sock else client.sock.send(data)
+        except (OSError, socket.error) as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            if client.sock:
+                self._drop(client)
+            return
+        client.cursor += n
+        client.bytes_out += n
+
+    def _write_port(self, now):
+        # Whole packets, unless the oldest byte has waited long enough
+        if len(self.tx) >= USB_PACKET:
+            count = len(self.tx) - len(self.tx) % USB_PACKET
+        elif now - self.tx_since >= COALESCE_SECONDS:
+            count = len(self.tx)
+        else:
+            return
+        try:
+            n = os.write(self.fd, bytes(self.tx[:count]))
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        del self.tx[:n]
+        self.stats.tx += n
+        self.stats.packets += -(-n // USB_PACKET)
+        self.tx_since = now if self.tx else None
+
+    def _skip_stuck(self, now):
+        # A client that can't keep up holds the port for a while, then
+        # loses data
+        for client in self.clients:
+            if not client.holds_port or self.ring.free_for(client.cursor) > USB_PACKET:
+                client.stuck_since = None
+            elif client.stuck_since is None:
+                client.stuck_since = now
+            elif now - client.stuck_since > STALL_SECONDS:
+                lost = self.ring.head - client.cursor
+                client.cursor = self.ring.head
+                client.overrun += lost
+                client.stuck_since = None
+                self.stats.overruns += lost
+                tool_log.warning("%s fell behind; skipped %d bytes", client.name, lost)
+
+    def run(self, stats_interval=None):
+        last_stats = time.time()
+        last = time.time()
+        while True:
+            port_ok = self.ring.free_for(self._slowest()) > USB_PACKET
+            clients_ok = len(self.tx) < TX_LIMIT
+            readers = [self.fd] if port_ok else []
+            if clients_ok:
+                readers += [c.read_fd for c in self.clients]
+            if self.listener:
+                readers.append(self.listener)
+            writers = [c.write_fd for c in self.clients if c.cursor < self.ring.head]
+            if self.tx:
+                writers.append(self.fd)
+            timeout = COALESCE_SECONDS if self.tx else 0.5
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+
+            now = time.time()
+            if not port_ok:
+                self.stats.rx_held += now - last
+            if not clients_ok:
+                self.stats.tx_held += now - last
+            last = now
+
+            if self.fd in readable:
+                self._read_port()
+            if self.listener in readable:
+                self._accept()
+            for client in list(self.clients):
+                if client.read_fd in readable and client in self.clients:
+                    self._read_client(client)
+                if client.write_fd in writable and client in self.clients:
+                    self._write_client(client)
+            if self.tx:
+                self._write_port(now)
+            self._skip_stuck(now)
+
+            if stats_interval and now - last_stats >= stats_interval:
+                tool_log.info("%s", self.stats.line(self.clients, self.ring.head - self._slowest(),
+                                                    len(self.tx)))
+                self.stats.total_rx += self.stats.rx
+                self.stats.total_tx += self.stats.tx
+                self.stats.total_packets += self.stats.packets
+                self.stats.reset()
+                last_stats = now
+
+def main():
+    parser = argparse.ArgumentParser(description="Share the Electron's USB serial link over a pty and TCP")
+    parser.add_argument("--port", help="serial port (default: guess)")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--tcp", type=int, default=DEFAULT_TCP_PORT,
+                        help="localhost TCP port to listen on; 0 for none (default %(default)d)")
+    parser.add_argument("--link", help="make a symlink to the pty here, e.g. /tmp/elk")
+    parser.add_argument("--stats", type=float, default=10.0, metavar="SECONDS",
+                        help="print stats this often; 0 to only print them on exit")
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+
+    with mcu_port.Port(baud=args.baud, port=args.port) as ser:
+        bridge = Bridge(ser, args.tcp, args.link)
+        try:
+            bridge.run(args.stats)
+        except KeyboardInterrupt:
+            print()
+        finally:
+            stats = bridge.stats
+            tool_log.info("%s", stats.line(bridge.clients, bridge.ring.head - bridge._slowest(),
+                                           len(bridge.tx)))
+            tool_log.info("total: %d bytes from the Electron, %d to it in %d packets",
+                          stats.total_rx + stats.rx, stats.total_tx + stats.tx,
+                          stats.total_packets + stats.packets)
+            bridge.close()
+
+if __name__ == '__main__':
+    main()
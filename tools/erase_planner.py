@@ -0,0 +1,168 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Plans the erases for a flash programming job on the W25Q128JV.
+#
+# The chip erases 4kB sectors (20h), 32kB blocks (52h) or 64kB blocks (D8h),
+# and a block erase takes only a little longer than a sector erase, so the
+# plan uses the biggest erases that fit.  For each aligned 64kB block we pick
+# the cheapest of:
+#
+# - one 64kB erase,
+# - the best plans for its two 32kB halves, each of which is one 32kB erase
+#   or 4kB erases of the sectors that need it,
+#
+# where a block erase is only allowed if every sector in it is part of the
+# job (we'd lose anything else), and costs a rewrite of any sector in it
+# that wouldn't otherwise have been written.
+#
+# If the current contents are known (program_flash.py --compare), sectors
+# that already hold the right data are left alone, and sectors that only
+# need bits cleared are programmed without an erase.  Sectors that end up
+# all FF after an erase aren't written at all.
+
+SECTOR_SIZE = 4096
+BLOCK_SIZES = (65536, 32768, SECTOR_SIZE)
+
+# Typical times from the W25Q128JV datasheet
+ERASE_SECONDS = {
+    SECTOR_SIZE: 0.045,
+    32768: 0.120,
+    65536: 0.150,
+}
+# Sending, programming and verifying one 4kB sector through the firmware
+# ('p' or 'w'), which dominates the 16 x 0.4 ms of page program time
+WRITE_SECONDS = 0.09
+
+def describe_size(size):
+    return "%dK" % (size // 1024)
+
+class Plan:
+    def __init__(self, start, length):
+        self.start = start
+        self.length = length
+        self.erases = []         # [(addr, size)]
+        self.writes = []         # [(addr, length)], runs of whole sectors
+        self.skipped = 0         # sectors that already match
+
+    def write_sectors(self):
+        return sum(length for _, length in self.writes) // SECTOR_SIZE
+
+    def seconds(self):
+        return (sum(ERASE_SECONDS[size] for _, size in self.erases)
+                + self.write_sectors() * WRITE_SECONDS)
+
+    def sector_erase_seconds(self):
+        """What the old erase-every-sector-as-we-go approach would take."""
+        sectors = self.length // SECTOR_SIZE
+        return sectors * (ERASE_SECONDS[SECTOR_SIZE] + WRITE_SECONDS)
+
+    def summary(self):
+        counts = []
+        for size in BLOCK_SIZES:
+            n = sum(1 for _, s in self.erases if s == size)
+            if n:
+                counts.append("%d x %s" % (n, describe_size(size)))
+        return "%s erase%s, %d sector%s to write%s; predicted %.1f s (%.1f s with 4K erases only)" % (
+            ", ".join(counts) or "no", "" if len(self.erases) == 1 else "s",
+            self.write_sectors(), "" if self.write_sectors() == 1 else "s",
+            ", %d unchanged" % self.skipped if self.skipped else "",
+            self.seconds(), self.sector_erase_seconds())
+
+    def lines(self):
+        for addr, size in self.erases:
+            yield "  erase %-3s at %06x" % (describe_size(size), addr)
+        for addr, length in self.writes:
+            sectors = length // SECTOR_SIZE
+            yield "  write %06x-%06x (%d sector%s)" % (
+                addr, addr + length, sectors, "" if sectors == 1 else "s")
+
+def _all_ff(data):
+    return data.count(b"\xff") == len(data)
+
+def _programmable(current, new):
+    # NOR flash programming can only clear bits
+    return all(c & n == n for c, n in zip(bytearray(current), bytearray(new)))
+
+def plan(start, data, current=None):
+    """Plans programming data at start (both sector aligned).  current is
+    what the flash holds there now, if known."""
+    assert not start % SECTOR_SIZE, "start must be a multiple of %d" % SECTOR_SIZE
+    assert not len(data) % SECTOR_SIZE, "length must be a multiple of %d" % SECTOR_SIZE
+    result = Plan(start, len(data))
+
+    # Per sector (by address): does it need an erase, does it need writing,
+    # and would it need writing if something else erased it?
+    must_erase = set()
+    must_write = set()
+    rewrite = set()
+    for offset in range(0, len(data), SECTOR_SIZE):
+        addr = start + offset
+        new = data[offset:offset + SECTOR_SIZE]
+        if not _all_ff(new):
+            rewrite.add(addr)
+        if current is None:
+            must_erase.add(addr)
+            if addr in rewrite:
+                must_write.add(addr)
+            continue
+        old = current[offset:offset + SECTOR_SIZE]
+        if old == new:
+            result.skipped += 1
+        elif _programmable(old, new):
+            must_write.add(addr)
+        else:
+            must_erase.add(addr)
+            if addr in rewrite:
+                must_write.add(addr)
+    in_job = lambda addr: start <= addr < start + len(data)
+
+    def best(addr, size):
+        # Returns (seconds, [(addr, size)], sectors written as a side effect)
+        sectors = range(addr, addr + size, SECTOR_SIZE)
+        if not any(s in must_erase for s in sectors):
+            return 0.0, [], set()
+        options = []
+        if all(in_job(s) for s in sectors):
+            extra = set(s for s in sectors if s in rewrite and s not in must_write)
+            options.append((ERASE_SECONDS[size] + len(extra) * WRITE_SECONDS,
+                            [(addr, size)], extra))
+        if size > SECTOR_SIZE:
+            sub = BLOCK_SIZES[BLOCK_SIZES.index(size) + 1]
+            seconds, erases, extra = 0.0, [], set()
+            for sub_addr in range(addr, addr + size, sub):
+                s, e, x = best(sub_addr, sub)
+                seconds += s
+                erases += e
+                extra |= x
+            options.append((seconds, erases, extra))
+        return min(options, key=lambda option: option[0])
+
+    biggest = BLOCK_SIZES[0]
+    writes = set(must_write)
+    block = start - start % biggest
+    while block < start + len(data):
+        _, erases, extra = best(block, biggest)
+        result.erases += erases
+        writes |= extra
+        block += biggest
+
+    for addr in sorted(writes):
+        if result.writes and sum(result.writes[-1]) == addr:
+            result.writes[-1] = (result.writes[-1][0], result.writes[-1][1] + SECTOR_SIZE)
+        else:
+            result.writes.append((addr, SECTOR_SIZE))
+    return result
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Serves the board's W25Q128 flash as a network block device, so dd, cmp
+# and hex editors can work on it directly:
+#
+#   python flash_nbd.py [--port /dev/ttyACM0] [--tcp 10809]
+#   sudo nbd-client -N flash localhost 10809 /dev/nbd0
+#   sudo dd if=/dev/nbd0 of=flash.bin bs=1M
+#   sudo nbd-client -d /dev/nbd0
+#
+# It speaks the fixed newstyle NBD handshake (NBD_OPT_EXPORT_NAME, _GO,
+# _INFO and _LIST) and the READ, WRITE, FLUSH and DISC commands, and talks to
+# the board with the same commands as program_flash.py.
+#
+# Caching, by 4kB sector:
+#
+# - A read of an uncached sector fetches READ_AHEAD bytes (or up to the next
+#   cached sector) in one 'r' command, so a sequential pass runs at the
+#   link's full rate.  After that, reads come from memory.
+# - Writes only touch the cache and mark 256-byte pages dirty.  Dirty
+#   sectors go to the board on FLUSH (or a write with FUA), after
+#   IDLE_FLUSH_SECONDS without requests, when more than DIRTY_LIMIT bytes
+#   are waiting, and on disconnect.  Each run of adjacent dirty sectors is
+#   planned with erase_planner.py against what the flash held before, so a
+#   sector that only needs bits cleared isn't erased, and neighbouring
+#   sectors share 32kB/64kB block erases.
+# - If a write-back the client didn't ask for (idle or disconnect) fails,
+#   the sectors stay dirty, and the next FLUSH tries again and reports EIO
+#   if that fails too.
+#
+# The cache trusts that nothing else writes the flash while it's running.
+
+import argparse
+import select
+import socket
+import struct
+import time
+
+import erase_planner
+import flow_control
+import mcu_port
+import program_flash
+import tool_log
+
+FLASH_SIZE = 16 * 1024 * 1024
+SECTOR_SIZE = erase_planner.SECTOR_SIZE
+PAGE_SIZE = 256
+READ_AHEAD = 64 * 1024
+DIRTY_LIMIT = 1024 * 1024
+IDLE_FLUSH_SECONDS = 2.0
+DEFAULT_TCP_PORT = 10809
+EXPORT_NAME = b"flash"
+
+# Handshake
+NBDMAGIC = 0x4e42444d41474943
+IHAVEOPT = 0x49484156454f5054
+OPT_REPLY_MAGIC = 0x3e889045565a9
+FLAG_FIXED_NEWSTYLE = 1 << 0
+FLAG_NO_ZEROES = 1 << 1
+OPT_EXPORT_NAME = 1
+OPT_ABORT = 2
+OPT_LIST = 3
+OPT_INFO = 6
+OPT_GO = 7
+REP_ACK = 1
+REP_SERVER = 2
+REP_INFO = 3
+REP_ERR_UNSUP = (1 << 31) + 1
+REP_ERR_UNKNOWN = (1 << 31) + 6
+INFO_EXPORT = 0
+
+# Transmission
+REQUEST_MAGIC = 0x25609513
+REPLY_MAGIC = 0x67446698
+TFLAG_HAS_FLAGS = 1 << 0
+TFLAG_READ_ONLY = 1 << 1
+TFLAG_SEND_FLUSH = 1 << 2
+TFLAG_SEND_FUA = 1 << 3
+CMD_FLAG_FUA = 1 << 0
+CMD_READ = 0
+CMD_WRITE = 1
+CMD_DISC = 2
+CMD_FLUSH = 3
+EIO = 5
+EPERM = 1
+EINVAL = 22
+ENOSPC = 28
+
+class Board:
+    """Sector-aligned reads and writes through the firmware."""
+    def __init__(self, ser, port_name):
+        self.ser = ser
+        ser.write(b"\n")
+        program_flash.read_until(ser, b"OK")
+        self.flow = flow_control.FlowControl(ser, port_name=port_name)
+        self.block_erase = program_flash.has_block_erase(ser)
+        if not self.block_erase:
+            tool_log.info("Firmware doesn't support block erases; writing sector by sector")
+
+    def read(self, addr, length):
+        return program_flash.read_range(self.ser, addr, length)
+
+    def write(self, addr, data, current):
+        """Programs data at addr; current is what the flash holds there."""
+        try:
+            return self._write(addr, data, current)
+        except Exception:
+            # Leave the firmware at its prompt for whatever comes next
+            try:
+                flow_control.resync(self.ser)
+            except Exception as e:
+                tool_log.warning("%s", e)
+            raise
+
+    def _write(self, addr, data, current):
+        if not self.block_erase:
+            program_flash.program_with_retries(self.ser, b"p", data, addr, addr, len(data), self.flow)
+            return None
+        job = erase_planner.plan(addr, data, current)
+        for block_addr, size in job.erases:
+            program_flash.erase_block(self.ser, block_addr, size)
+        for write_addr, size in job.writes:
+            program_flash.program_with_retries(self.ser, b"w", data, addr, write_addr, size, self.flow)
+        return job
+
+class SectorCache:
+    def __init__(self, board, size=FLASH_SIZE):
+        self.board = board
+        self.size = size
+        self.flash = {}          # sector number -> bytes, as on the chip
+        self.dirty = {}          # sector number -> (bytearray, set of dirty pages)
+        self.stats = dict(read_hits=0, read_misses=0, board_reads=0, board_read_bytes=0,
+                          flushes=0, sectors_written=0, pages_dirtied=0,
+                          erases=0, predicted_seconds=0.0, flush_seconds=0.0)
+
+    def dirty_bytes(self):
+        return len(self.dirty) * SECTOR_SIZE
+
+    def _fill(self, sector):
+        # Read ahead from sector, stopping at the next sector we already have
+        last = min(sector + READ_AHEAD // SECTOR_SIZE, self.size // SECTOR_SIZE)
+        end = sector + 1
+        while end < last and end not in self.flash:
+            end += 1
+        data = self.board.read(sector * SECTOR_SIZE, (end - sector) * SECTOR_SIZE)
+        self.stats["board_reads"] += 1
+        self.stats["board_read_bytes"] += len(data)
+        for n in range(sector, end):
+            offset = (n - sector) * SECTOR_SIZE
+            self.flash[n] = data[offset:offset + SECTOR_SIZE]
+
+    def _sector(self, n):
+        # The current contents of sector n, including unflushed writes
+        if n in self.dirty:
+            return self.dirty[n][0]
+        if n not in self.flash:
+            self.stats["read_misses"] += 1
+            self._fill(n)
+        else:
+            self.stats["read_hits"] += 1
+        return self.flash[n]
+
+    def read(self, offset, length):
+        result = bytearray()
+        while length:
+            n, start = divmod(offset, SECTOR_SIZE)
+            count = min(length, SECTOR_SIZE - start)
+            result += self._sector(n)[start:start + count]
+            offset += count
+            length -= count
+        return bytes(result)
+
+    def write(self, offset, data):
+        data = memoryview(data)
+        while len(data):
+            n, start = divmod(offset, SECTOR_SIZE)
+            count = min(len(data), SECTOR_SIZE - start)
+            if n not in self.dirty:
+                if count == SECTOR_SIZE and n not in self.flash:
+                    # Whole sector overwritten; we still need the old
+                    # contents to plan the erase, but can get them at flush
+                    self.dirty[n] = (bytearray(SECTOR_SIZE), set())
+                else:
+                    self.dirty[n] = (bytearray(self._sector(n)), set())
+            buf, pages = self.dirty[n]
+            buf[start:start + count] = data[:count]
+            for page in range(start // PAGE_SIZE, (start + count - 1) // PAGE_SIZE + 1):
+                if page not in pages:
+                    pages.add(page)
+                    self.stats["pages_dirtied"] += 1
+            offset += count
+            data = data[count:]
+
+    def flush(self):
+        if not self.dirty:
+            return
+        t0 = time.time()
+        sectors = sorted(self.dirty)
+        for n in sectors:
+            if n not in self.flash:
+                self._fill(n)
+        # Sectors where the writes put back what was there already
+        for n in sectors:
+            if bytes(self.dirty[n][0]) == self.flash[n]:
+                del self.dirty[n]
+        runs = []
+        for n in sorted(self.dirty):
+            if runs and runs[-1][-1] == n - 1:
+                runs[-1].append(n)
+            else:
+                runs.append([n])
+        for run in runs:
+            data = b"".join(bytes(self.dirty[n][0]) for n in run)
+            current = b"".join(self.flash[n] for n in run)
+            job = self.board.write(run[0] * SECTOR_SIZE, data, current)
+            if job:
+                self.stats["erases"] += len(job.erases)
+                self.stats["predicted_seconds"] += job.seconds()
+            for n in run:
+                self.flash[n] = bytes(self.dirty.pop(n)[0])
+            self.stats["sectors_written"] += len(run)
+        self.stats["flushes"] += 1
+        self.stats["flush_seconds"] += time.time() - t0
+        tool_log.info("Flushed %d sectors in %d runs in %.1f s",
+                      sum(len(run) for run in runs), len(runs), time.time() - t0)
+
+    def try_flush(self, when):
+        """Flushes without raising; on failure the sectors stay dirty.
+        Returns True if everything was written."""
+        try:
+            self.flush()
+            return True
+        except Exception as e:
+            tool_log.error("Write-back %s failed, %d sectors still dirty: %s",
+                           when, len(self.dirty), e)
+            return False
+
+    def report(self):
+        s = self.stats
+        lookups = s["read_hits"] + s["read_misses"]
+        tool_log.info("reads: %d sector lookups, %.0f%% from cache; %d board reads (%d kB)",
+                      lookups, 100.0 * s["read_hits"] / lookups if lookups else 0,
+                      s["board_reads"], s["board_read_bytes"] // 1024)
+        tool_log.info("writes: %d pages dirtied, %d sectors written in %d flushes with %d erases, "
+                      "%.1f s (predicted %.1f s)",
+                      s["pages_dirtied"], s["sectors_written"], s["flushes"], s["erases"],
+                      s["flush_seconds"], s["predicted_seconds"])
+        tool_log.event("nbd_stats", **s)
+
+def recv_exactly(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return bytes(data)
+
+class NbdSession:
+    def __init__(self, sock, cache, read_only=False):
+        self.sock = sock
+        self.cache = cache
+        self.read_only = read_only
+        self.no_zeroes = False
+
+    def transmission_flags(self):
+        flags = TFLAG_HAS_FLAGS | TFLAG_SEND_FLUSH | TFLAG_SEND_FUA
+        if self.read_only:
+            flags |= TFLAG_READ_ONLY
+        return flags
+
+    def option_reply(self, option, reply, data=b""):
+        self.sock.sendall(struct.pack(">QIII", OPT_REPLY_MAGIC, option, reply, len(data)) + data)
+
+    def handshake(self):
+        """Returns True when the client is ready for transmission."""
+        self.sock.sendall(struct.pack(">QQH", NBDMAGIC, IHAVEOPT,
+                                      FLAG_FIXED_NEWSTYLE | FLAG_NO_ZEROES))
+        client_flags, = struct.unpack(">I", recv_exactly(self.sock, 4))
+        self.no_zeroes = bool(client_flags & FLAG_NO_ZEROES)
+        while True:
+            magic, option, length = struct.unpack(">QII", recv_exactly(self.sock, 16))
+            if magic != IHAVEOPT:
+                return False
+            data = recv_exactly(self.sock, length)
+            if option == OPT_EXPORT_NAME:
+                if data not in (b"", EXPORT_NAME):
+                    return False
+                self.sock.sendall(struct.pack(">QH", self.cache.size, self.transmission_flags())
+                                  + (b"" if self.no_zeroes else b"\0" * 124))
+                return True
+            elif option == OPT_ABORT:
+                self.option_reply(option, REP_ACK)
+                return False
+            elif option == OPT_LIST:
+                self.option_reply(option, REP_SERVER,
+                                  struct.pack(">I", len(EXPORT_NAME)) + EXPORT_NAME)
+                self.option_reply(option, REP_ACK)
+            elif option in (OPT_INFO, OPT_GO):
+                name_length, = struct.unpack(">I", data[:4])
+                name = data[4:4 + name_length]
+                if name not in (b"", EXPORT_NAME):
+                    self.option_reply(option, REP_ERR_UNKNOWN)
+                    continue
+                self.option_reply(option, REP_INFO, struct.pack(
+                    ">HQH", INFO_EXPORT, self.cache.size, self.transmission_flags()))
+                self.option_reply(option, REP_ACK)
+                if option == OPT_GO:
+                    return True
+            else:
+                self.option_reply(option, REP_ERR_UNSUP)
+
+    def reply(self, handle, error=0, data=b""):
+        self.sock.sendall(struct.pack(">IIQ", REPLY_MAGIC, error, handle) + data)
+
+    def serve(self):
+        """Handles requests until the client disconnects."""
+        idle_failed = False
+        while True:
+            if self.cache.dirty and not idle_failed and \
+                    not select.select([self.sock], [], [], IDLE_FLUSH_SECONDS)[0]:
+                # Idle: a good time to write back.  If it fails, leave it
+                # to the client's next FLUSH rather than retrying in a loop
+                idle_failed = not self.cache.try_flush("while idle")
+                continue
+            header = recv_exactly(self.sock, 28)
+            idle_failed = False
+            magic, flags, kind, handle, offset, length = struct.unpack(">IHHQQI", header)
+            if magic != REQUEST_MAGIC:
+                raise EOFError()
+            data = recv_exactly(self.sock, length) if kind == CMD_WRITE else None
+            if kind == CMD_DISC:
+                return
+            if offset + length > self.cache.size and kind in (CMD_READ, CMD_WRITE):
+                self.reply(handle, EINVAL if kind == CMD_READ else ENOSPC)
+                continue
+            try:
+                if kind == CMD_READ:
+                    self.reply(handle, 0, self.cache.read(offset, length))
+                    continue
+                elif kind == CMD_WRITE:
+                    if self.read_only:
+                        self.reply(handle, EPERM)
+                        continue
+                    self.cache.write(offset, data)
+                    if flags & CMD_FLAG_FUA or self.cache.dirty_bytes() > DIRTY_LIMIT:
+                        self.cache.flush()
+                elif kind == CMD_FLUSH:
+                    self.cache.flush()
+                else:
+                    self.reply(handle, EINVAL)
+                    continue
+            except Exception as e:
+                tool_log.error("Error handling request %d at %06x+%d: %s", kind, offset, length, e)
+                self.reply(handle, EIO)
+                continue
+            self.reply(handle)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the board's flash as a network block device")
+    parser.add_argument("--port", help="serial port (default: guess, or board_daemon.py)")
+    parser.add_argument("--tcp", type=int, default=DEFAULT_TCP_PORT,
+                        help="localhost TCP port to listen on (default %(default)d)")
+    parser.add_argument("--read-only", action="store_true")
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+
+    with mcu_port.Port(port=args.port) as ser:
+        cache = SectorCache(Board(ser, args.port or ser.port))
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("localhost", args.tcp))
+        listener.listen(1)
+        tool_log.info("Serving %d MB of flash as '%s' on localhost:%d",
+                      cache.size // (1024 * 1024), EXPORT_NAME.decode(), args.tcp)
+        try:
+            while True:
+                sock, addr = listener.accept()
+                tool_log.info("Client connected from %s:%d", *addr)
+                session = NbdSession(sock, cache, args.read_only)
+                try:
+                    if session.handshake():
+                        session.serve()
+                except (EOFError, socket.error):
+                    pass
+                finally:
+                    sock.close()
+                    cache.try_flush("on disconnect")
+                    tool_log.info("Client disconnected")
+                    cache.report()
+        except KeyboardInterrupt:
+            print()
+        finally:
+            cache.try_flush("on exit")
+            # Once per run, not per flush: save() counts clean runs towards
+            # letting the chunk size ceiling expire
+            try:
+                cache.board.flow.save()
+            except (IOError, OSError) as e:
+                tool_log.warning("Couldn't save flow control state: %s", e)
+            listener.close()
+            mcu_port.finish(ser)
+
+if __name__ == '__main__':
+    main()
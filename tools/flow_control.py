@@ -0,0 +1,198 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Adaptive write chunking for the D11's USB serial port.
+#
+# Arduino USB serial stacks have been seen to lose data or hang when the host
+# writes more than 63 (sometimes 127) bytes at a time, while the ASF firmware
+# takes whole 4kB blocks.  Rather than hardcode a size, FlowControl starts
+# small (or at whatever worked last time for this board) and moves up
+# CHUNK_SIZES one step after RAMP_AFTER clean blocks.  The caller reports
+# each block: success when the firmware's page checksums match what was sent,
+# failure on a mismatch or a stall (no response for STALL_SECONDS, or a write
+# that times out).  A failure drops back to the last good size and stops it
+# ramping past the failing one.
+#
+# Boards are identified with the firmware's 'i' command (firmware name and
+# the flash chip's 64-bit unique ID); older firmware doesn't answer it, and
+# then the port name has to do.  The best size and the size that failed are
+# kept per board in STATE_FN.  A failure may just have been a USB hiccup, so
+# the failed size is forgotten after CEILING_EXPIRY_RUNS runs without any
+# trouble, and tried again.
+
+import json
+import os
+import re
+import time
+
+import serial
+
+import tool_log
+
+CHUNK_SIZES = [63, 127, 255, 511, 1023, 2047, 4096]
+RAMP_AFTER = 4
+CEILING_EXPIRY_RUNS = 3
+STALL_SECONDS = 2.0
+# board_daemon.py may take two handshake timeouts and a DTR drop to recover
+# the firmware before our new session starts
+DAEMON_RESYNC_SECONDS = 10.0
+
+STATE_FN = os.path.join(
+    os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config"),
+    "elk-tools", "flow_control.json")
+
+class LinkError(Exception):
+    """Data went missing or arrived corrupted; worth retrying smaller."""
+
+def _read_oks(ser, resp, count, deadline):
+    while resp.count(b"OK") < count and time.time() < deadline:
+        resp += ser.read(1024)
+        time.sleep(0.01)
+    return resp
+
+def identify(ser, timeout=2.0):
+    """Returns (firmware, board id) from the 'i' command, or ("unknown",
+    None) for firmware that doesn't have it."""
+    ser.write(b"i\n")
+    deadline = time.time() + timeout
+    # Old firmware ignores the 'i' and answers the '\n'; new firmware sends
+    # the ID line before either OK
+    resp = _read_oks(ser, b"", 1, deadline)
+    m = re.search(br"ID: (\w+) ([0-9A-Fa-f]+)", resp)
+    if not m:
+        return "unknown", None
+    _read_oks(ser, resp, 2, deadline)
+    return m.group(1).decode(), m.group(2).decode().lower()
+
+def resync(ser):
+    """Gets the firmware back to its prompt after a failed transfer.  It may
+    be waiting for the rest of a page, so drop DTR to make it give up."""
+    timeout = 5
+    if getattr(ser, "shared", False) and hasattr(ser, "reconnect"):
+        # Through board_daemon.py there's no DTR, and the firmware would
+        # take our "\n" as page data; the daemon recovers it between sessions
+        ser.reconnect()
+        timeout = DAEMON_RESYNC_SECONDS
+    elif hasattr(ser, "dtr"):
+        ser.dtr = False
+        time.sleep(0.2)
+        ser.dtr = True
+        # online_waiting, then the banner and flash detection
+        time.sleep(0.5)
+    ser.read(65536)
+    ser.write(b"\n")
+    resp = b""
+    deadline = time.time() + timeout
+    while b"OK" not in resp and time.time() < deadline:
+        resp += ser.read(1024)
+        time.sleep(0.01)
+    if b"OK" not in resp:
+        raise Exception("Board didn't come back after a failed transfer")
+
+def _load_state(fn):
+    try:
+        with open(fn) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+class FlowControl:
+    def __init__(self, ser, port_name=None, state_fn=STATE_FN):
+        self.ser = ser
+        self.state_fn = state_fn
+        self.firmware, board = identify(ser)
+        self.board = "%s-%s" % (self.firmware, board) if board else "port-%s" % port_name
+        saved = _load_state(state_fn).get(self.board, {})
+        self.ceiling = saved.get("ceiling")      # smallest size that failed
+        # Runs without trouble since the ceiling was set
+        self.clean_runs = saved.get("clean_runs", 0)
+        self.index = self._index_of(saved.get("chunk", CHUNK_SIZES[0]))
+        self.good = None                         # biggest size that worked this time
+        self.clean = 0
+        self.failures = 0
+        self.stall_seconds = STALL_SECONDS
+        if hasattr(ser, "write_timeout"):
+            # So a wedged device shows up as a stall rather than a hang
+            ser.write_timeout = STALL_SECONDS
+        tool_log.info("Board %s (%s firmware); starting with %d byte writes%s",
+                      self.board, self.firmware, self.chunk,
+                      ", %d failed before" % self.ceiling if self.ceiling else "")
+
+    @staticmethod
+    def _index_of(chunk):
+        return max(i for i, size in enumerate(CHUNK_SIZES) if size <= chunk or i == 0)
+
+    @property
+    def chunk(self):
+        return CHUNK_SIZES[self.index]
+
+    def write(self, data):
+        """Writes data in chunks of the current size."""
+        while data:
+            try:
+                n = self.ser.write(data[:self.chunk])
+            except serial.SerialTimeoutException:
+                raise LinkError("write timed out with %d byte chunks" % self.chunk)
+            if n:
+                data = data[n:]
+            else:
+                time.sleep(0.001)
+
+    def success(self):
+        """Call after each block the firmware confirmed."""
+        self.good = max(self.good or 0, self.chunk)
+        self.clean += 1
+        if self.clean < RAMP_AFTER or self.index == len(CHUNK_SIZES) - 1:
+            return
+        bigger = CHUNK_SIZES[self.index + 1]
+        if self.ceiling and bigger >= self.ceiling:
+            return
+        self.index += 1
+        self.clean = 0
+
+    def failure(self, reason):
+        """Call when a block went wrong; the caller resyncs and retries."""
+        self.failures += 1
+        failed = self.chunk
+        self.ceiling = min(self.ceiling or failed, failed)
+        self.clean_runs = 0
+        self.index = self._index_of(self.good if self.good and self.good < failed
+                                    else CHUNK_SIZES[max(self.index - 1, 0)])
+        self.clean = 0
+        tool_log.warning("Link trouble (%s) at %d byte writes; dropping to %d",
+                         reason, failed, self.chunk)
+        tool_log.event("link_failure", board=self.board, reason=str(reason),
+                       failed=failed, chunk=self.chunk)
+
+    def save(self):
+        """Remembers the best size for this board."""
+        state = _load_state(self.state_fn)
+        best = self.good or self.chunk
+        if self.ceiling and not self.failures:
+            self.clean_runs += 1
+            if self.clean_runs >= CEILING_EXPIRY_RUNS:
+                tool_log.info("No link trouble in %d runs; will try %d byte writes again",
+                              self.clean_runs, self.ceiling)
+                self.ceiling = None
+                self.clean_runs = 0
+        state[self.board] = {"chunk": best, "ceiling": self.ceiling,
+                             "clean_runs": self.clean_runs}
+        if not os.path.isdir(os.path.dirname(self.state_fn)):
+            os.makedirs(os.path.dirname(self.state_fn))
+        with open(self.state_fn, "w") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        tool_log.info("Best write size for %s: %d bytes%s", self.board, best,
+                      " (%d failures)" % self.failures if self.failures else "")
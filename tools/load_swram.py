@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Push a 16kB ROM image into one of the SDRAM-backed sideways RAM banks
+# (4-7, with Banks_4_5_6_7_InRAM in ElectronULA_max10.vhd) over the USB
+# serial link, instead of rebuilding rom_image.bin and reflashing.
+#
+# The D11 can't reach the SDRAM, so the Electron does the writing: a small
+# loader (LOADER_SOURCE, BBC BASIC with inline assembler) waits on &FCA0/
+# &FCA1 for
+#
+#   'S', bank, flags, 16384 bytes of ROM
+#
+# pages the bank in, stores the data, then reads the whole bank back and
+# replies
+#
+#   'K', bank, 16-bit sum of the bank contents (LE)
+#
+# which has to match the sum of the image we sent.  With flags bit 0 set
+# (--reset) it then jumps through the reset vector so the MOS picks up the
+# new ROM; otherwise it goes back to waiting for the next image.  ESCAPE on
+# the Electron leaves the loader.
+#
+# One-off setup: get the loader onto the Electron (e.g. python load_swram.py
+# --loader > LOADER, then *EXEC it from SD card, or type it in) and RUN it.
+# After a --reset, CALL &900 starts it again.
+#
+#   python load_swram.py --bank 4 myrom.rom [--reset] [--port tcp:localhost:6502]
+
+import argparse
+import sys
+import time
+
+import mcu_port
+import tool_log
+
+ROM_SIZE = 16384
+RAM_BANKS = (4, 5, 6, 7)
+# The firmware forwards the Electron's serial port at this baud rate
+SERIAL_BAUD = 115200
+REPLY_TIMEOUT = 5
+
+FLAG_RESET = 0x01
+
+LOADER_ORG = 0x900
+LOADER_SOURCE = r"""
+REM Sideways RAM loader for load_swram.py
+ptr=&70:sum=&72:bank=&74:flags=&75
+FOR pass%=0 TO 2 STEP 2
+P%=&{org:X}
+[OPT pass%
+.wait BIT &FF:BMI quit
+LDA &FCA1:LSR A:BCC wait
+SEI
+JSR get:CMP #ASC"S":BNE again
+JSR get:STA bank
+JSR get:STA flags
+\ Page out BASIC first; from 8-11 only 8-15 can be selected
+LDA #12:STA &FE05:LDA bank:STA &FE05
+LDY #0:STY ptr:LDA #&80:STA ptr+1
+.store JSR get:STA (ptr),Y:INY:BNE store
+INC ptr+1:LDA ptr+1:CMP #&C0:BNE store
+\ Sum what actually ended up in the bank
+LDA #&80:STA ptr+1:STY sum:STY sum+1
+.add LDA (ptr),Y:CLC:ADC sum:STA sum:BCC nc:INC sum+1
+.nc INY:BNE add
+INC ptr+1:LDA ptr+1:CMP #&C0:BNE add
+LDA #12:STA &FE05:LDA &F4:STA &FE05
+LDA #ASC"K":JSR put
+LDA bank:JSR put:LDA sum:JSR put:LDA sum+1:JSR put
+LDA flags:LSR A:BCC again
+JMP (&FFFC)
+.again CLI:JMP wait
+.quit LDA #&7E:JSR &FFF4:RTS
+.get LDA &FCA1:LSR A:BCC get:LDA &FCA0:RTS
+.put PHA
+.putw LDA &FCA1:AND #2:BEQ putw:PLA:STA &FCA0:RTS
+]
+NEXT
+PRINT "Waiting for load_swram.py; ESCAPE to stop"
+CALL &{org:X}
+"""
+
+def loader_listing(org=LOADER_ORG):
+    """The loader as a numbered BASIC listing, ready for *EXEC."""
+    lines = [line for line in LOADER_SOURCE.format(org=org).splitlines() if line]
+    return "".join("%d %s\r" % ((n + 1) * 10, line) for n, line in enumerate(lines))
+
+def rom_sum(data):
+    return sum(bytearray(data)) & 0xffff
+
+def read_rom(fn):
+    data = open(fn, "rb").read()
+    if len(data) > ROM_SIZE:
+        raise Exception("%s is %d bytes; a sideways ROM can't be more than %d"
+                        % (fn, len(data), ROM_SIZE))
+    # Pad with FF, as pad_rom.py does
+    return data + b"\xff" * (ROM_SIZE - len(data))
+
+def check_header(data):
+    """Returns a warning string if data doesn't look like a sideways ROM."""
+    rom_type = bytearray(data[6:7])[0]
+    copyright = bytearray(data[7:8])[0]
+    if not rom_type & 0xc0:
+        return "ROM type byte (%02x) has neither a service nor a language entry" % rom_type
+    if data[copyright:copyright + 4] != b"\x00(C)":
+        return "no (C) string at the copyright offset (%02x)" % copyright
+    return None
+
+def read_reply(ser, timeout=REPLY_TIMEOUT):
+    # Returns the 4 byte reply, skipping anything the Electron printed
+    resp = bytearray()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        resp += ser.read(64)
+        p = resp.find(b"K")
+        if p != -1 and len(resp) >= p + 4:
+            return resp[p:p + 4]
+        if not resp:
+            time.sleep(0.001)
+    raise Exception("No reply from the loader on the Electron (is it running?); got %r"
+                    % bytes(resp))
+
+def load(ser, bank, data, reset=False):
+    """Sends one image and checks the loader's sum of the bank.  Returns
+    the number of seconds it took."""
+    t0 = time.time()
+    ser.read(4096)  # anything stale
+    ser.write(bytes(bytearray([ord("S"), bank, FLAG_RESET if reset else 0])) + data)
+    _, reply_bank, lo, hi = read_reply(ser)
+    elapsed = time.time() - t0
+    if reply_bank != bank:
+        raise Exception("Loader wrote bank %d, not %d" % (reply_bank, bank))
+    expected = rom_sum(data)
+    got = lo | (hi << 8)
+    if got != expected:
+        raise Exception("Bank %d checksum %04x doesn't match the image (%04x); "
+                        "is there RAM in that bank?" % (bank, got, expected))
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load a ROM image into sideways RAM over the USB serial link")
+    parser.add_argument("rom", nargs="?", help="ROM image (up to 16kB; padded with FF)")
+    parser.add_argument("--bank", type=int, default=4, choices=RAM_BANKS,
+                        help="sideways RAM bank (default %(default)d)")
+    parser.add_argument("--reset", action="store_true",
+                        help="reset the Electron afterwards so the MOS sees the new ROM")
+    parser.add_argument("--port", help="serial port, or tcp:host:port for elk_serial_bridge.py")
+    parser.add_argument("--loader", action="store_true",
+                        help="print the Electron side loader (BASIC) and exit")
+    parser.add_argument("--org", type=lambda s: int(s, 0), default=LOADER_ORG,
+                        help="where the loader assembles to (default 0x%(default)x)")
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+
+    if args.loader:
+        sys.stdout.write(loader_listing(args.org))
+        return
+    if not args.rom:
+        parser.error("give a ROM image to load, or --loader")
+
+    data = read_rom(args.rom)
+    warning = check_header(data)
+    if warning:
+        tool_log.warning("Warning: %s: %s", args.rom, warning)
+
+    with mcu_port.Port(baud=SERIAL_BAUD, port=args.port) as ser:
+        try:
+            elapsed = load(ser, args.bank, data, args.reset)
+        except Exception as e:
+            tool_log.error("Failed: %s", e)
+            sys.exit(1)
+    tool_log.info("Loaded %s into bank %d in %.2f s (%.1f kB/s), checksum %04x verified%s",
+                  args.rom, args.bank, elapsed, ROM_SIZE / 1024.0 / elapsed, rom_sum(data),
+                  "; resetting" if args.reset else "")
+
+if __name__ == '__main__':
+    main()
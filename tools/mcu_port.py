@@ -14,8 +14,30 @@ from __future__ import print_function
 # limitations under the License.
 
 import glob
+import os
+import select
+import socket
+import time
+
 import serial
 
+import tool_log
+
+# Ports named tcp:host:port connect to elk_serial_bridge.py instead, to share
+# the serial port with whatever else is using the bridge
+TCP_PREFIX = "tcp:"
+
+# Ports named unix:/path connect to board_daemon.py, which keeps the
+# firmware's command interface open between tools.  When no port is given
+# for command mode and the daemon's default socket exists, that's used.
+UNIX_PREFIX = "unix:"
+DAEMON_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or "/tmp",
+                             "elk-board-%d.sock" % os.getuid())
+
+# The firmware forwards the Electron's serial port at this baud rate, and
+# runs its command interface at any other
+SERIAL_BAUD = 115200
+
 def guess_port():
     port = None
     for pattern in "/dev/ttyACM? /dev/ttyUSB? /dev/tty.usbserial* /dev/tty.usbmodem* /dev/tty.wchusbserial*".split():
@@ -23,16 +45,90 @@ def guess_port():
         if matches:
             return matches[0]
 
+class SocketPort:
+    """Enough of serial.Serial to talk through elk_serial_bridge.py or
+    board_daemon.py."""
+    def __init__(self, sock, port, timeout=0, shared=False, path=None):
+        self.sock = sock
+        self.port = port
+        self.timeout = timeout
+        # True when the far end keeps the firmware in command mode for us
+        self.shared = shared
+        self.path = path
+
+    @classmethod
+    def tcp(cls, host, port):
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(sock, "%s%s:%d" % (TCP_PREFIX, host, port))
+
+    @classmethod
+    def unix(cls, path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return cls(sock, UNIX_PREFIX + path, shared=True, path=path)
+
+    def reconnect(self):
+        """Ends this board_daemon.py session and queues a new one.  Between
+        sessions the daemon gets the firmware back to its prompt, dropping
+        DTR if it has to, which can't be done through the socket."""
+        self.sock.close()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+        self.timeout = self._timeout
+
+    def __repr__(self):
+        return "SocketPort(%s)" % self.port
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        self.sock.settimeout(value)
+
+    @property
+    def in_waiting(self):
+        if not select.select([self.sock], [], [], 0)[0]:
+            return 0
+        return len(self.sock.recv(65536, socket.MSG_PEEK))
+
+    def read(self, size=1):
+        try:
+            return self.sock.recv(size)
+        except (socket.timeout, BlockingIOError):
+            return b""
+
+    def write(self, data):
+        self.sock.sendall(data)
+        return len(data)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
 class Port:
     def __init__(self, baud=9600, port=None):
+        if not port and baud != SERIAL_BAUD and os.path.exists(DAEMON_SOCKET):
+            port = UNIX_PREFIX + DAEMON_SOCKET
         if not port:
             port = guess_port()
         if not port:
             raise Exception("Port not provided, and could not guess it")
 
-        print("Opening port %s" % port)
-        self.ser = serial.Serial(port, timeout=0, baudrate=baud)
-        print("Serial port opened: %s" % repr(self.ser))
+        tool_log.info("Opening port %s", port)
+        if port.startswith(TCP_PREFIX):
+            host, _, tcp_port = port[len(TCP_PREFIX):].rpartition(":")
+            self.ser = SocketPort.tcp(host or "localhost", int(tcp_port))
+        elif port.startswith(UNIX_PREFIX):
+            self.ser = SocketPort.unix(port[len(UNIX_PREFIX):])
+        else:
+            self.ser = serial.Serial(port, timeout=0, baudrate=baud)
+        tool_log.debug("Serial port opened: %r", self.ser)
 
     def __enter__(self):
         return self.ser
@@ -40,3 +136,11 @@ class Port:
     def __exit__(self, type, value, traceback):
         self.ser.close()
 
+def finish(ser):
+    """Leaves the firmware's command interface.  Through board_daemon.py the
+    daemon keeps it open for the next tool, so there's nothing to do."""
+    if getattr(ser, "shared", False):
+        return
+    ser.write(b"x")
+    time.sleep(0.5)
+    tool_log.debug("%r", ser.read(1024))
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Builds and updates the BEEB.MMB disc bundle that MMFS (mmfs_swram.rom)
+# reads from the SD card, one disc at a time.
+#
+# An MMB is a HEADER_SIZE byte header followed by up to MAX_DISCS slots of
+# DISC_SIZE bytes, each holding one single sided 80 track DFS disc (an .ssd
+# image, zero padded).  The header starts with the discs MMFS puts in drives
+# 0-3 at boot (low bytes, then high bytes), and from offset 16 has one 16
+# byte catalogue entry per slot: the disc title (12 bytes, zero padded), then
+# a status byte at offset 15: STATUS_LOCKED, STATUS_UNLOCKED,
+# STATUS_UNFORMATTED (empty slot) or STATUS_INVALID.
+#
+# Rather than rebuilding the whole bundle when one disc changes, the bundle
+# is memory-mapped, and adding, replacing or removing a disc writes only its
+# slot and its catalogue entry.  Images whose title matches a disc already
+# in the bundle replace it (unless --slot says where to put them); others go
+# in the first empty slot.  Images identical to what's in the slot already
+# aren't written at all, so re-importing a directory only touches the discs
+# that changed.
+#
+#   python mmb_tool.py BEEB.MMB create
+#   python mmb_tool.py BEEB.MMB list
+#   python mmb_tool.py BEEB.MMB add elite.ssd [--slot 5] [--locked]
+#   python mmb_tool.py BEEB.MMB import games/
+#   python mmb_tool.py BEEB.MMB extract 5 elite.ssd
+#   python mmb_tool.py BEEB.MMB remove 5
+
+import argparse
+import mmap
+import os
+import time
+
+import tool_log
+
+HEADER_SIZE = 8192
+ENTRY_SIZE = 16
+TITLE_SIZE = 12
+MAX_DISCS = (HEADER_SIZE - ENTRY_SIZE) // ENTRY_SIZE
+SECTOR_SIZE = 256
+DISC_SECTORS = 800
+DISC_SIZE = DISC_SECTORS * SECTOR_SIZE
+
+STATUS_LOCKED = 0x00
+STATUS_UNLOCKED = 0x0F
+STATUS_UNFORMATTED = 0xF0
+STATUS_INVALID = 0xFF
+
+STATUS_NAMES = {
+    STATUS_LOCKED: "locked",
+    STATUS_UNLOCKED: "",
+    STATUS_UNFORMATTED: "empty",
+    STATUS_INVALID: "invalid",
+}
+
+class MmbError(Exception):
+    pass
+
+def ssd_title(data):
+    """The title from a DFS catalogue: 8 bytes in sector 0, 4 in sector 1."""
+    raw = data[:8] + data[SECTOR_SIZE:SECTOR_SIZE + 4]
+    return raw.split(b"\0")[0].rstrip(b" ").decode("latin-1")
+
+def ssd_sectors(data):
+    """The disc size from a DFS catalogue, in sectors."""
+    s1 = bytearray(data[SECTOR_SIZE:2 * SECTOR_SIZE])
+    return ((s1[6] & 3) << 8) | s1[7]
+
+def read_ssd(fn):
+    data = open(fn, "rb").read()
+    if len(data) > DISC_SIZE:
+        raise MmbError("%s is %d bytes; an MMB slot holds a single sided disc of up to %d"
+                       % (fn, len(data), DISC_SIZE))
+    if len(data) < 2 * SECTOR_SIZE:
+        raise MmbError("%s is too short to hold a DFS catalogue" % fn)
+    return data
+
+class Entry:
+    def __init__(self, slot, title, status):
+        self.slot = slot
+        self.title = title
+        self.status = status
+
+    @property
+    def formatted(self):
+        return self.status in (STATUS_LOCKED, STATUS_UNLOCKED)
+
+def create(path, discs=MAX_DISCS):
+    """Writes an empty bundle.  The slots are left as a hole in the file,
+    so this is quick and takes little space on most filesystems."""
+    if not 1 <= discs <= MAX_DISCS:
+        raise MmbError("an MMB holds 1 to %d discs" % MAX_DISCS)
+    header = bytearray(HEADER_SIZE)
+    header[0:4] = bytearray([0, 1, 2, 3])
+    for slot in range(MAX_DISCS):
+        header[ENTRY_SIZE + slot * ENTRY_SIZE + 15] = (
+            STATUS_UNFORMATTED if slot < discs else STATUS_INVALID)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.truncate(HEADER_SIZE + discs * DISC_SIZE)
+
+class Mmb:
+    """A memory-mapped MMB.  Changes go straight into the mapping; close()
+    (or leaving a with block) flushes them."""
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.f = open(path, "r+b" if writable else "rb")
+        size = os.fstat(self.f.fileno()).st_size
+        if size < HEADER_SIZE:
+            self.f.close()
+            raise MmbError("%s is too short (%d bytes) to be an MMB" % (path, size))
+        self.map = mmap.mmap(self.f.fileno(), 0,
+                             access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        # Some bundles are cut short after the last disc in use
+        self.slots = min(MAX_DISCS, (size - HEADER_SIZE) // DISC_SIZE)
+        self.dirty = []          # (offset, length) ranges to flush
+        self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.map.close()
+        self.f.close()
+
+    def flush(self):
+        for offset, length in self.dirty:
+            start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            self.map.flush(start, offset + length - start)
+        self.dirty = []
+
+    def _write(self, offset, data):
+        self.map[offset:offset + len(data)] = data
+        self.dirty.append((offset, len(data)))
+
+    def _entry_offset(self, slot):
+        return ENTRY_SIZE + slot * ENTRY_SIZE
+
+    def _check_slot(self, slot):
+        if not 0 <= slot < self.slots:
+            raise MmbError("slot %d is outside the bundle (0-%d)" % (slot, self.slots - 1))
+
+    def entry(self, slot):
+        self._check_slot(slot)
+        raw = self.map[self._entry_offset(slot):self._entry_offset(slot) + ENTRY_SIZE]
+        return Entry(slot, raw[:TITLE_SIZE].split(b"\0")[0].decode("latin-1"),
+                     bytearray(raw)[15])
+
+    def entries(self):
+        return [self.entry(slot) for slot in range(self.slots)]
+
+    def boot_discs(self):
+        header = bytearray(self.map[:8])
+        return [header[n] | (header[n + 4] << 8) for n in range(4)]
+
+    def index(self):
+        """Slots by lower case title, for the discs in use."""
+        if self._index is None:
+            self._index = {}
+            for entry in self.entries():
+                if entry.formatted and entry.title:
+                    self._index.setdefault(entry.title.lower(), entry.slot)
+        return self._index
+
+    def free_slot(self):
+        for slot in range(self.slots):
+            if self.entry(slot).status == STATUS_UNFORMATTED:
+                return slot
+        raise MmbError("no empty slots left in %s" % self.path)
+
+    def _disc_offset(self, slot):
+        return HEADER_SIZE + slot * DISC_SIZE
+
+    def read_disc(self, slot):
+        """The slot's image, trimmed to the size in its catalogue."""
+        self._check_slot(slot)
+        offset = self._disc_offset(slot)
+        data = self.map[offset:offset + DISC_SIZE]
+        sectors = min(max(ssd_sectors(data), 2), DISC_SECTORS)
+        return data[:sectors * SECTOR_SIZE]
+
+    def _set_entry(self, slot, title, status):
+        raw = title.encode("latin-1")[:TITLE_SIZE].ljust(TITLE_SIZE, b"\0")
+        self._write(self._entry_offset(slot), raw + b"\0\0\0" + bytearray([status]))
+        self._index = None
+
+    def write_disc(self, slot, data, locked=False):
+        """Puts an image in a slot, replacing what was there.  Returns False
+        if the slot already held exactly this."""
+        self._check_slot(slot)
+        data = data.ljust(DISC_SIZE, b"\0")
+        title = ssd_title(data)
+        status = STATUS_LOCKED if locked else STATUS_UNLOCKED
+        offset = self._disc_offset(slot)
+        entry = self.entry(slot)
+        if entry.status == status and entry.title == title[:TITLE_SIZE] \
+                and self.map[offset:offset + DISC_SIZE] == data:
+            return False
+        self._write(offset, data)
+        self._set_entry(slot, title, status)
+        return True
+
+    def remove_disc(self, slot):
+        self._check_slot(slot)
+        self._set_entry(slot, "", STATUS_UNFORMATTED)
+
+    def slot_for(self, data):
+        """Where add puts an image: the disc with the same title, or the
+        first empty slot."""
+        title = ssd_title(data)
+        if title and title.lower() in self.index():
+            return self.index()[title.lower()]
+        return self.free_slot()
+
+def add_images(mmb, paths, slot=None, locked=False):
+    """Adds or replaces each image.  Returns (written, unchanged)."""
+    written = unchanged = 0
+    for fn in paths:
+        t0 = time.time()
+        data = read_ssd(fn)
+        target = slot if slot is not None else mmb.slot_for(data)
+        replacing = mmb.entry(target)
+        if mmb.write_disc(target, data, locked):
+            written += 1
+            tool_log.info("%s -> slot %d '%s'%s in %.1f ms", fn, target, ssd_title(data),
+                          " (was '%s')" % replacing.title if replacing.formatted else "",
+                          (time.time() - t0) * 1000)
+        else:
+            unchanged += 1
+            tool_log.debug("%s: slot %d is already up to date", fn, target)
+    return written, unchanged
+
+def ssd_files(directory):
+    return sorted(os.path.join(directory, fn) for fn in os.listdir(directory)
+                  if fn.lower().endswith(".ssd"))
+
+def list_bundle(mmb, show_empty=False):
+    print("%s: %d slots; boot discs %s" % (
+        mmb.path, mmb.slots, " ".join("%d" % n for n in mmb.boot_discs())))
+    used = 0
+    for entry in mmb.entries():
+        if entry.formatted:
+            used += 1
+        if entry.formatted or show_empty:
+            print(("%4d  %-12s  %s" % (entry.slot, entry.title, STATUS_NAMES.get(
+                entry.status, "status %02x" % entry.status))).rstrip())
+    print("%d discs, %d empty slots" % (
+        used, sum(1 for e in mmb.entries() if e.status == STATUS_UNFORMATTED)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and update an MMFS BEEB.MMB disc bundle")
+    parser.add_argument("mmb", help="the bundle, e.g. BEEB.MMB")
+    tool_log.add_arguments(parser)
+    commands = parser.add_subparsers(dest="command")
+
+    p = commands.add_parser("create", help="write an empty bundle")
+    p.add_argument("--discs", type=int, default=MAX_DISCS,
+                   help="number of slots (default %(default)d)")
+    p = commands.add_parser("list", help="list the discs in the bundle")
+    p.add_argument("--all", action="store_true", help="include empty slots")
+    p = commands.add_parser("add", help="add or replace discs")
+    p.add_argument("images", nargs="+", help=".ssd images")
+    p.add_argument("--slot", type=int, help="put the (one) image in this slot")
+    p.add_argument("--locked", action="store_true", help="mark the discs read only")
+    p = commands.add_parser("import", help="add or replace every .ssd in directories")
+    p.add_argument("directories", nargs="+")
+    p.add_argument("--locked", action="store_true", help="mark the discs read only")
+    p = commands.add_parser("extract", help="copy a disc out to an .ssd")
+    p.add_argument("slot", type=int)
+    p.add_argument("output")
+    p = commands.add_parser("remove", help="mark a slot empty")
+    p.add_argument("slot", type=int)
+    args = parser.parse_args()
+    tool_log.configure(args)
+
+    if not args.command:
+        parser.error("give a command")
+    if args.command == "create" and os.path.exists(args.mmb):
+        parser.error("%s already exists" % args.mmb)
+    if args.command == "add" and args.slot is not None and len(args.images) != 1:
+        parser.error("--slot takes one image")
+
+    writable = args.command in ("add", "import", "remove")
+    try:
+        if args.command == "create":
+            create(args.mmb, args.discs)
+            tool_log.info("Created %s with %d empty slots", args.mmb, args.discs)
+            return
+        with Mmb(args.mmb, writable) as mmb:
+            if args.command == "list":
+                list_bundle(mmb, args.all)
+            elif args.command == "extract":
+                data = mmb.read_disc(args.slot)
+                open(args.output, "wb").write(data)
+                tool_log.info("Slot %d '%s' -> %s (%d sectors)", args.slot,
+                              mmb.entry(args.slot).title, args.output, len(data) // SECTOR_SIZE)
+            elif args.command == "remove":
+                tool_log.info("Removing '%s' from slot %d", mmb.entry(args.slot).title, args.slot)
+                mmb.remove_disc(args.slot)
+            else:
+                t0 = time.time()
+                if args.command == "add":
+                    paths, slot = args.images, args.slot
+                else:
+                    paths = [fn for d in args.directories for fn in ssd_files(d)]
+                    slot = None
+                written, unchanged = add_images(mmb, paths, slot, args.locked)
+                mmb.flush()
+                tool_log.info("%d discs written, %d unchanged in %.1f ms",
+                              written, unchanged, (time.time() - t0) * 1000)
+    except MmbError as e:
+        tool_log.error("%s", e)
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
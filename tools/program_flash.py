@@ -27,15 +27,19 @@ import re
 import sys
 import time
 
+import erase_planner
+import flow_control
 import mcu_port
+import tool_log
 
 if sys.version_info < (3, 0):
     print("WARNING: This script is no longer tested under Python 2.  "
           "Running under Python 3 is highly recommended.")
 
 # Arduino USB serial ports seem to crash out if you send more than 63 (or sometimes 127)
-# bytes at a time.  The ASF version works fine with full blocks.
-usb_block_size = 1024 * 1024
+# bytes at a time.  The ASF version works fine with full blocks.  flow_control.py
+# works out what each board can take.
+MAX_RETRIES = 3
 
 # Flash sector size
 sector_size = 4096
@@ -45,7 +49,7 @@ def read_until(ser, match):
     while True:
         r = ser.read(1024)
         if r:
-            print(repr(r))
+            tool_log.debug("%r", r)
             resp += r
             if resp.find(match) != -1:
                 break
@@ -68,88 +72,201 @@ def parse_address(addr):
         return int(m.group(1), 16)
     return int(addr)
 
-def upload(rom, start_addr, length, program=True, verify=True, port=None):
+def read_result(ser):
+    # Reads until the firmware prints an OK or ERR line
+    resp = b''
+    while True:
+        resp += read_until(ser, b"\n")
+        for line in resp.split(b"\n")[:-1]:
+            line = line.strip()
+            if line == b"OK" or line.startswith(b"ERR"):
+                return resp
+
+def has_block_erase(ser):
+    # Firmware with the E (block erase) and w (write erased range) commands
+    # prompts for an address, and complains about the empty line.  Older
+    # firmware ignores the E and just says OK.
+    ser.write(b"E\n")
+    return b"erase block" in read_result(ser)
+
+def erase_block(ser, addr, size):
+    tool_log.debug("* Erase %s at %06x", erase_planner.describe_size(size), addr)
+    ser.write(b"E%d+%d\n" % (addr, size))
+    resp = read_result(ser)
+    if b"ERR" in resp:
+        raise Exception("Erase at %06x failed: %r" % (addr, resp))
+
+def program_range(ser, cmd, rom, start_addr, addr, length, flow, progress=None):
+    # Runs a 'p' (erase and program) or 'w' (program erased) command,
+    # sending the blocks the firmware asks for.  The firmware reports the
+    # checksum of each page it receives; a mismatch, or no progress for a
+    # while, raises flow_control.LinkError.  progress (a tool_log.Progress)
+    # counts acknowledged pages.
+    cmd = cmd + b"%d+%d\n" % (addr, length)
+    tool_log.debug("programming command: %r", cmd)
+    ser.write(cmd)  # program chip
+
+    input_buf = b''
+    pending = []  # checksums of pages sent but not yet acknowledged
+    last_progress = time.time()
+    while True:
+        r = ser.read(1024)
+        if r:
+            tool_log.debug("%r", r)
+            input_buf += r
+            last_progress = time.time()
+        elif pending and time.time() - last_progress > flow.stall_seconds:
+            raise flow_control.LinkError("stalled with %d pages unacknowledged" % len(pending))
+        else:
+            time.sleep(0.001)
+        while input_buf.find(b"\n") != -1:
+            p = input_buf.find(b"\n") + 1
+            line, input_buf = input_buf[:p], input_buf[p:]
+            line = line.strip()
+            tool_log.debug("parse %r", line)
+            if line == b"OK":
+                tool_log.debug("All done!")
+                return
+            if line.startswith(b"ERR"):
+                raise Exception("Programming failed: %s" % line)
+            m = re.search(br"^Checksum ([0-9a-fA-F]+)$", line)
+            if m and pending:
+                expected = pending.pop(0)
+                if int(m.group(1), 16) != expected:
+                    raise flow_control.LinkError("page checksum %s, expected %x" % (m.group(1).decode(), expected))
+                if progress:
+                    progress.update(256)
+                if not pending:
+                    flow.success()
+                continue
+            m = re.search(br"^([0-9a-f]+)\+([0-9a-f]+)$", line)
+            if not m: continue
+
+            start, size = int(m.group(1), 16), int(m.group(2), 16)
+            tool_log.debug("* Sending data from %d-%d (%d-%d in our buffer)",
+                           start, start+size, start-start_addr, start-start_addr+size)
+            blk = rom[start-start_addr:start-start_addr+size]
+            tool_log.debug("First 64 bytes: %r", blk[:64])
+            assert len(blk) == size, "Remote requested %d+%d but we only have up to %d" % (start, size, len(rom))
+            pending += [sum(bytearray(blk[i:i+256])) for i in range(0, len(blk), 256)]
+            flow.write(blk)
+            tool_log.debug("wrote %d bytes in %d byte chunks", len(blk), flow.chunk)
+            last_progress = time.time()
+
+def program_with_retries(ser, cmd, rom, start_addr, addr, length, flow, progress=None):
+    # Retries use p, which erases again: after corruption the firmware will
+    # have programmed whatever it received
+    done = progress.count if progress else 0
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return program_range(ser, cmd, rom, start_addr, addr, length, flow, progress)
+        except flow_control.LinkError as e:
+            if attempt == MAX_RETRIES:
+                raise
+            if progress:
+                progress.set(done)
+            flow.failure(e)
+            flow_control.resync(ser)
+            cmd = b"p"
+
+def read_range(ser, start_addr, length, progress=None):
+    cmd = b"r%d+%d\n" % (start_addr, length)
+    tool_log.debug("command: %r", cmd)
+    ser.write(cmd)
+    resp = b''
+    while True:
+        r = ser.read(65536)
+        if r:
+            resp += r
+            tool_log.debug("%r", r)
+            p = resp.find(b"DATA:")
+            if p != -1 and progress:
+                progress.set(min(len(resp) - (p+5), length))
+            if p != -1 and len(resp) >= p+5 + length:
+                tool_log.debug("got %d bytes", length)
+                # Wait for the checksum line, so it doesn't get mixed up
+                # with the response to the next command
+                tail = resp[p+5+length:]
+                while not re.search(br"checksum [0-9a-fA-F]+\r?\n", tail):
+                    tail += ser.read(1024)
+                    time.sleep(0.01)
+                return resp[p+5:p+5+length]
+        else:
+            time.sleep(0.001)
+
+def upload(rom, start_addr, length, program=True, verify=True, port=None,
+           compare=False, plan_only=False):
     assert not (start_addr % sector_size), "start_addr must be a multiple of %s" % sector_size
     assert not (length % sector_size), "length must be a multiple of %s" % sector_size
 
     with mcu_port.Port(port=port) as ser:
-        print("\n* Port open.  Giving it a kick, and waiting for OK.")
+        tool_log.debug("* Port open.  Giving it a kick, and waiting for OK.")
         ser.write(b"\n")
         r = read_until(ser, b"OK")
 
+        flow = flow_control.FlowControl(ser, port_name=port or ser.port)
+
         program_start_time = time.time()
+        job = None
 
         if program:
-            print("\n* Start programming process")
-            cmd = b"p%d+%d\n" % (start_addr, length)
-            print("programming command: %s" % cmd)
-            ser.write(cmd)  # program chip
-
-            input_buf = b''
-            done = 0
-            while not done:
-                input_buf += read_until(ser, b"\n")
-                while input_buf.find(b"\n") != -1:
-                    p = input_buf.find(b"\n") + 1
-                    line, input_buf = input_buf[:p], input_buf[p:]
-                    line = line.strip()
-                    print("parse",repr(line))
-                    if line == b"OK":
-                        print("All done!")
-                        done = 1
-                        break
-                    m = re.search(br"^([0-9a-f]+)\+([0-9a-f]+)$", line)
-                    if not m: continue
-
-                    start, size = int(m.group(1), 16), int(m.group(2), 16)
-                    print("* Sending data from %d-%d (%d-%d in our buffer)" % (start, start+size, start-start_addr, start-start_addr+size))
-                    blk = rom[start-start_addr:start-start_addr+size]
-                    print("First 64 bytes: %s" % repr(blk[:64]))
-                    assert len(blk) == size, "Remote requested %d+%d but we only have up to %d" % (start, size, len(rom))
-                    while len(blk):
-                        n = ser.write(blk[:usb_block_size])
-                        if n:
-                            blk = blk[n:]
-                            print("wrote %d bytes" % n)
-                        else:
-                            time.sleep(0.01)
+            current = None
+            if compare:
+                tool_log.info("* Reading the current contents, to skip unchanged sectors")
+                with tool_log.Progress(length, "compare") as progress:
+                    current = read_range(ser, start_addr, length, progress)
+            job = erase_planner.plan(start_addr, rom[:length], current)
+            tool_log.info("* Plan: %s", job.summary())
+            for line in job.lines():
+                tool_log.info("%s", line)
+            tool_log.event("plan", erases=job.erases, writes=job.writes,
+                           skipped=job.skipped, seconds=round(job.seconds(), 2))
+            if plan_only:
+                mcu_port.finish(ser)
+                return
+
+            tool_log.info("* Start programming process")
+            if not has_block_erase(ser):
+                tool_log.info("Firmware doesn't support block erases; erasing sector by sector")
+                job = None
+                with tool_log.Progress(length, "program") as progress:
+                    program_with_retries(ser, b"p", rom, start_addr, start_addr, length, flow,
+                                         progress)
+            else:
+                for addr, size in job.erases:
+                    erase_block(ser, addr, size)
+                with tool_log.Progress(sum(size for _, size in job.writes), "program") as progress:
+                    for addr, size in job.writes:
+                        program_with_retries(ser, b"w", rom, start_addr, addr, size, flow,
+                                             progress)
+            flow.save()
 
         program_end_time = time.time()
 
         if verify:
-            print("read back")
-            cmd = b"r%d+%d\n" % (start_addr, length)
-            print("command: %s" % cmd)
-            ser.write(cmd)  # program chip
-            resp = b''
-            while True:
-                r = ser.read(1024)
-                if r:
-                    resp += r
-                    print(repr(r))
-                    p = resp.find(b"DATA:")
-                    if p != -1 and len(resp) >= p+5 + length:
-                        print("got %d bytes" % length)
-                        open("readback.rom", "wb").write(resp[p+5:p+5+length])
-                        break
-                time.sleep(0.1)
+            with tool_log.Progress(length, "read back") as progress:
+                open("readback.rom", "wb").write(read_range(ser, start_addr, length, progress))
 
         readback_end_time = time.time()
 
-        ser.write(b"x")
-        time.sleep(0.5)
-        print(ser.read(1024))
+        mcu_port.finish(ser)
 
-        print("programming took %.1f s; readback took %.1f s" % (
-            program_end_time - program_start_time,
-            readback_end_time - program_end_time,
-        ))
+        tool_log.info("programming took %.1f s%s; readback took %.1f s",
+                      program_end_time - program_start_time,
+                      " (predicted %.1f s)" % job.seconds() if job else "",
+                      readback_end_time - program_end_time)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Program flash on a UEU board.')
     parser.add_argument('--port', type=str, help='Serial port to use')
+    parser.add_argument('--compare', action='store_true',
+                        help='read the flash first and skip sectors that already match')
+    parser.add_argument('--plan-only', action='store_true',
+                        help='print the erase plan and predicted time, and stop')
+    tool_log.add_arguments(parser)
     parser.add_argument('rest', nargs=argparse.REMAINDER)
     args = parser.parse_args()
+    tool_log.configure(args)
 
     filename, start_addr, length = args.rest
     start_addr = parse_address(start_addr)
@@ -159,12 +276,15 @@ if __name__ == '__main__':
     assert len(data) <= length, "file %s is %d bytes long and we only want to program %d" % (filename, len(data), length)
     if len(data) < length:
         pad = length - len(data)
-        print("padding data with %d FF bytes" % pad)
+        tool_log.info("padding data with %d FF bytes", pad)
         data += b'\xff' * pad
 
-    upload(data, start_addr, len(data), program=True, verify=True, port=args.port)
+    upload(data, start_addr, len(data), program=True, verify=True, port=args.port,
+           compare=args.compare, plan_only=args.plan_only)
+    if args.plan_only:
+        sys.exit(0)
 
     if data == open("readback.rom", "rb").read():
-        print("verified")
+        tool_log.info("verified")
     else:
         raise Exception("verification failed")
@@ -2,6 +2,7 @@ from __future__ import print_function
 
 import os, sys
 import program_flash
+import tool_log
 
 if sys.version_info < (3, 0):
     print("WARNING: This script is no longer tested under Python 2.  "
@@ -23,7 +24,7 @@ romsize = 16 * 1024
 # 3d dotty (page latch 89, RBS 0) is actually in bank 89+128 and file 89*2+1=179
 def translate(romid):
     bank = ((romid & 0x7f) << 1) | (1 if (romid & 128) else 0)
-    print("translate romid %d (%02x) -> %d (%02x)" % (romid, romid, bank, bank))
+    tool_log.debug("translate romid %d (%02x) -> %d (%02x)", romid, romid, bank, bank)
     return bank
 assert translate(0) == 0
 assert translate(1) == 2 # arcadians
@@ -42,14 +43,21 @@ def fn(romid):
     translated_romid = translate(romid)
     return '%s/../../../electron/elkjs/elkjs/mgc/mgc_%d.bin' % (HERE, translated_romid)
 
-print("programming 256 mgc roms at %d" % start_addr)
+tool_log.info("programming 256 mgc roms at %d", start_addr)
 
+# One upload for the lot, so the erase planner can use 64kB block erases; a
+# 16kB upload per rom only covers part of a block, so it only gets 4kB ones.
+roms = []
 for romid in range(256):
     romfn = fn(romid)
-    romstart = start_addr + romid * romsize
-    print("- program %s in as rom id %d" % (romfn, romid))
-    program_flash.upload(open(romfn, "rb").read(),
-                         romstart,
-                         romsize,
-                         program=True,
-                         )
+    tool_log.debug("- %s goes in as rom id %d", romfn, romid)
+    rom = open(romfn, "rb").read()
+    assert len(rom) <= romsize, "%s is %d bytes long; roms are %d" % (romfn, len(rom), romsize)
+    roms.append(rom + b"\xff" * (romsize - len(rom)))
+data = b"".join(roms)
+
+program_flash.upload(data,
+                     start_addr,
+                     len(data),
+                     program=True,
+                     )
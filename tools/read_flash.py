@@ -20,53 +20,28 @@ from __future__ import print_function
 # blocking serial comms (that would hang on the ATMEGA32U4) for Arcflash with
 # its ATSAMD21.
 
-import re
-import sys
-import time
+import argparse
 
 import mcu_port
+import program_flash
+import tool_log
 
-usb_block_size = 63
+def download(port=None, read_from=0, read_length=16384 * 16, filename="download.rom"):
+    with mcu_port.Port(port=port) as ser:
+        tool_log.debug("* Port open.  Giving it a kick, and waiting for OK.")
+        ser.write(b"\n")
+        program_flash.read_until(ser, b"OK")
 
-def read_until(ser, match):
-    resp = ''
-    while True:
-        r = ser.read(1024)
-        if r:
-            print(repr(r))
-            resp += r
-            if resp.find(match) != -1:
-                break
-            else:
-                time.sleep(0.1)
-    return resp
+        with tool_log.Progress(read_length, "read") as progress:
+            data = program_flash.read_range(ser, read_from, read_length, progress)
+        open(filename, "wb").write(data)
 
-def download():
-    with mcu_port.Port() as ser:
-        print("\n* Port open.  Giving it a kick, and waiting for OK.")
-        ser.write("\n")
-        r = read_until(ser, "OK")
-
-        read_from = 0
-        read_length = 16384 * 16
-
-        ser.write("r%d+%d\n" % (read_from, read_length))
-        resp = ''
-        while True:
-            r = ser.read(1024)
-            if r:
-                resp += r
-                print(repr(r))
-                p = resp.find("DATA:")
-                if p != -1 and len(resp) >= p+5 + read_length:
-                    print("got %d bytes" % read_length)
-                    open("download.rom", "wb").write(resp[p+5:p+5+read_length])
-                    break
-            time.sleep(0.1)
-
-        ser.write("x")
-        time.sleep(0.5)
-        print(ser.read(1024))
+        mcu_port.finish(ser)
 
 if __name__ == '__main__':
-    download()
+    parser = argparse.ArgumentParser(description='Read the flash on a UEU board into download.rom.')
+    parser.add_argument('--port', type=str, help='Serial port to use')
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+    download(port=args.port)
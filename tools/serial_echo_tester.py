@@ -20,15 +20,15 @@ from __future__ import print_function
 # blocking serial comms (that would hang on the ATMEGA32U4) for Arcflash with
 # its ATSAMD21.
 
-import re
-import sys
+import argparse
 import time
 
 import mcu_port
+import tool_log
 
 def read_timeout(ser, bytes, secs):
     now = time.time()
-    buf = ''
+    buf = b''
     while 1:
         data = ser.read(bytes - len(buf))
         buf += data
@@ -39,43 +39,53 @@ def read_timeout(ser, bytes, secs):
             break
     return buf
 
-def test_port():
-    with mcu_port.Port(baud=115200) as ser:
+def test_port(port=None):
+    with mcu_port.Port(baud=115200, port=port) as ser:
+        progress = tool_log.Progress(None, "echoed")
 
         def echo_test(x):
-            print("send %s (%d bytes long)" % (repr(x), len(x)))
+            tool_log.debug("send %r (%d bytes long)", x, len(x))
             ser.write(x)
             a = read_timeout(ser, len(x), 0.5)
-            print("got %s" % repr(a))
-            assert a == x
+            tool_log.debug("got %r", a)
+            assert a == x, "sent %d bytes, got %d back" % (len(x), len(a))
+            progress.update(len(x))
 
         # double check we're in the right mode
-        ser.write('x')
+        ser.write(b'x')
         time.sleep(0.5)
         a = ser.read()
-        print(a)
-        assert "Unlock" not in a
+        tool_log.debug("%r", a)
+        assert b"Unlock" not in a
 
         # clear buffer
         while 1:
             a = ser.read()
             if not a: break
-            print(repr(a))
+            tool_log.debug("%r", a)
 
-        while 1:
-            # test writing a bunch of single bytes
-            for x in range(256):
-                echo_test(chr(x))
+        try:
+            while 1:
+                # test writing a bunch of single bytes
+                for x in range(256):
+                    echo_test(bytes(bytearray([x])))
 
-            # test writing blocks of bytes
-            for x in range(256):
-                echo_test("this is a test")
+                # test writing blocks of bytes
+                for x in range(256):
+                    echo_test(b"this is a test")
 
-            # bigger and bigger blocks now
-            msg = ''
-            for x in range(10240):
-                msg += chr(x & 0xff)
-                echo_test(msg)
+                # bigger and bigger blocks now
+                msg = b''
+                for x in range(10240):
+                    msg += bytes(bytearray([x & 0xff]))
+                    echo_test(msg)
+        except KeyboardInterrupt:
+            progress.finish()
 
 if __name__ == '__main__':
-    test_port()
+    parser = argparse.ArgumentParser(description='Check that the serial forwarder echoes everything.')
+    parser.add_argument('--port', type=str, help='Serial port to use')
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+    test_port(args.port)
@@ -18,15 +18,15 @@ from __future__ import print_function
 
 # Send a variety of different packets over the link and see what we get back.
 
-import re
-import sys
+import argparse
 import time
 
 import mcu_port
+import tool_log
 
 def read_timeout(ser, bytes, secs):
     now = time.time()
-    buf = ''
+    buf = b''
     while 1:
         data = ser.read(bytes - len(buf))
         buf += data
@@ -38,11 +38,11 @@ def read_timeout(ser, bytes, secs):
     return buf
 
 def read_until(ser, match):
-    resp = ''
+    resp = b''
     while True:
         r = ser.read(1024)
         if r:
-            print(repr(r))
+            tool_log.debug("%r", r)
             resp += r
             if resp.find(match) != -1:
                 break
@@ -50,27 +50,37 @@ def read_until(ser, match):
                 time.sleep(0.1)
     return resp
 
-def test_port():
-    with mcu_port.Port(baud=115200) as ser:
+def test_port(port=None):
+    with mcu_port.Port(baud=115200, port=port) as ser:
+        progress = tool_log.Progress(None, "sent")
 
         def echo_test(x):
-            print("TEST: send %s (%d bytes long)" % (repr(x), len(x)))
+            tool_log.debug("TEST: send %r (%d bytes long)", x, len(x))
             ser.write(x)
-            a = read_until(ser, ";")
-            print("REPORT: %s" % a.strip())
+            a = read_until(ser, b";")
+            tool_log.info("REPORT (%d bytes sent): %s", len(x), a.strip().decode("latin-1"))
+            progress.update(len(x))
 
         # clear buffer
         while 1:
             a = ser.read()
             if not a: break
-            print(repr(a))
+            tool_log.debug("%r", a)
 
-        while 1:
-            # bigger and bigger blocks
-            msg = ''
-            for x in range(10240):
-                msg += chr(x & 0xff)
-                echo_test(msg)
+        try:
+            while 1:
+                # bigger and bigger blocks
+                msg = b''
+                for x in range(10240):
+                    msg += bytes(bytearray([x & 0xff]))
+                    echo_test(msg)
+        except KeyboardInterrupt:
+            progress.finish()
 
 if __name__ == '__main__':
-    test_port()
+    parser = argparse.ArgumentParser(description='Send packets of every size and log what the board reports.')
+    parser.add_argument('--port', type=str, help='Serial port to use')
+    tool_log.add_arguments(parser)
+    args = parser.parse_args()
+    tool_log.configure(args)
+    test_port(args.port)
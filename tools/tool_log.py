@@ -0,0 +1,197 @@
+from __future__ import print_function
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Logging and progress reporting shared by the tools.
+#
+# The tools used to print repr() of everything the firmware sent and a line
+# per block written, which on a fast link costs more than the transfer.  Now:
+#
+# - debug(), info(), warning() and error() take a format string and its
+#   arguments, and only format them if the level is enabled.  The default
+#   is INFO; -v turns on DEBUG (everything the tools used to print), -q
+#   leaves only warnings and errors.
+#
+# - Progress draws one line on stderr (bytes, %, kB/s, ETA), redrawn at
+#   most every PROGRESS_SECONDS, so update() per chunk is just an addition
+#   and a clock check.  It's only drawn on a terminal; either way, finish()
+#   logs a one line summary.
+#
+# - --json FILE ("-" for stdout, in which case messages go to stderr) writes
+#   one JSON object per line for each message and (rate limited) progress
+#   update, for scripts driving the tools.
+#
+#   parser = argparse.ArgumentParser(...)
+#   tool_log.add_arguments(parser)
+#   args = parser.parse_args()
+#   tool_log.configure(args)
+#   tool_log.debug("got %r", data)
+#   with tool_log.Progress(length, "read") as progress:
+#       progress.update(len(chunk))
+
+import json
+import sys
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+PROGRESS_SECONDS = 0.2
+BAR_WIDTH = 30
+
+_level = INFO
+_json = None
+_out = sys.stdout
+_progress = None    # the Progress currently drawn on the terminal
+
+def add_arguments(parser):
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="log every exchange with the board")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only log warnings and errors")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write events as JSON lines to FILE ('-' for stdout)")
+
+def configure(args=None, level=None, json_fn=None):
+    """Sets up logging from add_arguments' options, or explicitly."""
+    global _level, _json, _out
+    if args is not None:
+        if args.quiet:
+            level = WARNING
+        elif args.verbose:
+            level = DEBUG
+        json_fn = args.json
+    if level is not None:
+        _level = level
+    if json_fn == "-":
+        _json = sys.stdout
+        _out = sys.stderr
+    elif json_fn:
+        _json = open(json_fn, "a")
+
+def enabled(level):
+    return level >= _level
+
+def event(kind, **fields):
+    """Writes a structured event, if --json was given."""
+    if not _json:
+        return
+    fields["event"] = kind
+    fields["time"] = round(time.time(), 3)
+    _json.write(json.dumps(fields, sort_keys=True) + "\n")
+    _json.flush()
+
+def _clear_progress():
+    global _progress
+    if _progress:
+        sys.stderr.write("\r\033[K")
+        sys.stderr.flush()
+        _progress = None
+
+def log(level, fmt, *args):
+    if level < _level:
+        return
+    message = fmt % args if args else fmt
+    _clear_progress()
+    print(message, file=_out)
+    _out.flush()
+    event("log", level=LEVEL_NAMES.get(level, level), message=message)
+
+def debug(fmt, *args):
+    log(DEBUG, fmt, *args)
+
+def info(fmt, *args):
+    log(INFO, fmt, *args)
+
+def warning(fmt, *args):
+    log(WARNING, fmt, *args)
+
+def error(fmt, *args):
+    log(ERROR, fmt, *args)
+
+def _format_seconds(seconds):
+    seconds = int(seconds + 0.5)
+    return "%d:%02d" % (seconds // 60, seconds % 60)
+
+class Progress:
+    """Byte count for one transfer; total may be None if it isn't known."""
+    def __init__(self, total=None, label=""):
+        self.total = total
+        self.label = label
+        self.count = 0
+        self.start = time.time()
+        self.next_draw = self.start + PROGRESS_SECONDS
+        self.draw = _level <= INFO and sys.stderr.isatty()
+        event("progress_start", label=label, total=total)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.finish()
+        else:
+            _clear_progress()
+
+    def update(self, n):
+        self.count += n
+        now = time.time()
+        if now >= self.next_draw:
+            self._report(now)
+
+    def set(self, count):
+        """For going back, e.g. when a block has to be sent again."""
+        self.count = count
+        self.update(0)
+
+    def rate(self, now=None):
+        elapsed = (now or time.time()) - self.start
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def _report(self, now):
+        global _progress
+        self.next_draw = now + PROGRESS_SECONDS
+        rate = self.rate(now)
+        eta = (self.total - self.count) / rate if self.total and rate else None
+        event("progress", label=self.label, count=self.count, total=self.total,
+              rate=round(rate), eta=None if eta is None else round(eta, 1))
+        if not self.draw:
+            return
+        if self.total:
+            filled = min(BAR_WIDTH, BAR_WIDTH * self.count // self.total)
+            line = "%s [%s%s] %3d%% %d/%d kB %.1f kB/s ETA %s" % (
+                self.label, "#" * filled, "." * (BAR_WIDTH - filled),
+                100 * self.count // self.total, self.count // 1024, self.total // 1024,
+                rate / 1024, _format_seconds(eta) if eta is not None else "?")
+        else:
+            line = "%s %d kB %.1f kB/s" % (self.label, self.count // 1024, rate / 1024)
+        if _progress and _progress is not self:
+            _clear_progress()
+        _progress = self
+        sys.stderr.write("\r" + line + "\033[K")
+        sys.stderr.flush()
+
+    def finish(self):
+        now = time.time()
+        elapsed = now - self.start
+        if _progress is self:
+            _clear_progress()
+        event("progress_done", label=self.label, count=self.count, seconds=round(elapsed, 3))
+        info("%s: %d bytes in %.1f s (%.1f kB/s)", self.label, self.count, elapsed,
+             self.rate(now) / 1024)